@@ -0,0 +1,118 @@
+"""Encode/decode benchmark of every message type in gossip.codec, and of building
+a PEER_ANNOUNCE with the old struct.pack(...) + data compared to a (header, payload)
+tuple.
+
+Run from the main directory of the project:
+    python3 -m benchmarks.codec_benchmark
+"""
+
+from argparse import ArgumentParser
+import struct
+import time
+
+from gossip import codec
+from gossip.messages_type import PEER_ANOUNCE
+
+DATA = b"x" * 1024
+DIGESTS = [codec.announce_digest(1337, b"%d" % i) for i in range(16)]
+PEERS = [(f"10.0.{i // 256}.{i % 256}", 6001) for i in range(30)]
+ADDRESSES = [f"{host}:{port}" for host, port in PEERS]
+
+
+def join(message):
+    if type(message) is tuple:
+        return b"".join(message)
+    return message
+
+
+MESSAGES = {
+    "GOSSIP_ANNOUNCE": (
+        lambda: codec.encode_gossip_announce(4, 1337, DATA),
+        codec.decode_gossip_announce,
+    ),
+    "GOSSIP_NOTIFY": (
+        lambda: codec.encode_gossip_notify(1337),
+        codec.decode_gossip_notify,
+    ),
+    "GOSSIP_NOTIFICATION": (
+        lambda: codec.encode_gossip_notification(42, 1337, DATA),
+        codec.decode_gossip_notification,
+    ),
+    "GOSSIP_VALIDATION": (
+        lambda: codec.encode_gossip_validation(42, True),
+        codec.decode_gossip_validation,
+    ),
+    "PEER_INIT": (
+        lambda: codec.encode_peer_init(0x0123456789ABCDEF),
+        codec.decode_peer_init,
+    ),
+    "PEER_VERIFY": (
+        lambda: codec.encode_peer_verify(6001, 12345),
+        codec.decode_peer_verify,
+    ),
+    "PEER_OK": (lambda: codec.encode_peer_ok(1), codec.decode_peer_ok),
+    "PEER_ANNOUNCE": (
+        lambda: codec.encode_peer_announce(4, 1337, DATA),
+        codec.decode_peer_announce,
+    ),
+    "PEER_DISCOVER": (codec.encode_peer_discover, codec.decode_header),
+    "PEER_BROADCAST": (
+        lambda: codec.encode_peer_broadcast(ADDRESSES),
+        codec.decode_peer_broadcast,
+    ),
+    "PEER_BROADCAST_V2": (
+        lambda: codec.encode_peer_broadcast_v2(PEERS),
+        codec.decode_peer_broadcast_v2,
+    ),
+    "PEER_IHAVE": (
+        lambda: codec.encode_peer_ihave(1337, DIGESTS),
+        codec.decode_peer_ihave,
+    ),
+    "PEER_GRAFT": (
+        lambda: codec.encode_peer_graft(DIGESTS[:1]),
+        codec.decode_peer_graft,
+    ),
+    "PEER_PRUNE": (codec.encode_peer_prune, codec.decode_header),
+}
+
+
+def rate(function, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=200_000)
+    parser.add_argument(
+        "-s", "--payload-sizes", type=int, nargs="+", default=[64, 1024, 60000]
+    )
+    args = parser.parse_args()
+
+    print(f"{'message':22} {'encode/sec':>14} {'decode/sec':>14}")
+    for name, (encode, decode) in MESSAGES.items():
+        frame = memoryview(join(encode()))
+        print(
+            f"{name:22} {rate(encode, args.count):14,.0f} {rate(lambda: decode(frame), args.count):14,.0f}"
+        )
+
+    print("\nbuilding a PEER_ANNOUNCE:")
+    for size in args.payload_sizes:
+        data = b"x" * size
+
+        def concat():
+            struct.pack(">HHBBH", 8 + len(data), PEER_ANOUNCE, 4, 0, 1337) + data
+
+        def parts():
+            codec.encode_peer_announce(4, 1337, data)
+
+        print(
+            f"    {size:6} bytes: struct.pack + data {rate(concat, args.count):12,.0f}/sec"
+            f"   (header, payload) {rate(parts, args.count):12,.0f}/sec"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Throughput benchmark of reading frames from a stream, compares the old
+read(2) + read(size - 2) loop with gossip.framing.FrameReader.
+
+Run from the main directory of the project:
+    python3 -m benchmarks.framing_benchmark
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import struct
+import time
+
+from gossip.framing import FrameReader
+from gossip.messages_type import PEER_ANOUNCE
+
+
+def make_stream(frames):
+    reader = asyncio.StreamReader(limit=2**32)
+    reader.feed_data(frames)
+    reader.feed_eof()
+    return reader
+
+
+async def read_frames_old(reader, count):
+    for _ in range(count):
+        msg_size_bytes = await reader.read(2)
+        msg_size = struct.unpack(">H", msg_size_bytes)[0]
+        msg = msg_size_bytes + await reader.read(msg_size - 2)
+        if len(msg) != msg_size:
+            raise Exception("Incomplete message")
+        struct.unpack(">H", msg[2:4])
+        msg[8:]
+
+
+async def read_frames_new(reader, count):
+    frames = FrameReader(reader, 4)
+    for _ in range(count):
+        msg = await frames.read_frame()
+        struct.unpack_from(">HH", msg)
+        msg[8:]
+
+
+async def measure(read_frames, frames, count, repeat):
+    best = None
+    for _ in range(repeat):
+        reader = make_stream(frames)
+        start = time.perf_counter()
+        await read_frames(reader, count)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+async def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=200_000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[16, 256, 4096, 60000]
+    )
+    args = parser.parse_args()
+
+    for payload_size in args.sizes:
+        count = max(args.count * 256 // max(payload_size, 256), 1000)
+        frame = (
+            struct.pack(">HHBBH", 8 + payload_size, PEER_ANOUNCE, 0, 0, 1337)
+            + b"x" * payload_size
+        )
+        frames = frame * count
+        megabytes = len(frames) / 2**20
+
+        print(f"{count} frames of {len(frame)} bytes:")
+        for name, read_frames in (
+            ("read(2) + read(size - 2)", read_frames_old),
+            ("FrameReader", read_frames_new),
+        ):
+            elapsed = await measure(read_frames, frames, count, args.repeat)
+            print(
+                f"    {name:26} {count / elapsed:12,.0f} frames/sec {megabytes / elapsed:10,.1f} MiB/sec"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
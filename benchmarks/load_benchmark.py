@@ -0,0 +1,348 @@
+"""Load test of a network of gossip nodes run in one process.
+
+Starts `--nodes` Gossip instances on localhost from generated configs, each one
+bootstrapping from a random earlier node. Every node gets one API client that
+subscribes to the data type and validates every notification. `--clients` more
+API clients, spread over the nodes, send GOSSIP_ANNOUNCE messages at `--rate`
+messages per second in total for `--duration` seconds.
+
+The payload of every announce carries a sequence number and the time it was sent,
+so the subscribers measure the propagation latency of every delivery. The report
+holds the achieved throughput, latency percentiles of single deliveries and of
+reaching all nodes, the delivery ratio, the share of PEER_ANNOUNCE messages that
+were duplicates, bytes sent per announce and the memory used per node. It is
+written as JSON, with --baseline it is compared with an earlier report and the
+exit status is 1 if it regressed by more than --tolerance.
+
+Run from the main directory of the project:
+    python3 -m benchmarks.load_benchmark --nodes 8 --rate 200 --duration 10
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import json
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+
+from gossip.codec import (
+    decode_gossip_notification,
+    encode_gossip_announce,
+    encode_gossip_notify,
+    encode_gossip_validation,
+)
+from gossip.framing import FrameReader
+from gossip.gossip import Gossip
+from gossip.log import setup_logging
+
+HOST = "127.0.0.1"
+DATA_TYPE = 1337
+# sequence number and perf_counter time of sending
+PAYLOAD = struct.Struct(">Qd")
+
+CONFIG = """[global]
+hostkey = /hostkey.pem
+
+[gossip]
+cache_size = {cache_size}
+degree = {degree}
+bootstrapper = {bootstrapper}
+p2p_address = {p2p_address}
+api_address = {api_address}
+challenge_timeout = 60
+challenge_difficulty = 0
+discovery_cooldown = 1
+pow_workers = 0
+log_level = {log_level}
+{extra}
+"""
+
+
+def write_config(directory, index, bootstrap_index, args):
+    path = os.path.join(directory, f"node{index}.ini")
+    with open(path, "w") as f:
+        f.write(
+            CONFIG.format(
+                cache_size=args.cache_size,
+                degree=args.degree,
+                bootstrapper=f"{HOST}:{args.base_port + bootstrap_index}",
+                p2p_address=f"{HOST}:{args.base_port + index}",
+                api_address=f"{HOST}:{args.base_port + 1000 + index}",
+                log_level=args.log_level,
+                # extra config lines, e.g. "dissemination = plumtree"
+                extra="\n".join(args.option),
+            )
+        )
+    return path
+
+
+def rss_bytes():
+    """resident memory of the process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # peak instead of current memory, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {
+        f"p{p}": values[min(len(values) - 1, len(values) * p // 100)]
+        for p in (50, 90, 99)
+    }
+    result["max"] = values[-1]
+    result["mean"] = sum(values) / len(values)
+    return result
+
+
+class Results:
+    """Deliveries seen by the subscribers"""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.published = 0
+        # key: sequence number, value: number of nodes that delivered it
+        self.delivered = {}
+        self.seen = set()
+        self.latencies = []
+        # time until a message was delivered on all nodes
+        self.coverage_latencies = []
+        self.duplicates = 0
+
+    def deliver(self, node, sequence, latency):
+        if (node, sequence) in self.seen:
+            self.duplicates += 1
+            return
+        self.seen.add((node, sequence))
+        self.latencies.append(latency)
+        count = self.delivered.get(sequence, 0) + 1
+        self.delivered[sequence] = count
+        if count == self.nodes:
+            self.coverage_latencies.append(latency)
+
+
+async def subscribe(node, port, results):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(encode_gossip_notify(DATA_TYPE))
+    frames = FrameReader(reader, 8)
+    while True:
+        msg = await frames.read_frame()
+        now = time.perf_counter()
+        message_id, _, data = decode_gossip_notification(msg)
+        sequence, sent = PAYLOAD.unpack_from(data)
+        results.deliver(node, sequence, now - sent)
+        if message_id != 0:
+            writer.write(encode_gossip_validation(message_id, True))
+
+
+async def publish(port, rate, duration, args, results):
+    """send `rate` announces per second for `duration` seconds"""
+    _, writer = await asyncio.open_connection(HOST, port)
+    padding = b"\0" * max(args.size - PAYLOAD.size, 0)
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        for _ in range(int(rate * elapsed) - sent):
+            sequence = results.published
+            results.published += 1
+            data = PAYLOAD.pack(sequence, time.perf_counter()) + padding
+            writer.writelines(encode_gossip_announce(args.ttl, DATA_TYPE, data))
+            sent += 1
+        await writer.drain()
+        await asyncio.sleep(0.005)
+    await writer.drain()
+    writer.close()
+
+
+def node_totals(nodes):
+    """duplicate ratio and bytes sent, summed over the nodes"""
+    hits = lookups = bytes_sent = 0
+    for node in nodes:
+        cache = node.cache.stats()
+        hits += cache["hits"]
+        lookups += cache["hits"] + cache["misses"]
+        bytes_sent += sum(node.metrics.bytes_out.values())
+    return hits, lookups, bytes_sent
+
+
+async def run(args):
+    random.seed(args.seed)
+    rss_start = rss_bytes()
+
+    directory = tempfile.mkdtemp(prefix="gossip-load-")
+    nodes = []
+    tasks = []
+    for i in range(args.nodes):
+        # the first node dials the second one before it is started and waits for
+        # the others to connect
+        bootstrap_index = random.randrange(i) if i else 1
+        nodes.append(Gossip(write_config(directory, i, bootstrap_index, args)))
+        tasks.append(asyncio.create_task(nodes[-1].run()))
+        await asyncio.sleep(args.start_interval)
+
+    target_degree = min(args.degree, args.nodes - 1)
+    deadline = time.perf_counter() + args.warmup
+    while time.perf_counter() < deadline:
+        if all(len(node.p2p_connections) >= target_degree for node in nodes):
+            break
+        await asyncio.sleep(0.1)
+    degrees = [len(node.p2p_connections) for node in nodes]
+    rss_started = rss_bytes()
+
+    results = Results(args.nodes)
+    tasks += [
+        asyncio.create_task(subscribe(i, args.base_port + 1000 + i, results))
+        for i in range(args.nodes)
+    ]
+    await asyncio.sleep(0.5)
+
+    hits_before, lookups_before, bytes_before = node_totals(nodes)
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            publish(
+                args.base_port + 1000 + i % args.nodes,
+                args.rate / args.clients,
+                args.duration,
+                args,
+                results,
+            )
+            for i in range(args.clients)
+        )
+    )
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+    hits, lookups, bytes_sent = node_totals(nodes)
+    hits -= hits_before
+    lookups -= lookups_before
+    bytes_sent -= bytes_before
+
+    rss_end = rss_bytes()
+    for task in tasks:
+        task.cancel()
+
+    deliveries = len(results.latencies)
+    expected = results.published * args.nodes
+    return {
+        "parameters": vars(args),
+        "nodes": args.nodes,
+        "degrees": {
+            "min": min(degrees),
+            "mean": sum(degrees) / len(degrees),
+            "max": max(degrees),
+        },
+        "published": results.published,
+        "publish_rate": results.published / args.duration,
+        "deliveries": deliveries,
+        "deliveries_per_second": deliveries / elapsed,
+        "delivery_ratio": deliveries / expected if expected else 0,
+        "fully_delivered": len(results.coverage_latencies),
+        "latency": percentiles(results.latencies),
+        "coverage_latency": percentiles(results.coverage_latencies),
+        "duplicate_ratio": hits / lookups if lookups else 0,
+        "duplicate_notifications": results.duplicates,
+        "bytes_sent_per_announce": (
+            bytes_sent / results.published if results.published else 0
+        ),
+        "memory": {
+            "rss_start": rss_start,
+            "rss_started": rss_started,
+            "rss_end": rss_end,
+            "per_node": (rss_end - rss_start) / args.nodes,
+        },
+    }
+
+
+# (path in the report, True if higher is better)
+COMPARED = (
+    (("deliveries_per_second",), True),
+    (("delivery_ratio",), True),
+    (("latency", "p99"), False),
+    (("coverage_latency", "p99"), False),
+    (("duplicate_ratio",), False),
+    (("memory", "per_node"), False),
+)
+
+
+def lookup(report, path):
+    for key in path:
+        if report is None:
+            return None
+        report = report.get(key)
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """regressions of `report` against `baseline` by more than `tolerance`"""
+    regressions = []
+    for path, higher_is_better in COMPARED:
+        new, old = lookup(report, path), lookup(baseline, path)
+        if not new or not old:
+            continue
+        change = (new - old) / old
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{'.'.join(path)}: {old:.6g} -> {new:.6g}")
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--nodes", type=int, default=8)
+    parser.add_argument("-d", "--degree", type=int, default=4)
+    parser.add_argument("-c", "--clients", type=int, default=4)
+    parser.add_argument("-r", "--rate", type=float, default=200)
+    parser.add_argument("-t", "--duration", type=float, default=10)
+    parser.add_argument("-s", "--size", type=int, default=64)
+    parser.add_argument("--ttl", type=int, default=0)
+    parser.add_argument("--cache-size", type=int, default=100_000)
+    parser.add_argument("--base-port", type=int, default=16000)
+    parser.add_argument("--start-interval", type=float, default=0.05)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--drain", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument(
+        "-o",
+        "--option",
+        action="append",
+        default=[],
+        help='extra config line for all nodes, e.g. "dissemination = plumtree"',
+    )
+    parser.add_argument("--output", help="file the JSON report is written to")
+    parser.add_argument("--baseline", help="earlier report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # the report goes to stdout, logs to stderr
+    setup_logging(args.log_level, sys.stderr)
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
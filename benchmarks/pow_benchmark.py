@@ -0,0 +1,56 @@
+"""Microbenchmark of the PEER_INIT nonce search, reports hashes/sec of the old
+hexdigest based search and of gossip.pow.search_nonce_range.
+
+Run from the main directory of the project:
+    python3 -m benchmarks.pow_benchmark
+"""
+
+from argparse import ArgumentParser
+import hashlib
+import time
+
+from gossip.pow import search_nonce_range
+
+CHALLENGE = (0x0123456789ABCDEF).to_bytes(8, "big")
+LISTENING_PORT_BYTES = (6001).to_bytes(2, "big")
+
+
+def hexdigest_search(challenge, listening_port_bytes, difficulty, start, end):
+    """The search handle_peer_init used to run, difficulty in hex digits"""
+    for trial in range(start, end):
+        hash = hashlib.sha256(
+            (challenge + trial.to_bytes(8, "big") + listening_port_bytes)
+        ).hexdigest()
+
+        if hash[:difficulty] == "0" * difficulty:
+            return trial
+    return None
+
+
+def measure(search, difficulty, trials, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # a difficulty no digest meets makes the search try every nonce of the range
+        search(CHALLENGE, LISTENING_PORT_BYTES, difficulty, 0, trials)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return trials / best
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--trials", type=int, default=500_000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    old = measure(hexdigest_search, 64, args.trials, args.repeat)
+    new = measure(search_nonce_range, 256, args.trials, args.repeat)
+
+    print(f"hexdigest prefix search:  {old:12,.0f} hashes/sec")
+    print(f"midstate + digest bits:   {new:12,.0f} hashes/sec")
+    print(f"speedup:                  {new / old:12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
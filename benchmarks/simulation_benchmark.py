@@ -0,0 +1,412 @@
+"""Simulation of a large gossip network on a virtual clock (see gossip.simulation).
+
+`--nodes` nodes join one after the other, each bootstrapping from a random node
+that is up, and every node gets an API client that subscribes to the data type
+and validates every notification. Once the overlay settled `--messages`
+announces are published at random nodes, while `--churn` of the nodes are
+replaced every `--churn-interval` seconds: killed and restarted with an empty
+state after `--downtime` seconds.
+
+For every combination of the --degree, --cache-size and --ttl values the report
+holds how the overlay converged, the coverage of the announces (share of the
+nodes that were up when an announce was published and got it), the time until
+an announce reached 50%, 90% and all of them, and the redundancy, the PEER_ANNOUNCE
+messages delivered per node that got a new announce. All times are virtual
+seconds. The report is written as JSON, a run only depends on --seed.
+
+Run from the main directory of the project:
+    python3 -m benchmarks.simulation_benchmark --nodes 10000 --degree 4 6 8
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import contextvars
+import copy
+import itertools
+import json
+import os
+import random
+import resource
+import struct
+import sys
+import tempfile
+import time
+
+from gossip.codec import (
+    decode_gossip_notification,
+    encode_gossip_announce,
+    encode_gossip_notify,
+    encode_gossip_validation,
+)
+from gossip.config import Config
+from gossip.framing import FrameReader
+from gossip.gossip import Gossip
+from gossip.log import setup_logging
+from gossip.messages_type import PEER_ANOUNCE
+from gossip.simulation import Network, SimulatedLoop, current_host
+
+P2P_PORT = 6001
+API_PORT = 7001
+DATA_TYPE = 1337
+SEQUENCE = struct.Struct(">Q")
+
+CONFIG = """[global]
+hostkey = /hostkey.pem
+
+[gossip]
+cache_size = 1000
+degree = 8
+bootstrapper = 10.0.0.1:{p2p_port}
+p2p_address = 10.0.0.1:{p2p_port}
+api_address = 10.0.0.1:{api_port}
+challenge_timeout = 3600
+challenge_difficulty = 0
+discovery_cooldown = {discovery_cooldown}
+pow_workers = 0
+log_level = {log_level}
+read_buffer_size = 512
+send_queue_size = 256
+{extra}
+"""
+
+
+def host_of(index):
+    return f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    result = {
+        f"p{p}": values[min(len(values) - 1, len(values) * p // 100)]
+        for p in (50, 90, 99)
+    }
+    result["max"] = values[-1]
+    result["mean"] = sum(values) / len(values)
+    return result
+
+
+class Announce:
+    """A published announce and the nodes it reached"""
+
+    __slots__ = ("published", "targets", "delivered")
+
+    def __init__(self, published, targets):
+        self.published = published
+        # nodes that were subscribed when it was published
+        self.targets = targets
+        # key: host, value: virtual time of the notification
+        self.delivered = {}
+
+
+class Simulation:
+
+    def __init__(self, args, config, degree, cache_size, ttl):
+        self.args = args
+        self.ttl = ttl
+        self.config = copy.copy(config)
+        self.config.degree = degree
+        self.config.cache_size = cache_size
+
+        self.random = random.Random(args.seed)
+        self.network = Network(args.seed, args.latency, args.jitter, args.loss)
+        self.loop = SimulatedLoop(self.network)
+
+        # key: host, value: Gossip of the running nodes
+        self.nodes = {}
+        # hosts of the running nodes, to pick bootstrappers from
+        self.up = []
+        # key: host, value: index of its node
+        self.indexes = {}
+        # key: host, value: writer of its subscribed API client
+        self.subscribers = {}
+        self.announces = []
+        self.duplicates = 0
+        self.restarts = 0
+
+    def start_node(self, index):
+        host = host_of(index)
+        self.indexes[host] = index
+        config = copy.copy(self.config)
+        config.p2p_address = f"{host}:{P2P_PORT}"
+        config.api_address = f"{host}:{API_PORT}"
+        if self.nodes:
+            bootstrapper = self.random.choice(self.up)
+            config.bootstrapper = f"{bootstrapper}:{P2P_PORT}"
+        else:
+            # nothing is listening there, the first node waits for the others
+            config.bootstrapper = f"{host}:1"
+
+        context = contextvars.copy_context()
+        context.run(current_host.set, host)
+        node = context.run(Gossip, config)
+        self.nodes[host] = node
+        self.up.append(host)
+        self.loop.create_task(node.run(), context=context)
+        self.loop.create_task(self.subscribe(host), context=context)
+
+    def close(self):
+        """cancel the tasks of all nodes and close the loop"""
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def kill_node(self, host):
+        del self.nodes[host]
+        self.up.remove(host)
+        self.subscribers.pop(host, None)
+        self.network.kill(host)
+
+    async def subscribe(self, host):
+        # the API server of the node is started in the same step
+        await asyncio.sleep(0.001)
+        reader, writer = await asyncio.open_connection(host, API_PORT)
+        writer.write(encode_gossip_notify(DATA_TYPE))
+        self.subscribers[host] = writer
+
+        frames = FrameReader(reader, 8, 512)
+        while True:
+            msg = await frames.read_frame()
+            message_id, _, data = decode_gossip_notification(msg)
+            self.deliver(host, SEQUENCE.unpack_from(data)[0])
+            if message_id != 0:
+                writer.write(encode_gossip_validation(message_id, True))
+
+    def deliver(self, host, sequence):
+        delivered = self.announces[sequence].delivered
+        if host in delivered:
+            self.duplicates += 1
+        else:
+            delivered[host] = self.loop.time()
+
+    def publish(self):
+        host = self.random.choice(list(self.subscribers))
+        sequence = len(self.announces)
+        self.announces.append(Announce(self.loop.time(), len(self.subscribers)))
+        # local subscribers other than the sender are notified, so it is
+        # delivered to the publishing node right away
+        self.deliver(host, sequence)
+        data = SEQUENCE.pack(sequence) + b"\0" * max(self.args.size - 8, 0)
+        self.subscribers[host].writelines(
+            encode_gossip_announce(self.ttl, DATA_TYPE, data)
+        )
+
+    def degrees(self):
+        return [len(node.p2p_connections) for node in self.nodes.values()]
+
+    def components(self):
+        """sizes of the connected parts of the overlay, largest first"""
+        seen = set()
+        sizes = []
+        for host in self.nodes:
+            if host in seen:
+                continue
+            seen.add(host)
+            stack = [host]
+            size = 0
+            while stack:
+                size += 1
+                for connection in self.nodes[stack.pop()].p2p_connections:
+                    if connection.address not in seen:
+                        seen.add(connection.address)
+                        stack.append(connection.address)
+            sizes.append(size)
+        return sorted(sizes, reverse=True)
+
+    async def churn(self):
+        while True:
+            await asyncio.sleep(self.args.churn_interval)
+            count = round(self.args.churn * len(self.nodes))
+            for host in self.random.sample(sorted(self.nodes), count):
+                self.kill_node(host)
+                self.loop.call_later(
+                    self.args.downtime, self.start_node, self.indexes[host]
+                )
+                self.restarts += 1
+
+    async def run(self):
+        args = self.args
+        target = min(self.config.degree, args.nodes - 1)
+
+        # join phase, sampling the overlay every second
+        connected_time = full_degree_time = None
+
+        def sample():
+            nonlocal connected_time, full_degree_time
+            degrees = self.degrees()
+            if len(degrees) < args.nodes:
+                return
+            now = self.loop.time()
+            if connected_time is None and min(degrees) >= 1:
+                connected_time = now
+            if full_degree_time is None:
+                full = sum(1 for d in degrees if d >= target)
+                if full >= args.full_degree_share * len(degrees):
+                    full_degree_time = now
+
+        for i in range(args.nodes):
+            self.start_node(i)
+            await asyncio.sleep(args.join_interval)
+        joined = self.loop.time()
+        while self.loop.time() < joined + args.settle:
+            sample()
+            await asyncio.sleep(1)
+        degrees = self.degrees()
+        components = self.components()
+        overlay = {
+            "joined": joined,
+            "connected_time": (
+                None if connected_time is None else connected_time - joined
+            ),
+            "full_degree_time": (
+                None if full_degree_time is None else full_degree_time - joined
+            ),
+            "degrees": percentiles(degrees),
+            "isolated": degrees.count(0),
+            "components": len(components),
+            "largest_component": components[0],
+        }
+
+        # message phase with churn
+        delivered_before = self.network.delivered.get(PEER_ANOUNCE, 0)
+        churn = None
+        if args.churn > 0:
+            churn = asyncio.create_task(self.churn())
+        for _ in range(args.messages):
+            # nothing is published while no subscriber is connected
+            if self.subscribers:
+                self.publish()
+            await asyncio.sleep(args.message_interval)
+        if churn is not None:
+            churn.cancel()
+        await asyncio.sleep(args.drain)
+
+        announce_frames = self.network.delivered.get(PEER_ANOUNCE, 0) - delivered_before
+        return self.report(overlay, announce_frames)
+
+    def report(self, overlay, frames):
+        coverages = []
+        half_times = []
+        most_times = []
+        full_times = []
+        new_deliveries = 0
+        for announce in self.announces:
+            times = sorted(t - announce.published for t in announce.delivered.values())
+            new_deliveries += len(times) - 1
+            coverages.append(min(len(times) / announce.targets, 1))
+            for share, results in ((0.5, half_times), (0.9, most_times)):
+                needed = max(int(share * announce.targets), 1)
+                if len(times) >= needed:
+                    results.append(times[needed - 1])
+            if len(times) >= announce.targets:
+                full_times.append(times[announce.targets - 1])
+
+        return {
+            "degree": self.config.degree,
+            "cache_size": self.config.cache_size,
+            "ttl": self.ttl,
+            "overlay": overlay,
+            "announces": len(self.announces),
+            "coverage": percentiles(coverages),
+            "fully_covered": (
+                len(full_times) / len(self.announces) if self.announces else None
+            ),
+            "time_to_50_percent": percentiles(half_times),
+            "time_to_90_percent": percentiles(most_times),
+            "time_to_all": percentiles(full_times),
+            "redundancy": frames / new_deliveries if new_deliveries else None,
+            "duplicate_notifications": self.duplicates,
+            "restarts": self.restarts,
+            "network": self.network.stats(),
+        }
+
+
+def read_config(args):
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+        f.write(
+            CONFIG.format(
+                p2p_port=P2P_PORT,
+                api_port=API_PORT,
+                discovery_cooldown=args.discovery_cooldown,
+                log_level=args.log_level,
+                extra="\n".join(args.option),
+            )
+        )
+    try:
+        return Config(f.name)
+    finally:
+        os.remove(f.name)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--nodes", type=int, default=1000)
+    parser.add_argument("-d", "--degree", type=int, nargs="+", default=[8])
+    parser.add_argument("--cache-size", type=int, nargs="+", default=[1000])
+    parser.add_argument("--ttl", type=int, nargs="+", default=[0])
+    parser.add_argument("-m", "--messages", type=int, default=100)
+    parser.add_argument("--message-interval", type=float, default=0.1)
+    parser.add_argument("-s", "--size", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--churn", type=float, default=0.0)
+    parser.add_argument("--churn-interval", type=float, default=10)
+    parser.add_argument("--downtime", type=float, default=5)
+    parser.add_argument("--join-interval", type=float, default=0.01)
+    parser.add_argument("--settle", type=float, default=30)
+    parser.add_argument("--full-degree-share", type=float, default=0.95)
+    parser.add_argument("--drain", type=float, default=10)
+    parser.add_argument("--discovery-cooldown", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="CRITICAL")
+    parser.add_argument(
+        "-o",
+        "--option",
+        action="append",
+        default=[],
+        help='extra config line for all nodes, e.g. "dissemination = plumtree"',
+    )
+    parser.add_argument("--output", help="file the JSON report is written to")
+    args = parser.parse_args()
+
+    setup_logging(args.log_level, sys.stderr)
+    config = read_config(args)
+
+    reports = []
+    for degree, cache_size, ttl in itertools.product(
+        args.degree, args.cache_size, args.ttl
+    ):
+        # the nodes draw from the random module, seeded for every run
+        random.seed(args.seed)
+        simulation = Simulation(args, config, degree, cache_size, ttl)
+        started = time.perf_counter()
+        try:
+            report = simulation.loop.run_until_complete(simulation.run())
+        finally:
+            simulation.close()
+        report["wall_seconds"] = time.perf_counter() - started
+        # peak of the process, in KiB on Linux
+        report["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        reports.append(report)
+        coverage = report["coverage"]
+        coverage = f"{coverage['mean']:.4f}" if coverage else "n/a"
+        print(
+            f"degree {degree}, cache_size {cache_size}, ttl {ttl}: "
+            f"coverage {coverage} in {report['wall_seconds']:.1f}s",
+            file=sys.stderr,
+        )
+
+    text = json.dumps({"parameters": vars(args), "runs": reports}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
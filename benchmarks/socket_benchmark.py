@@ -0,0 +1,207 @@
+"""Benchmark of the event loop and socket options over loopback TCP.
+
+Every configuration is compared with the baseline, a server and client started
+with plain asyncio.start_server and asyncio.open_connection (listen backlog 100,
+TCP_NODELAY set by asyncio on TCP transports, OS default buffers). The other
+configurations go through gossip.sockets:
+    - defaults: the default options of the config, listen backlog 1024
+    - tcp_nodelay off: disables the TCP_NODELAY that asyncio sets
+    - buffers: --buffer-size bytes SO_SNDBUF and SO_RCVBUF
+    - uvloop: the uvloop event loop with the defaults, if it is installed
+and measure
+    - round trips: the client sends a 64 byte GOSSIP_NOTIFICATION as header and
+      payload in two writes, the server answers with a GOSSIP_VALIDATION, the
+      pattern of notifying a subscriber and waiting for its validation, for
+      --duration seconds
+    - throughput: the client streams PEER_ANNOUNCE frames, the server reads them
+      with the FrameReader of the connections
+    - connect burst: --connections clients connect at the same time, the time
+      until all of them are connected depends on the listen backlog
+
+SO_REUSEPORT is not measured, it only matters with several processes listening
+on the same port (see the workers option).
+
+Run from the main directory of the project:
+    python3 -m benchmarks.socket_benchmark
+"""
+
+from argparse import ArgumentParser
+import asyncio
+import importlib.util
+import resource
+import struct
+from types import SimpleNamespace
+import time
+
+from gossip.framing import FrameReader
+from gossip.messages_type import GOSSIP_NOTIFICATION, GOSSIP_VALIDATION, PEER_ANOUNCE
+from gossip.sockets import install_event_loop, open_connection, start_server
+
+HOST = "127.0.0.1"
+
+NOTIFICATION_HEADER = struct.pack(">HHHH", 8 + 64, GOSSIP_NOTIFICATION, 1, 1337)
+NOTIFICATION_PAYLOAD = b"x" * 64
+VALIDATION = struct.pack(">HHHBB", 8, GOSSIP_VALIDATION, 1, 0, 1)
+
+
+async def listen(client_connected_cb, port, config):
+    """the baseline has no config"""
+    if config is None:
+        return await asyncio.start_server(client_connected_cb, HOST, port)
+    return await start_server(client_connected_cb, HOST, port, config)
+
+
+async def connect(port, config):
+    if config is None:
+        return await asyncio.open_connection(HOST, port)
+    return await open_connection(HOST, port, config)
+
+
+async def round_trips(config, port, duration):
+    closed = asyncio.get_running_loop().create_future()
+
+    async def answer_notifications(reader, writer):
+        frames = FrameReader(reader, 4)
+        try:
+            while True:
+                await frames.read_frame()
+                writer.write(VALIDATION)
+        except ConnectionError:
+            writer.close()
+            closed.set_result(None)
+
+    server = await listen(answer_notifications, port, config)
+    reader, writer = await connect(port, config)
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        writer.write(NOTIFICATION_HEADER)
+        writer.write(NOTIFICATION_PAYLOAD)
+        await reader.readexactly(len(VALIDATION))
+        count += 1
+    elapsed = time.perf_counter() - start
+    writer.close()
+    await closed
+    server.close()
+    return count / elapsed
+
+
+async def throughput(config, port, count, payload_size):
+    received = asyncio.get_running_loop().create_future()
+
+    async def read_frames(reader, writer):
+        frames = FrameReader(reader, 4)
+        for _ in range(count):
+            await frames.read_frame()
+        received.set_result(time.perf_counter())
+        writer.close()
+
+    frame = (
+        struct.pack(">HHBBH", 8 + payload_size, PEER_ANOUNCE, 0, 0, 1337)
+        + b"x" * payload_size
+    )
+    server = await listen(read_frames, port, config)
+    _, writer = await connect(port, config)
+    start = time.perf_counter()
+    # the send queue writes everything that was queued with one writelines call
+    batch = 64
+    for sent in range(0, count, batch):
+        writer.writelines([frame] * min(batch, count - sent))
+        await writer.drain()
+    end = await received
+    writer.close()
+    server.close()
+    return count * len(frame) / (end - start) / 2**20
+
+
+async def connect_burst(config, port, count):
+    """seconds until `count` simultaneous connects completed, and the failed ones"""
+    accepted = []
+
+    async def on_connection(reader, writer):
+        accepted.append(writer)
+
+    server = await listen(on_connection, port, config)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(connect(port, config) for _ in range(count)), return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    failed = 0
+    for result in results:
+        if isinstance(result, Exception):
+            failed += 1
+        else:
+            result[1].close()
+    await asyncio.sleep(0.1)
+    for writer in accepted:
+        writer.close()
+    server.close()
+    return elapsed, failed
+
+
+def run(loop_name, config, args):
+    install_event_loop(loop_name)
+    try:
+        trips = asyncio.run(round_trips(config, args.port, args.duration))
+        mib = asyncio.run(
+            throughput(config, args.port + 1, args.frames, args.payload_size)
+        )
+        burst, failed = asyncio.run(
+            connect_burst(config, args.port + 2, args.connections)
+        )
+    finally:
+        asyncio.set_event_loop_policy(None)
+    return trips, mib, burst, failed
+
+
+def gossip_config(nodelay=True, buffer_size=0):
+    return SimpleNamespace(
+        tcp_nodelay=nodelay,
+        reuse_port=False,
+        listen_backlog=1024,
+        socket_send_buffer=buffer_size,
+        socket_receive_buffer=buffer_size,
+    )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-d", "--duration", type=float, default=3)
+    parser.add_argument("-f", "--frames", type=int, default=200_000)
+    parser.add_argument("-s", "--payload-size", type=int, default=512)
+    parser.add_argument("-b", "--buffer-size", type=int, default=2**20)
+    parser.add_argument("-c", "--connections", type=int, default=1000)
+    parser.add_argument("-p", "--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    # both ends of every connection of the burst are open at the same time
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < 2 * args.connections + 64:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    configurations = [
+        ("baseline", "asyncio", None),
+        ("defaults", "asyncio", gossip_config()),
+        ("tcp_nodelay off", "asyncio", gossip_config(nodelay=False)),
+        ("buffers", "asyncio", gossip_config(buffer_size=args.buffer_size)),
+    ]
+    if importlib.util.find_spec("uvloop") is not None:
+        configurations.append(("uvloop", "uvloop", gossip_config()))
+    else:
+        print("uvloop is not installed, only the asyncio event loop is measured")
+
+    # the first measurement of a process is slower, warm up with the baseline
+    asyncio.run(round_trips(None, args.port, 1))
+
+    print(
+        f"{'configuration':18} {'round trips/sec':>16} {'MiB/sec':>10} "
+        f"{'burst seconds':>14} {'failed':>7}"
+    )
+    for name, loop_name, config in configurations:
+        trips, mib, burst, failed = run(loop_name, config, args)
+        print(f"{name:18} {trips:16,.0f} {mib:10,.1f} {burst:14.3f} {failed:7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Periodic anti-entropy exchange that repairs announces a peer has missed.
+
+Every anti_entropy_interval seconds a random peer supporting the exchange gets a
+PEER_DIGEST with the data types and digests of the announces we forwarded most
+recently. The peer answers with a PEER_REQUEST for the digests it has not seen and
+has subscribers for, and gets those announces as normal PEER_ANNOUNCE messages. At
+most anti_entropy_max_digests digests are offered and anti_entropy_max_bytes of
+payload are sent per exchange, which bounds the bandwidth used."""
+
+from itertools import islice
+import random
+
+from gossip.batching import join_messages
+from gossip.codec import (
+    MAX_DIGEST_ENTRIES,
+    encode_peer_announce,
+    encode_peer_digest,
+    encode_peer_request,
+)
+from gossip.log import P2P as log
+from gossip.messages_type import FEATURE_ANTI_ENTROPY
+
+
+class AntiEntropy:
+
+    def __init__(self, gossip):
+        self.gossip = gossip
+        config = gossip.config
+        self.interval = config.anti_entropy_interval
+        self.max_digests = min(config.anti_entropy_max_digests, MAX_DIGEST_ENTRIES)
+        self.max_bytes = config.anti_entropy_max_bytes
+        # features we advertise to peers
+        self.features = FEATURE_ANTI_ENTROPY if self.interval > 0 else 0
+
+        self.exchanges = 0
+        self.requested = 0
+        self.repaired_sent = 0
+
+    def exchange(self):
+        """offer the digests of recent announces to a random peer"""
+        peers = [
+            connection
+            for connection in self.gossip.p2p_connections
+            if connection.features & FEATURE_ANTI_ENTROPY
+        ]
+        payloads = self.gossip.dissemination.payloads
+        if not peers or not payloads:
+            return
+
+        connection = random.choice(peers)
+        entries = [
+            (data_type, digest)
+            for digest, (_, data_type, _) in islice(
+                reversed(payloads.items()), self.max_digests
+            )
+        ]
+        log.debug(
+            "Sending PEER_DIGEST with %s digests to %s:%s",
+            len(entries),
+            connection.address,
+            connection.listening_port,
+        )
+        connection.send(encode_peer_digest(entries))
+        self.exchanges += 1
+
+    def on_digest(self, connection, entries):
+        """request the offered announces we have not seen and have subscribers for"""
+        gossip = self.gossip
+        cache = gossip.cache
+        missing = [
+            digest
+            for data_type, digest in entries[: self.max_digests]
+            if digest not in cache and gossip.has_subscribers(data_type)
+        ]
+        if not missing:
+            return
+        log.debug(
+            "Requesting %s missed announces from %s:%s",
+            len(missing),
+            connection.address,
+            connection.listening_port,
+        )
+        connection.send(encode_peer_request(missing))
+        self.requested += len(missing)
+
+    def on_request(self, connection, digests):
+        """send the requested announces, at most max_bytes of payload"""
+        dissemination = self.gossip.dissemination
+        messages = []
+        budget = self.max_bytes
+        for digest in digests:
+            payload = dissemination.payload(digest)
+            if payload is None:
+                continue
+            budget -= len(payload[2])
+            if budget < 0:
+                break
+            messages.append(encode_peer_announce(*payload))
+        if messages:
+            connection.send(join_messages(messages), len(messages))
+            self.repaired_sent += len(messages)
+
+    def stats(self):
+        return {
+            "exchanges": self.exchanges,
+            "requested": self.requested,
+            "repaired_sent": self.repaired_sent,
+        }
@@ -1,13 +1,23 @@
-import struct
-import hexdump
+import asyncio
+
+from gossip.batching import create_batcher, join_messages
+from gossip.codec import (
+    decode_gossip_announce,
+    decode_gossip_notify,
+    decode_gossip_validation,
+    decode_header,
+    encode_gossip_notification,
+    announce_digest,
+)
+from gossip.framing import FrameReader
+from gossip.log import API as log, log_payload
+from gossip.send_queue import SendQueue
 
 
 from gossip.messages_type import (
     GOSSIP_ANNOUNCE,
     GOSSIP_NOTIFY,
     GOSSIP_VALIDATION,
-    PEER_ANOUNCE,
-    GOSSIP_NOTIFICATION,
 )
 
 
@@ -17,56 +27,101 @@ class APIConnection:
         self.gossip = gossip
         self.reader = reader
         self.writer = writer
+        # messages are at least 8 bytes long
+        self.frames = FrameReader(reader, 8, gossip.config.read_buffer_size)
 
         peername = writer.get_extra_info("peername")
         self.address = peername[0]
         self.port = peername[1]
 
+        self.send_queue = SendQueue(
+            f"API {self.address}:{self.port}",
+            writer,
+            gossip.config.send_queue_size,
+            gossip.config.send_queue_policy,
+            self.close_connection,
+            gossip.metrics,
+        )
+
+        # GOSSIP_NOTIFICATION messages coalesced into one write, None if disabled
+        self.notifications = create_batcher(
+            gossip.config,
+            lambda messages: self.send(join_messages(messages), len(messages)),
+        )
+
+    def send(self, message, count=1):
+        """queue a message to be sent to the connection without waiting for it,
+        `count` is the number of messages joined into it"""
+        return self.send_queue.put(message, count)
+
+    def notify(self, message):
+        """send a GOSSIP_NOTIFICATION, batched with others if batching is enabled"""
+        if self.notifications is None:
+            return self.send(message)
+        self.notifications.add(message)
+        return True
+
     async def close_connection(self):
-        print(f"[-][API] Closing connection with {self.address}:{self.port}")
+        log.info("Closing connection with %s:%s", self.address, self.port)
+        self.send_queue.close()
+        if self.notifications is not None:
+            self.notifications.close()
         self.writer.close()
-        async with self.gossip.api_connections_lock:
-            if self in self.gossip.api_connections:
-                self.gossip.api_connections.remove(self)
-
-        async with self.gossip.subscriptions_lock:
-            for data_type in self.gossip.subscriptions:
-                if self in self.gossip.subscriptions[data_type]:
-                    self.gossip.subscriptions[data_type].remove(self)
-                    print(
-                        f"[+] Removed {self.address}:{self.port} from list of subscribers of data type: ${data_type}"
-                    )
+        self.gossip.api_connections.remove(self)
+
+        left = self.gossip.subscriptions.unsubscribe_all(self)
+        for data_type in left:
+            log.info(
+                "Removed %s:%s from list of subscribers of data type: %s",
+                self.address,
+                self.port,
+                data_type,
+            )
+        if left and self.gossip.cluster is not None:
+            self.gossip.cluster.update_subscriptions()
+
+        # announces that only waited for this connection are forwarded if another
+        # subscriber validated them, otherwise they are dropped
+        completed, dropped = self.gossip.unvalidated_announces.remove_validator(self)
+        for entry in completed:
+            self.forward_validated(entry)
+        if self.gossip.cluster is not None:
+            for entry in dropped:
+                self.gossip.cluster.withdraw(entry.digest)
+
+    def forward_validated(self, entry):
+        """send an announce validated by all its validators to all peers but its
+        sender, batched with others if batching is enabled"""
+        log.debug(
+            "All validators have validated the message. Message will now be announced to peers."
+        )
+        if self.gossip.validated_announces is None:
+            forward_announces(self.gossip, [entry])
+        else:
+            self.gossip.validated_announces.add(entry)
 
     async def run(self):
         """listen for incoming messages"""
 
-        print(f"[+][API] Connection established with {self.address}:{self.port}")
+        log.info("Connection established with %s:%s", self.address, self.port)
+        self.send_queue.start()
         while True:
             try:
-                msg_size_bytes = await self.reader.read(2)
-                msg_size = struct.unpack(">H", msg_size_bytes)[0]
-                if msg_size < 8 or msg_size > 65535:
-                    raise Exception(f"[-][API] Invalid message size {msg_size}")
-                msg = msg_size_bytes + await self.reader.read(msg_size - 2)
-                if len(msg) != (msg_size):
-                    raise Exception(
-                        f"[-][API] Incomplete message received from {self.address}:{self.port}=> expected {msg_size} bytes, got {len(msg)} bytes"
-                    )
-                print("++++++++++++++++++++")
+                msg = await self.frames.read_frame()
                 await self.handle_message(msg)
             except Exception as e:
-                print(
-                    f"[-][API] Error in Connection with {self.address}:{self.port} \n Exception: {e}"
+                log.warning(
+                    "Error in Connection with %s:%s => %s", self.address, self.port, e
                 )
                 await self.close_connection()
                 break
-            print("++++++++++++++++++++")
 
     async def handle_message(self, msg):
         """handle incoming message"""
-        print(f"[+][API] Packet arrived from {self.address}:{self.port}")
+        log.debug("Packet arrived from %s:%s", self.address, self.port)
 
-        msg_type = struct.unpack(">H", msg[2:4])[0]
+        size, msg_type = decode_header(msg)
+        self.gossip.metrics.received(msg_type, size)
 
         if msg_type == GOSSIP_ANNOUNCE:
             await self.handle_gossip_announce(msg)
@@ -82,172 +137,131 @@ class APIConnection:
     async def handle_gossip_announce(self, msg):
 
         try:
-            print(f"[+][API] GOSSIP_ANNOUNCE from {self.address}:{self.port} =>\n")
-            ttl = struct.unpack(">B", msg[4:5])[0]
-            data_type = struct.unpack(">H", msg[6:8])[0]
-            data = msg[8:]
-
-            print(f"    [+] Data type: {data_type}")
-            print(f"    [+] TTL: {ttl}")
-            print(f"    [+] Data: {hexdump.dump(data)}")
-
-            async with self.gossip.subscriptions_lock:
-                if data_type in self.gossip.subscriptions:
-                    gossip_notification_message = (
-                        struct.pack(
-                            ">HHHH",
-                            8 + len(data),
-                            GOSSIP_NOTIFICATION,
-                            0,
-                            data_type,
-                        )
-                        + data
-                    )
-                    for connection in self.gossip.subscriptions[data_type]:
-                        if connection != self:
-                            try:
-                                print(
-                                    f"[+][API] Sending GOSSIP_NOTIFICATION to {connection.address}:{connection.port}"
-                                )
-                                connection.writer.write(gossip_notification_message)
-                                await connection.writer.drain()
-                            except Exception as e:
-                                print(
-                                    f"[-][API] Error in sending GOSSIP_NOTIFICATION to {connection.address}:{connection.port}: {e}"
-                                )
-
-            peer_announce_msg = (
-                struct.pack(
-                    ">HHBBH",
-                    8 + len(data),
-                    PEER_ANOUNCE,
-                    ttl,
-                    0,
-                    data_type,
-                )
-                + data
-            )
+            log.debug("GOSSIP_ANNOUNCE from %s:%s", self.address, self.port)
+            ttl, data_type, data = decode_gossip_announce(msg)
+            # one copy of the payload out of the frame buffer, shared by all recipients
+            data = bytes(data)
 
-            async with self.gossip.p2p_connections_lock:
-                for connection in self.gossip.p2p_connections:
-                    try:
-                        print(
-                            f"[+][P2P] Sending PEER_ANNOUNCE to {connection.address}:{connection.listening_port}"
-                        )
-                        connection.writer.write(peer_announce_msg)
-                        await connection.writer.drain()
-                    except Exception as e:
-                        print(
-                            f"[-][P2P] Error in sending PEER_ANNOUNCE to {connection.address}:{connection.listening_port}: {e}"
+            log.debug("    Data type: %s, TTL: %s", data_type, ttl)
+            log_payload(log, data)
+
+            if data_type in self.gossip.subscriptions:
+                gossip_notification_message = encode_gossip_notification(
+                    0, data_type, data
+                )
+                for connection in self.gossip.subscriptions.subscribers(data_type):
+                    if connection != self:
+                        log.debug(
+                            "Sending GOSSIP_NOTIFICATION to %s:%s",
+                            connection.address,
+                            connection.port,
                         )
+                        connection.notify(gossip_notification_message)
+
+            # remembered so the announce is dropped when it comes back to us
+            digest = announce_digest(data_type, data)
+            self.gossip.cache.check_and_add(digest)
+            self.gossip.dissemination.broadcast([(digest, None, ttl, data_type, data)])
+            if self.gossip.cluster is not None:
+                self.gossip.cluster.publish(digest, ttl, data_type, data)
 
         except Exception as e:
-            print(
-                f"[-][API] Error in handling GOSSIP_ANNOUNCE from {self.address}:{self.port}"
+            log.warning(
+                "Error in handling GOSSIP_ANNOUNCE from %s:%s", self.address, self.port
             )
             raise e
 
     async def handle_gossip_notify(self, msg):
         try:
-            print(f"[+][API] GOSSIP_NOTIFY from {self.address}:{self.port} =>\n")
-
-            data_type = struct.unpack(">H", msg[6:8])[0]
-
-            print(f"    [+] Data type: {data_type}")
-
-            async with self.gossip.subscriptions_lock:
-                if data_type not in self.gossip.subscriptions:
-                    self.gossip.subscriptions[data_type] = (
-                        set()
-                    )  # Using set to avoid duplicates
-                    print(f"[+] new valid data type is registered: {data_type}")
-                self.gossip.subscriptions[data_type].add(self)
-                print(
-                    f"[+] Added {self.address}:{self.port} to list of subscribers of data type: {data_type}"
-                )
+            log.debug("GOSSIP_NOTIFY from %s:%s", self.address, self.port)
+
+            data_type = decode_gossip_notify(msg)
+
+            if self.gossip.subscriptions.subscribe(data_type, self):
+                log.info("new valid data type is registered: %s", data_type)
+                if self.gossip.cluster is not None:
+                    self.gossip.cluster.update_subscriptions()
+            log.info(
+                "Added %s:%s to list of subscribers of data type: %s",
+                self.address,
+                self.port,
+                data_type,
+            )
 
         except Exception as e:
-            print(
-                f"[-][API] Error in handling GOSSIP_NOTIFY from {self.address}:{self.port}"
+            log.warning(
+                "Error in handling GOSSIP_NOTIFY from %s:%s", self.address, self.port
             )
 
             raise e
 
     async def handle_gossip_validation(self, msg):
-        print(f"[+][API] GOSSIP_VALIDATION received from {self.address}:{self.port}")
+        log.debug("GOSSIP_VALIDATION received from %s:%s", self.address, self.port)
 
         try:
-            message_id = struct.unpack(">H", msg[4:6])[0]
-            is_valid = (struct.unpack(">H", msg[6:8])[0]) & 1 != 0
-
-            print(f"    [+] Message ID: {message_id}")
-            print(f"    [+] Is Valid: {is_valid}")
-
-            async with self.gossip.unvalidated_announces_lock:
-                if message_id not in self.gossip.unvalidated_announces:
-                    print(
-                        f"[-][API] GOSSIP_VALIDATION received for message_id {message_id} that does not exist in unvalidated_announces"
-                    )
-                    return
-
-                if self not in self.gossip.unvalidated_announces[message_id][4]:
-                    raise Exception(
-                        f"[-][API] GOSSIP_VALIDATION received for message_id {message_id} from a non validator: {self.address}:{self.port}"
-                    )
-
-                if not is_valid:
-                    print(
-                        f"[+][API] Message {message_id} is not valid. Deleting data and not propagating it further and dropping sender peer connection."
-                    )
-                    _, _, _, sender, _ = self.gossip.unvalidated_announces.pop(
-                        message_id
-                    )
+            message_id, is_valid = decode_gossip_validation(msg)
+
+            log.debug("    Message ID: %s, Is Valid: %s", message_id, is_valid)
+
+            unvalidated_announces = self.gossip.unvalidated_announces
+            entry = unvalidated_announces.get(message_id)
+            if entry is None:
+                log.warning(
+                    "GOSSIP_VALIDATION received for message_id %s that does not exist in unvalidated_announces",
+                    message_id,
+                )
+                return
+
+            if self not in entry.validators:
+                raise Exception(
+                    f"[-][API] GOSSIP_VALIDATION received for message_id {message_id} from a non validator: {self.address}:{self.port}"
+                )
+
+            if not is_valid:
+                log.info(
+                    "Message %s is not valid. Deleting data and not propagating it further and dropping sender peer connection.",
+                    message_id,
+                )
+                entry = unvalidated_announces.pop(message_id)
+                if self.gossip.cluster is not None:
+                    # no worker forwards it, the one it came from drops the sender
+                    self.gossip.cluster.validated(entry.digest, False)
+                sender = entry.sender
+                if sender is not None:
+                    self.gossip.p2p_connections.remove(sender)
                     await sender.close_connection()
-                    async with self.gossip.p2p_connections_lock:
-                        if sender in self.gossip.p2p_connections:
-                            self.gossip.p2p_connections.remove(sender)
-
-                    return
-
-                print("[+][API] removing connection from list of awaited validators")
-                self.gossip.unvalidated_announces[message_id][4].remove(self)
-
-                if len(self.gossip.unvalidated_announces[message_id][4]) == 0:
-                    print(
-                        "[+][API] All validators have validated the message. Message will now be announced to peers."
-                    )
-                    ttl, data_type, data, sender, _ = (
-                        self.gossip.unvalidated_announces.pop(message_id)
-                    )
-
-                    peer_announce_msg = (
-                        struct.pack(
-                            ">HHBBH",
-                            8 + len(data),
-                            PEER_ANOUNCE,
-                            ttl,
-                            0,
-                            data_type,
-                        )
-                        + data
-                    )
-
-                    async with self.gossip.p2p_connections_lock:
-                        for connection in self.gossip.p2p_connections:
-                            if connection != sender:
-                                try:
-                                    print(
-                                        f"[+][P2P] Sending PEER_ANNOUNCE to {connection.address}:{connection.listening_port}"
-                                    )
-                                    connection.writer.write(peer_announce_msg)
-                                    await connection.writer.drain()
-                                except Exception as e:
-                                    print(
-                                        f"[-][P2P] Error in sending PEER_ANNOUNCE to {connection.address}:{connection.port}: {e}"
-                                    )
+                return
+
+            log.debug("removing connection from list of awaited validators")
+            entry = unvalidated_announces.validate(message_id, self)
+            if entry is not None:
+                self.forward_validated(entry)
 
         except Exception as e:
-            print(
-                f"[-][API] Error in handling GOSSIP_VALIDATION from {self.address}:{self.port}"
+            log.warning(
+                "Error in handling GOSSIP_VALIDATION from %s:%s",
+                self.address,
+                self.port,
             )
             raise e
+
+
+def forward_announces(gossip, entries):
+    """send validated announces to all peers, each peer gets the announces it did not
+    send to us as one message"""
+    # announces were received validation_timeout seconds before their deadline
+    now = asyncio.get_running_loop().time()
+    timeout = gossip.unvalidated_announces.timeout
+    for entry in entries:
+        gossip.metrics.announce_forward.observe(now - (entry.deadline - timeout))
+    if gossip.cluster is not None:
+        # every worker forwards them once the other workers validated them too
+        for entry in entries:
+            gossip.cluster.validated(entry.digest)
+        return
+    gossip.dissemination.broadcast(
+        [
+            (entry.digest, entry.sender, entry.ttl, entry.data_type, entry.data)
+            for entry in entries
+        ]
+    )
@@ -1,6 +1,8 @@
 import asyncio
 
 from gossip.api_connection import APIConnection
+from gossip.log import API as log
+from gossip.sockets import start_server, tune_connection
 
 
 class APIServer:
@@ -10,24 +12,24 @@ class APIServer:
         self.host, self.port = gossip.config.api_address.split(":")
 
     async def on_connection(self, reader, writer):
+        tune_connection(writer, self.gossip.config)
         connection = APIConnection(self.gossip, reader, writer)
 
-        async with self.gossip.api_connections_lock:
-            self.gossip.api_connections.append(connection)
+        self.gossip.api_connections.append(connection)
 
         asyncio.create_task(connection.run())
 
     async def run(self):
         try:
-            server = await asyncio.start_server(
-                self.on_connection, self.host, self.port
+            server = await start_server(
+                self.on_connection, self.host, self.port, self.gossip.config
             )
 
-            print(f">>>> API Server started, listening on {self.host}:{self.port} <<<<")
+            log.info("API Server started, listening on %s:%s", self.host, self.port)
 
             async with server:
                 await server.serve_forever()
         except Exception as e:
-            print(
-                f"[-][API] Error in starting API server on {self.host}:{self.port}: {e}"
+            log.error(
+                "Error in starting API server on %s:%s: %s", self.host, self.port, e
             )
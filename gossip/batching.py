@@ -0,0 +1,73 @@
+"""Coalescing of messages that are sent at a high rate into batches"""
+
+import asyncio
+
+
+class Batcher:
+    """Collects items and passes them to `flush` as one list, either once `max_items`
+    are collected or `window` seconds after the first item of the batch was added"""
+
+    def __init__(self, window, max_items, flush):
+        self.window = window
+        self.max_items = max_items
+        self.flush = flush
+
+        self.items = []
+        self.timer = None
+
+        self.batches = 0
+        self.flushed = 0
+
+    def add(self, item):
+        self.items.append(item)
+        if len(self.items) >= self.max_items:
+            self.flush_now()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(
+                self.window, self.flush_now
+            )
+
+    def flush_now(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.items:
+            return
+        items, self.items = self.items, []
+        self.batches += 1
+        self.flushed += len(items)
+        self.flush(items)
+
+    def close(self):
+        """drop the items of the current batch"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.items = []
+
+    def stats(self):
+        return {
+            "pending": len(self.items),
+            "batches": self.batches,
+            "flushed": self.flushed,
+        }
+
+
+def join_messages(messages):
+    """one message made of the parts of all `messages`, each a bytes-like object or a
+    (header, payload) tuple, to be written with a single writelines call"""
+    parts = []
+    for message in messages:
+        if type(message) is tuple:
+            parts.extend(message)
+        else:
+            parts.append(message)
+    return tuple(parts)
+
+
+def create_batcher(config, flush):
+    """Batcher configured by batch_window_ms and batch_max_messages, None if batching
+    is disabled"""
+    if config.batch_window_ms == 0:
+        return None
+    return Batcher(config.batch_window_ms / 1000, config.batch_max_messages, flush)
@@ -0,0 +1,270 @@
+"""Cache of already seen message hashes, used to drop duplicate PEER_ANNOUNCE messages"""
+
+from collections import OrderedDict
+import hashlib
+import math
+import mmap
+import multiprocessing
+import time
+
+
+class MessageCache:
+    """Keeps up to `max_size` message hashes in a dict ordered by the time they were
+    last seen. Lookups and inserts are O(1), when the cache is full the least
+    recently seen hash is evicted. With a `ttl` (in seconds) greater than 0 hashes
+    also expire once they have not been seen for `ttl` seconds."""
+
+    def __init__(self, max_size, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key: message hash, value: time after which the entry expires
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, message_hash):
+        self.expire()
+        return message_hash in self.entries
+
+    def expire(self):
+        """drop expired entries, they are always at the front of the ordered dict"""
+        if self.ttl <= 0:
+            return
+        now = time.monotonic()
+        entries = self.entries
+        while entries:
+            message_hash, expires_at = next(iter(entries.items()))
+            if expires_at > now:
+                break
+            del entries[message_hash]
+            self.expirations += 1
+
+    def check_and_add(self, message_hash):
+        """Return True if the hash was already seen, otherwise add it and return False.
+        Seeing a hash again refreshes its position and expiry time."""
+        self.expire()
+        entries = self.entries
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else 0
+
+        if message_hash in entries:
+            entries.move_to_end(message_hash)
+            entries[message_hash] = expires_at
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        if self.max_size <= 0:
+            return False
+        entries[message_hash] = expires_at
+        if len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return False
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class BloomFilter:
+    """Fixed size Bloom filter for `capacity` keys at the given false positive rate"""
+
+    def __init__(self, capacity, false_positive_rate):
+        capacity = max(capacity, 1)
+        self.size = max(
+            math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2), 8
+        )
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # message hashes are already uniformly distributed, other keys are hashed first
+        if len(key) < 16:
+            key = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(key[:8], "big")
+        h2 = int.from_bytes(key[8:16], "big") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
+
+    def contains_positions(self, positions):
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_positions(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return self.contains_positions(self.positions(key))
+
+    def add(self, key):
+        self.add_positions(self.positions(key))
+
+
+class RotatingBloomCache:
+    """Memory bounded alternative to MessageCache. Hashes are added to the current
+    of two Bloom filters, once it holds `capacity` hashes (or is older than `ttl`
+    seconds, if ttl is greater than 0) the previous filter is dropped and the current
+    one takes its place. A hash is therefore remembered for at least `capacity`
+    further messages. Lookups check both filters, each is sized for half of
+    `false_positive_rate` so a new message is wrongly dropped with at most that rate."""
+
+    def __init__(self, capacity, false_positive_rate, ttl=0):
+        self.capacity = max(capacity, 1)
+        self.false_positive_rate = false_positive_rate
+        self.ttl = ttl
+
+        self.current = self.new_filter()
+        self.previous = None
+        self.rotated_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.rotations = 0
+
+    def new_filter(self):
+        return BloomFilter(self.capacity, self.false_positive_rate / 2)
+
+    def __len__(self):
+        """approximate number of remembered hashes"""
+        return self.current.count + (self.previous.count if self.previous else 0)
+
+    def __contains__(self, message_hash):
+        self.expire()
+        return self.contains_positions(self.current.positions(message_hash))
+
+    def contains_positions(self, positions):
+        # both filters have the same size and hash count, so positions are shared
+        return self.current.contains_positions(positions) or (
+            self.previous is not None and self.previous.contains_positions(positions)
+        )
+
+    def expire(self):
+        if self.ttl > 0 and time.monotonic() - self.rotated_at >= self.ttl:
+            self.rotate()
+
+    def rotate(self):
+        self.previous = self.current
+        self.current = self.new_filter()
+        self.rotated_at = time.monotonic()
+        self.rotations += 1
+
+    def check_and_add(self, message_hash):
+        """Return True if the hash was (probably) already seen, otherwise add it and
+        return False"""
+        self.expire()
+        positions = self.current.positions(message_hash)
+        if self.contains_positions(positions):
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        if self.current.count >= self.capacity:
+            self.rotate()
+        self.current.add_positions(positions)
+        return False
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "rotations": self.rotations,
+            "memory_bytes": len(self.current.bits)
+            + (len(self.previous.bits) if self.previous else 0),
+        }
+
+
+class SharedDigestCache:
+    """Seen cache shared by the forked worker processes of a node (see
+    gossip.cluster). The digests are kept in a set associative table in an
+    anonymous shared memory mapping, which forked processes inherit. A digest can
+    only be in the `WAYS` slots of its bucket, a bucket holds its most recently
+    added digests and forgets the oldest one when a new digest is added to it.
+    Lookups and inserts hold a lock shared by the processes. There is no ttl."""
+
+    WAYS = 4
+
+    def __init__(self, max_size, digest_size=20):
+        self.digest_size = digest_size
+        self.buckets = max(max_size // self.WAYS, 1)
+        self.bucket_size = self.WAYS * digest_size
+        self.table = mmap.mmap(-1, self.buckets * self.bucket_size)
+        self.lock = multiprocessing.get_context("fork").Lock()
+
+        # counted by each process for its own lookups
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        empty = bytes(self.digest_size)
+        table = self.table
+        return sum(
+            table[offset : offset + self.digest_size] != empty
+            for offset in range(0, len(table), self.digest_size)
+        )
+
+    def __contains__(self, message_hash):
+        start, end = self.bucket_of(message_hash)
+        with self.lock:
+            bucket = self.table[start:end]
+        return self.in_bucket(bucket, message_hash)
+
+    def bucket_of(self, message_hash):
+        """start and end offset of the bucket of a hash in the table"""
+        start = int.from_bytes(message_hash[:8], "big") % self.buckets
+        start *= self.bucket_size
+        return start, start + self.bucket_size
+
+    def in_bucket(self, bucket, message_hash):
+        size = self.digest_size
+        return any(
+            bucket[offset : offset + size] == message_hash
+            for offset in range(0, self.bucket_size, size)
+        )
+
+    def check_and_add(self, message_hash):
+        """Return True if the hash was already seen, otherwise add it and return False"""
+        start, end = self.bucket_of(message_hash)
+        with self.lock:
+            bucket = self.table[start:end]
+            if self.in_bucket(bucket, message_hash):
+                self.hits += 1
+                return True
+            self.table[start:end] = message_hash + bucket[: -self.digest_size]
+        self.misses += 1
+        return False
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_bytes": len(self.table),
+        }
+
+
+def create_cache(config):
+    """Create the seen message cache selected by cache_mode in the config"""
+    if config.cache_mode == "bloom":
+        return RotatingBloomCache(
+            config.cache_size, config.cache_false_positive_rate, config.cache_ttl
+        )
+    return MessageCache(config.cache_size, config.cache_ttl)
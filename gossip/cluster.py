@@ -0,0 +1,453 @@
+"""Multi-process mode, `workers` forked processes serve one node.
+
+Every worker runs a Gossip instance on its own event loop and core. The API and
+P2P listeners of all workers are bound to the same addresses with SO_REUSEPORT,
+the kernel spreads the incoming connections over them and the network sees a
+single peer. Connections, send queues, proof of work and the pending validations
+of the local subscribers stay in the worker that holds the connection, the state
+that has to be the same everywhere is shared:
+    - the seen cache is a SharedDigestCache in shared memory, an announce is only
+      accepted by the first worker that receives it
+    - the StateService in the parent process is connected to every worker by a
+      socket pair. It knows the data types subscribed in each worker and relays
+      accepted announces to all workers, which notify their own subscribers.
+      Announces that are forwarded wait until the workers with subscribers for
+      their data type validated them, then every worker forwards them to its own
+      peers. If one subscriber finds an announce invalid, no worker forwards it.
+      A worker whose subscribers left or that exited no longer counts, an
+      announce nobody validated is dropped.
+
+The degree is split between the workers. Only the first worker dials the
+bootstrapper, a peer only keeps one connection to our address, the other workers
+get their peers from incoming connections and discovery."""
+
+import asyncio
+from collections import OrderedDict
+import copy
+import math
+import os
+import signal
+import socket
+import struct
+import sys
+
+from gossip.cache import SharedDigestCache
+from gossip.codec import encode_gossip_notification
+from gossip.gossip import Gossip
+from gossip.log import logger as log, pause_logging, resume_logging
+
+# messages between the workers and the state service, 4 byte size and 2 byte type
+STATE_HEADER = struct.Struct(">IH")
+
+# data types subscribed in the worker, from the service: in the other workers
+STATE_SUBSCRIPTIONS = 1
+# an announce accepted by a worker: digest, flags, ttl, data type, data
+STATE_ANNOUNCE = 2
+# validation of an announce by the subscribers of a worker: digest, valid
+STATE_VALIDATED = 3
+# the announce with the digest is forwarded / dropped by all workers
+STATE_FORWARD = 4
+STATE_DROP = 5
+# the worker has no subscribers left to validate the announce with the digest
+STATE_WITHDRAW = 6
+
+ANNOUNCE = struct.Struct(">20sBBH")
+VALIDATED = struct.Struct(">20sB")
+
+# flags of STATE_ANNOUNCE
+# forward the announce once all workers validated it
+FORWARD = 1
+# the subscribers of the receiving worker have to validate it
+VALIDATE = 2
+# forward the announce at once, it was published by an API client
+PUBLISHED = 4
+
+
+def encode_state_message(msg_type, payload):
+    return STATE_HEADER.pack(STATE_HEADER.size + len(payload), msg_type) + payload
+
+
+def encode_state_announce(digest, flags, ttl, data_type, data):
+    return encode_state_message(
+        STATE_ANNOUNCE, ANNOUNCE.pack(digest, flags, ttl, data_type) + data
+    )
+
+
+def encode_state_subscriptions(data_types):
+    return encode_state_message(
+        STATE_SUBSCRIPTIONS, struct.pack(f">{len(data_types)}H", *sorted(data_types))
+    )
+
+
+def decode_state_subscriptions(payload):
+    return frozenset(struct.unpack(f">{len(payload) // 2}H", payload))
+
+
+async def read_state_message(reader):
+    """returns the type and payload of the next message"""
+    size, msg_type = STATE_HEADER.unpack(await reader.readexactly(STATE_HEADER.size))
+    return msg_type, await reader.readexactly(size - STATE_HEADER.size)
+
+
+class StateService:
+    """Subscriptions and validations of all workers, runs in the parent process.
+    Announces whose validations did not arrive within `timeout` seconds are
+    forgotten, the workers drop them after the same time."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        # key: worker index, value: StreamWriter to the worker
+        self.workers = {}
+        # key: worker index, value: frozenset of the data types subscribed in it
+        self.subscriptions = {}
+        # key: digest, value: [deadline, set of worker indexes that did not validate
+        # it yet, True once a worker validated it], insertion ordered so the first
+        # entry expires first
+        self.pending = OrderedDict()
+        # cancelled to stop the service
+        self.stopped = None
+
+    async def run(self, sockets):
+        """serve the workers connected to `sockets`, a dict of worker index to
+        socket, until all of them exited or SIGINT or SIGTERM is received"""
+        loop = asyncio.get_running_loop()
+        self.stopped = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopped.cancel)
+        for index, sock in sockets.items():
+            asyncio.create_task(self.serve(index, sock))
+        await asyncio.wait((self.stopped,))
+
+    async def serve(self, index, sock):
+        reader, writer = await asyncio.open_connection(sock=sock)
+        self.workers[index] = writer
+        try:
+            while True:
+                msg_type, payload = await read_state_message(reader)
+                self.handle_message(index, msg_type, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.error("Worker %s exited", index)
+        finally:
+            self.workers.pop(index, None)
+            writer.close()
+            if self.subscriptions.pop(index, None):
+                self.send_subscriptions()
+            # announces waiting for the worker no longer wait for it, they are
+            # not validated by it
+            for digest in list(self.pending):
+                self.withdraw(index, digest)
+            if not self.workers:
+                self.stopped.cancel()
+
+    def handle_message(self, index, msg_type, payload):
+        if msg_type == STATE_SUBSCRIPTIONS:
+            self.subscriptions[index] = decode_state_subscriptions(payload)
+            self.send_subscriptions()
+        elif msg_type == STATE_ANNOUNCE:
+            self.handle_announce(index, payload)
+        elif msg_type == STATE_VALIDATED:
+            digest, valid = VALIDATED.unpack(payload)
+            if valid:
+                self.validated(index, digest)
+            elif self.pending.pop(digest, None) is not None:
+                self.send_all(encode_state_message(STATE_DROP, digest))
+        elif msg_type == STATE_WITHDRAW:
+            self.withdraw(index, payload)
+        else:
+            raise Exception(f"Unknown message type {msg_type} from worker {index}")
+
+    def handle_announce(self, index, payload):
+        digest, flags, ttl, data_type = ANNOUNCE.unpack_from(payload)
+        data = payload[ANNOUNCE.size :]
+        self.expire()
+
+        validators = set()
+        if flags & FORWARD:
+            validators = {
+                worker
+                for worker, data_types in self.subscriptions.items()
+                if worker != index and data_type in data_types
+            }
+            if flags & VALIDATE:
+                validators.add(index)
+            if validators:
+                deadline = asyncio.get_running_loop().time() + self.timeout
+                self.pending[digest] = [deadline, validators, False]
+
+        for worker, writer in self.workers.items():
+            if worker != index:
+                worker_flags = flags & ~VALIDATE
+                if worker in validators:
+                    worker_flags |= VALIDATE
+                writer.write(
+                    encode_state_announce(digest, worker_flags, ttl, data_type, data)
+                )
+        # without validators, as the subscribers are gone in the meantime, nobody
+        # validates it and the workers drop it after the timeout
+
+    def validated(self, index, digest):
+        entry = self.pending.get(digest)
+        if entry is not None:
+            entry[2] = True
+            self.remove_validator(index, digest, entry)
+
+    def withdraw(self, index, digest):
+        entry = self.pending.get(digest)
+        if entry is not None:
+            self.remove_validator(index, digest, entry)
+
+    def remove_validator(self, index, digest, entry):
+        """the announce is forwarded once no worker has to validate it anymore if
+        one of them validated it, otherwise it is dropped"""
+        _, validators, approved = entry
+        validators.discard(index)
+        if validators:
+            return
+        del self.pending[digest]
+        if approved:
+            self.send_all(encode_state_message(STATE_FORWARD, digest))
+        else:
+            log.info("Announce was not validated by any worker, dropping it")
+
+    def expire(self):
+        now = asyncio.get_running_loop().time()
+        pending = self.pending
+        while pending and next(iter(pending.values()))[0] <= now:
+            pending.popitem(last=False)
+
+    def send_subscriptions(self):
+        """tell every worker the data types subscribed in the other workers"""
+        for worker, writer in self.workers.items():
+            data_types = set()
+            for other, other_types in self.subscriptions.items():
+                if other != worker:
+                    data_types |= other_types
+            writer.write(encode_state_subscriptions(data_types))
+
+    def send_all(self, message):
+        for writer in self.workers.values():
+            writer.write(message)
+
+
+class StateClient:
+    """Connection of worker `index` to the StateService, passed to its Gossip
+    instance as `cluster`"""
+
+    def __init__(self, index, sock, cache):
+        self.index = index
+        self.sock = sock
+        # shared seen cache, used as the cache of the Gossip instance
+        self.cache = cache
+        # set by the Gossip instance
+        self.gossip = None
+        self.reader = None
+        self.writer = None
+
+        # data types with subscribers in this / in the other workers
+        self.local_types = frozenset()
+        self.remote_types = frozenset()
+
+        # key: digest, value: (sender, ttl, data_type, data, deadline) of announces
+        # waiting for STATE_FORWARD, insertion ordered so the first expires first
+        self.awaiting = OrderedDict()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
+
+    def withdraw(self, digest):
+        """the subscribers of this worker left without validating the announce"""
+        self.writer.write(encode_state_message(STATE_WITHDRAW, digest))
+
+    def is_subscribed(self, data_type):
+        """True if another worker has subscribers for the data type"""
+        return data_type in self.remote_types
+
+    def update_subscriptions(self):
+        """send the data types subscribed in this worker if they changed"""
+        data_types = frozenset(
+            data_type
+            for data_type, subscribers in self.gossip.subscriptions.snapshot.items()
+            if subscribers
+        )
+        if data_types != self.local_types:
+            self.local_types = data_types
+            self.writer.write(encode_state_subscriptions(data_types))
+
+    def announce(self, digest, sender, ttl, data_type, data, forward, validate):
+        """hand an announce received by this worker to the other workers. If
+        `forward` it is forwarded once it was validated, by the subscribers of
+        this worker if `validate`, and by those of the other workers"""
+        flags = 0
+        if forward:
+            self.await_forward(digest, sender, ttl, data_type, data)
+            flags = FORWARD | (VALIDATE if validate else 0)
+        self.writer.write(encode_state_announce(digest, flags, ttl, data_type, data))
+
+    def publish(self, digest, ttl, data_type, data):
+        """hand an announce of a local API client to the other workers, which
+        notify their subscribers and forward it to their peers"""
+        self.writer.write(
+            encode_state_announce(digest, PUBLISHED, ttl, data_type, data)
+        )
+
+    def validated(self, digest, valid=True):
+        self.writer.write(
+            encode_state_message(STATE_VALIDATED, VALIDATED.pack(digest, valid))
+        )
+
+    def await_forward(self, digest, sender, ttl, data_type, data):
+        now = asyncio.get_running_loop().time()
+        awaiting = self.awaiting
+        while awaiting and (
+            next(iter(awaiting.values()))[4] <= now
+            or len(awaiting) >= self.gossip.config.max_pending_validations
+        ):
+            awaiting.popitem(last=False)
+        deadline = now + self.gossip.config.validation_timeout
+        awaiting[digest] = (sender, ttl, data_type, data, deadline)
+
+    async def run(self):
+        """handle the messages of the state service, returns when it is gone"""
+        try:
+            while True:
+                msg_type, payload = await read_state_message(self.reader)
+                if msg_type == STATE_SUBSCRIPTIONS:
+                    self.remote_types = decode_state_subscriptions(payload)
+                elif msg_type == STATE_ANNOUNCE:
+                    self.handle_announce(payload)
+                elif msg_type == STATE_FORWARD:
+                    self.handle_forward(payload)
+                elif msg_type == STATE_DROP:
+                    await self.handle_drop(payload)
+                else:
+                    raise Exception(f"Unknown message type {msg_type} from the parent")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.info("State service closed, stopping worker %s", self.index)
+
+    def handle_announce(self, payload):
+        digest, flags, ttl, data_type = ANNOUNCE.unpack_from(payload)
+        data = bytes(payload[ANNOUNCE.size :])
+        gossip = self.gossip
+        subscribers = gossip.subscriptions.subscribers(data_type)
+
+        message_id = 0
+        if flags & FORWARD:
+            self.await_forward(digest, None, ttl, data_type, data)
+            if flags & VALIDATE:
+                if subscribers:
+                    message_id = gossip.unvalidated_announces.add(
+                        ttl, data_type, data, None, subscribers, digest
+                    )
+                else:
+                    # the subscribers left after the service counted them
+                    self.withdraw(digest)
+
+        if subscribers:
+            notification = encode_gossip_notification(message_id, data_type, data)
+            for connection in subscribers:
+                connection.notify(notification)
+
+        if flags & PUBLISHED:
+            gossip.dissemination.broadcast([(digest, None, ttl, data_type, data)])
+
+    def handle_forward(self, digest):
+        entry = self.awaiting.pop(digest, None)
+        if entry is not None:
+            sender, ttl, data_type, data, _ = entry
+            self.gossip.dissemination.broadcast(
+                [(digest, sender, ttl, data_type, data)]
+            )
+
+    async def handle_drop(self, digest):
+        entry = self.awaiting.pop(digest, None)
+        if entry is None:
+            return
+        sender = entry[0]
+        # the worker that received an invalid announce drops its sender
+        if sender is not None and self.gossip.p2p_connections.remove(sender):
+            log.info(
+                "Announce from %s:%s is not valid, dropping the connection",
+                sender.address,
+                sender.listening_port,
+            )
+            await sender.close_connection()
+
+
+def worker_config(config, index):
+    """the config of worker `index`: the listeners share their ports, the degree
+    and proof of work processes are split between the workers and the files and
+    the metrics port are its own"""
+    config = copy.copy(config)
+    config.reuse_port = True
+    config.degree = math.ceil(config.degree / config.workers)
+    if config.pow_workers:
+        config.pow_workers = math.ceil(config.pow_workers / config.workers)
+    if config.metrics_address:
+        host, port = config.metrics_address.rsplit(":", 1)
+        config.metrics_address = f"{host}:{int(port) + index}"
+    if config.store_path:
+        config.store_path = f"{config.store_path}.{index}"
+    if config.peer_table_path:
+        config.peer_table_path = f"{config.peer_table_path}.{index}"
+    return config
+
+
+async def serve_worker(config, index, sock, cache):
+    cluster = StateClient(index, sock, cache)
+    gossip = Gossip(config, cluster)
+    await cluster.connect()
+    log.info("Worker %s started in process %s", index, os.getpid())
+    node = asyncio.create_task(gossip.run())
+    service = asyncio.create_task(cluster.run())
+    # the parent process stops the workers with SIGTERM
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, service.cancel)
+    await asyncio.wait((service,))
+    node.cancel()
+
+
+def run_worker(config, index, sock, cache):
+    """body of a forked worker process, returns its exit status"""
+    # Ctrl+C reaches the whole process group, the parent stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        asyncio.run(serve_worker(worker_config(config, index), index, sock, cache))
+    except Exception as e:
+        log.exception("Worker %s failed: %s", index, e)
+        return 1
+    return 0
+
+
+def run_cluster(config):
+    """fork the workers and run the state service in this process until it is
+    interrupted, the event loop must not have been started yet"""
+    cache = SharedDigestCache(config.cache_size)
+    sockets = {}
+    pids = []
+
+    pause_logging()
+    for index in range(config.workers):
+        service_end, worker_end = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            service_end.close()
+            for sock in sockets.values():
+                sock.close()
+            resume_logging()
+            sys.exit(run_worker(config, index, worker_end, cache))
+        worker_end.close()
+        sockets[index] = service_end
+        pids.append(pid)
+    resume_logging()
+
+    log.info("Started %s workers: %s", config.workers, pids)
+    try:
+        asyncio.run(StateService(config.validation_timeout).run(sockets))
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            os.waitpid(pid, 0)
+        log.info("All workers stopped")
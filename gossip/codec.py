@@ -0,0 +1,283 @@
+"""Encoding and decoding of all messages in messages_type.py.
+
+Headers are packed with precompiled structs. Messages that carry a payload are
+encoded as a (header, payload) tuple instead of one bytes object, connections
+write both parts with writelines, so the same payload object is shared by all
+recipients of a message without being copied into a new buffer for each of them.
+Decoders take a whole frame (bytes or memoryview) and return slices of it."""
+
+import hashlib
+import socket
+import struct
+
+from gossip.framing import HEADER
+from gossip.messages_type import (
+    GOSSIP_ANNOUNCE,
+    GOSSIP_NOTIFY,
+    GOSSIP_NOTIFICATION,
+    GOSSIP_VALIDATION,
+    PEER_INIT,
+    PEER_VERIFY,
+    PEER_OK,
+    PEER_ANOUNCE,
+    PEER_DISCOVER,
+    PEER_BROADCAST,
+    PEER_IHAVE,
+    PEER_GRAFT,
+    PEER_PRUNE,
+    PEER_DIGEST,
+    PEER_REQUEST,
+    PEER_BROADCAST_V2,
+)
+
+# size, type, ttl, reserved, data type
+ANNOUNCE_HEADER = struct.Struct(">HHBBH")
+# size, type, reserved, data type
+NOTIFY = struct.Struct(">HHHH")
+# size, type, message id, data type
+NOTIFICATION_HEADER = struct.Struct(">HHHH")
+# size, type, message id, reserved, flags
+VALIDATION = struct.Struct(">HHHBB")
+# size, type, challenge
+PEER_INIT_MESSAGE = struct.Struct(">HHQ")
+# size, type, features, listening port, nonce
+PEER_VERIFY_MESSAGE = struct.Struct(">HHHHQ")
+# size, type, reserved, features
+PEER_OK_MESSAGE = struct.Struct(">HHHH")
+# size, type, reserved, data type, followed by message digests
+IHAVE_HEADER = struct.Struct(">HHHH")
+DATA_TYPE = struct.Struct(">H")
+# data type, digest
+DIGEST_ENTRY = struct.Struct(">H20s")
+# PEER_BROADCAST_V2 holds the number of IPv4 addresses, then the IPv4 and then
+# the IPv6 addresses, each followed by its port
+COUNT = struct.Struct(">H")
+PEER_RECORD_V4 = struct.Struct(">4sH")
+PEER_RECORD_V6 = struct.Struct(">16sH")
+
+PEER_DISCOVER_MESSAGE = HEADER.pack(HEADER.size, PEER_DISCOVER)
+PEER_PRUNE_MESSAGE = HEADER.pack(HEADER.size, PEER_PRUNE)
+
+# sha1 digest of the data type and data of an announce, identifies the message
+DIGEST_SIZE = 20
+MAX_DIGESTS = (2**16 - 1 - IHAVE_HEADER.size) // DIGEST_SIZE
+MAX_DIGEST_ENTRIES = (2**16 - 1 - HEADER.size) // DIGEST_ENTRY.size
+
+
+def decode_header(msg):
+    """returns (size, message type)"""
+    return HEADER.unpack_from(msg)
+
+
+def announce_digest(data_type, data):
+    """digest identifying an announce, the same for every hop it takes"""
+    digest = hashlib.sha1(DATA_TYPE.pack(data_type))
+    digest.update(data)
+    return digest.digest()
+
+
+def split_digests(msg, offset):
+    return [
+        bytes(msg[i : i + DIGEST_SIZE]) for i in range(offset, len(msg), DIGEST_SIZE)
+    ]
+
+
+def encode_gossip_announce(ttl, data_type, data):
+    header = ANNOUNCE_HEADER.pack(
+        ANNOUNCE_HEADER.size + len(data), GOSSIP_ANNOUNCE, ttl, 0, data_type
+    )
+    return header, data
+
+
+def decode_gossip_announce(msg):
+    """returns (ttl, data type, data)"""
+    _, _, ttl, _, data_type = ANNOUNCE_HEADER.unpack_from(msg)
+    return ttl, data_type, msg[ANNOUNCE_HEADER.size :]
+
+
+def encode_gossip_notify(data_type):
+    return NOTIFY.pack(NOTIFY.size, GOSSIP_NOTIFY, 0, data_type)
+
+
+def decode_gossip_notify(msg):
+    """returns the data type"""
+    return NOTIFY.unpack_from(msg)[3]
+
+
+def encode_gossip_notification(message_id, data_type, data):
+    header = NOTIFICATION_HEADER.pack(
+        NOTIFICATION_HEADER.size + len(data), GOSSIP_NOTIFICATION, message_id, data_type
+    )
+    return header, data
+
+
+def decode_gossip_notification(msg):
+    """returns (message id, data type, data)"""
+    _, _, message_id, data_type = NOTIFICATION_HEADER.unpack_from(msg)
+    return message_id, data_type, msg[NOTIFICATION_HEADER.size :]
+
+
+def encode_gossip_validation(message_id, is_valid):
+    return VALIDATION.pack(
+        VALIDATION.size, GOSSIP_VALIDATION, message_id, 0, 1 if is_valid else 0
+    )
+
+
+def decode_gossip_validation(msg):
+    """returns (message id, is valid)"""
+    _, _, message_id, _, flags = VALIDATION.unpack_from(msg)
+    return message_id, flags & 1 != 0
+
+
+def encode_peer_init(challenge):
+    return PEER_INIT_MESSAGE.pack(PEER_INIT_MESSAGE.size, PEER_INIT, challenge)
+
+
+def decode_peer_init(msg):
+    """returns the challenge as an int"""
+    return PEER_INIT_MESSAGE.unpack_from(msg)[2]
+
+
+def encode_peer_verify(listening_port, nonce, features=0):
+    return PEER_VERIFY_MESSAGE.pack(
+        PEER_VERIFY_MESSAGE.size, PEER_VERIFY, features, listening_port, nonce
+    )
+
+
+def decode_peer_verify(msg):
+    """returns (listening port, nonce, features)"""
+    _, _, features, listening_port, nonce = PEER_VERIFY_MESSAGE.unpack_from(msg)
+    return listening_port, nonce, features
+
+
+def encode_peer_ok(features=0):
+    return PEER_OK_MESSAGE.pack(PEER_OK_MESSAGE.size, PEER_OK, 0, features)
+
+
+def decode_peer_ok(msg):
+    """returns the features, 0 for a PEER_OK without them"""
+    if len(msg) < PEER_OK_MESSAGE.size:
+        return 0
+    return PEER_OK_MESSAGE.unpack_from(msg)[3]
+
+
+def encode_peer_announce(ttl, data_type, data):
+    header = ANNOUNCE_HEADER.pack(
+        ANNOUNCE_HEADER.size + len(data), PEER_ANOUNCE, ttl, 0, data_type
+    )
+    return header, data
+
+
+def decode_peer_announce(msg):
+    """returns (ttl, data type, data)"""
+    _, _, ttl, _, data_type = ANNOUNCE_HEADER.unpack_from(msg)
+    return ttl, data_type, msg[ANNOUNCE_HEADER.size :]
+
+
+def encode_peer_discover():
+    return PEER_DISCOVER_MESSAGE
+
+
+def encode_peer_broadcast(addresses):
+    """addresses is a list of "ip:port" strings"""
+    addresses_bytes = ",".join(addresses).encode("utf-8")
+    return (
+        HEADER.pack(HEADER.size + len(addresses_bytes), PEER_BROADCAST),
+        addresses_bytes,
+    )
+
+
+def decode_peer_broadcast(msg):
+    """returns the list of (host, port)"""
+    addresses = []
+    for address in str(msg[HEADER.size :], "utf-8").split(","):
+        host, port = address.rsplit(":", 1)
+        addresses.append((host, int(port)))
+    return addresses
+
+
+def encode_peer_broadcast_v2(addresses):
+    """addresses is a list of (ip, port), addresses that are not IPv4 or IPv6
+    addresses are left out"""
+    ipv4 = []
+    ipv6 = []
+    for host, port in addresses:
+        try:
+            if ":" in host:
+                ipv6.append(
+                    PEER_RECORD_V6.pack(socket.inet_pton(socket.AF_INET6, host), port)
+                )
+            else:
+                ipv4.append(PEER_RECORD_V4.pack(socket.inet_aton(host), port))
+        except OSError:
+            continue
+    body = COUNT.pack(len(ipv4)) + b"".join(ipv4) + b"".join(ipv6)
+    return HEADER.pack(HEADER.size + len(body), PEER_BROADCAST_V2) + body
+
+
+def decode_peer_broadcast_v2(msg):
+    """returns the list of (ip, port)"""
+    ipv4_count = COUNT.unpack_from(msg, HEADER.size)[0]
+    ipv6_start = HEADER.size + COUNT.size + ipv4_count * PEER_RECORD_V4.size
+    addresses = [
+        (socket.inet_ntoa(packed), port)
+        for packed, port in PEER_RECORD_V4.iter_unpack(
+            msg[HEADER.size + COUNT.size : ipv6_start]
+        )
+    ]
+    addresses.extend(
+        (socket.inet_ntop(socket.AF_INET6, packed), port)
+        for packed, port in PEER_RECORD_V6.iter_unpack(msg[ipv6_start:])
+    )
+    return addresses
+
+
+def encode_peer_ihave(data_type, digests):
+    """digests is a list of at most MAX_DIGESTS announce digests"""
+    header = IHAVE_HEADER.pack(
+        IHAVE_HEADER.size + DIGEST_SIZE * len(digests), PEER_IHAVE, 0, data_type
+    )
+    return header, b"".join(digests)
+
+
+def decode_peer_ihave(msg):
+    """returns (data type, list of digests)"""
+    data_type = IHAVE_HEADER.unpack_from(msg)[3]
+    return data_type, split_digests(msg, IHAVE_HEADER.size)
+
+
+def encode_peer_graft(digests):
+    return HEADER.pack(HEADER.size + DIGEST_SIZE * len(digests), PEER_GRAFT) + b"".join(
+        digests
+    )
+
+
+def decode_peer_graft(msg):
+    """returns the list of digests"""
+    return split_digests(msg, HEADER.size)
+
+
+def encode_peer_prune():
+    return PEER_PRUNE_MESSAGE
+
+
+def encode_peer_digest(entries):
+    """entries is a list of at most MAX_DIGEST_ENTRIES (data type, digest)"""
+    body = b"".join(DIGEST_ENTRY.pack(*entry) for entry in entries)
+    return HEADER.pack(HEADER.size + len(body), PEER_DIGEST) + body
+
+
+def decode_peer_digest(msg):
+    """returns the list of (data type, digest)"""
+    return list(DIGEST_ENTRY.iter_unpack(msg[HEADER.size :]))
+
+
+def encode_peer_request(digests):
+    return HEADER.pack(
+        HEADER.size + DIGEST_SIZE * len(digests), PEER_REQUEST
+    ) + b"".join(digests)
+
+
+def decode_peer_request(msg):
+    """returns the list of digests"""
+    return split_digests(msg, HEADER.size)
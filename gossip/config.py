@@ -1,8 +1,13 @@
 """hanldes parsing the config.ini file and validating it and provides the Config class"""
 
 from configparser import ConfigParser
+import os
 import re
 
+from gossip.dissemination import FANOUT_MODES, MODES
+from gossip.log import LEVELS, logger as log
+from gossip.send_queue import OVERFLOW_POLICIES
+
 
 def is_valid_filepath(value):
     """Regex for file path validation"""
@@ -18,11 +23,73 @@ def is_valid_ip_port(value):
     return ip_port_regex.match(value) is not None
 
 
+def is_valid_optional_ip_port(value):
+    """IP:port or empty"""
+    return value == "" or is_valid_ip_port(value)
+
+
 def is_valid_challenge_difficulty(value):
     value = int(value)
     return value >= 0 and value <= 64
 
 
+def is_valid_challenge_difficulty_bits(value):
+    value = int(value)
+    return value >= 0 and value <= 256
+
+
+def is_valid_cache_mode(value):
+    return value in ("exact", "bloom")
+
+
+def is_valid_probability(value):
+    value = float(value)
+    return value > 0 and value < 1
+
+
+def is_valid_send_queue_policy(value):
+    return value in OVERFLOW_POLICIES
+
+
+def is_valid_dissemination(value):
+    return value in MODES
+
+
+def is_valid_fanout_mode(value):
+    return value in FANOUT_MODES
+
+
+def is_valid_eviction_policy(value):
+    return value in ("quality", "oldest", "reject")
+
+
+def is_valid_event_loop(value):
+    return value in ("asyncio", "uvloop")
+
+
+def is_valid_log_level(value):
+    return value in LEVELS
+
+
+def is_valid_max_pending_validations(value):
+    # message ids of GOSSIP_NOTIFICATION are 16 bit and 0 is reserved
+    value = int(value)
+    return value > 0 and value < 2**16
+
+
+def is_valid_store_segment_size(value):
+    # a segment has to hold at least one record with the largest possible payload
+    return int(value) >= 2**17
+
+
+def is_non_negative(value):
+    return int(value) >= 0
+
+
+def is_positive(value):
+    return int(value) > 0
+
+
 class Config:
     """Config class to hold config values"""
 
@@ -32,25 +99,120 @@ class Config:
         },
         "gossip": {
             "cache_size": [int],
+            "cache_ttl": [is_non_negative, int],
+            "cache_mode": [is_valid_cache_mode],
+            "cache_false_positive_rate": [is_valid_probability, float],
             "degree": [int],
             "bootstrapper": [is_valid_ip_port],
             "p2p_address": [is_valid_ip_port],
             "api_address": [is_valid_ip_port],
             "challenge_timeout": [int],
             "challenge_difficulty": [is_valid_challenge_difficulty, int],
+            "challenge_difficulty_bits": [is_valid_challenge_difficulty_bits, int],
             "discovery_cooldown": [int],
+            "send_queue_size": [is_positive, int],
+            "send_queue_policy": [is_valid_send_queue_policy],
+            "pow_workers": [is_non_negative, int],
+            "pow_chunk_size": [is_positive, int],
+            "log_level": [is_valid_log_level],
+            "validation_timeout": [is_positive, int],
+            "max_pending_validations": [is_valid_max_pending_validations, int],
+            "max_pending_validation_bytes": [is_positive, int],
+            "batch_window_ms": [is_non_negative, int],
+            "batch_max_messages": [is_positive, int],
+            "dissemination": [is_valid_dissemination],
+            "fanout": [is_non_negative, int],
+            "fanout_mode": [is_valid_fanout_mode],
+            "anti_entropy_interval": [is_non_negative, int],
+            "anti_entropy_max_digests": [is_positive, int],
+            "anti_entropy_max_bytes": [is_positive, int],
+            "store_path": [],
+            "store_segment_size": [is_valid_store_segment_size, int],
+            "store_segment_age": [is_positive, int],
+            "store_max_segments": [is_positive, int],
+            "peer_table_path": [],
+            "peer_table_size": [is_positive, int],
+            "dial_concurrency": [is_positive, int],
+            "dial_timeout": [is_positive, int],
+            "dial_backoff": [is_positive, int],
+            "dial_max_backoff": [is_positive, int],
+            "eviction_policy": [is_valid_eviction_policy],
+            "eviction_min_uptime": [is_non_negative, int],
+            "peer_exchange_sample": [is_non_negative, int],
+            "plumtree_graft_timeout_ms": [is_positive, int],
+            "plumtree_payload_cache_size": [is_positive, int],
+            "metrics_address": [is_valid_optional_ip_port],
+            "read_buffer_size": [is_positive, int],
+            "event_loop": [is_valid_event_loop],
+            "tcp_nodelay": [bool],
+            "reuse_port": [bool],
+            "listen_backlog": [is_positive, int],
+            "socket_send_buffer": [is_non_negative, int],
+            "socket_receive_buffer": [is_non_negative, int],
+            "workers": [is_positive, int],
+        },
+    }
+
+    # values used for keys that are allowed to be missing from the config file
+    configFileDefaults = {
+        "gossip": {
+            "cache_ttl": 0,
+            "cache_mode": "exact",
+            "cache_false_positive_rate": 0.001,
+            "challenge_difficulty_bits": None,
+            "send_queue_size": 1024,
+            "send_queue_policy": "drop_oldest",
+            "pow_workers": os.cpu_count() or 1,
+            "pow_chunk_size": 2**16,
+            "log_level": "INFO",
+            "validation_timeout": 30,
+            "max_pending_validations": 4096,
+            "max_pending_validation_bytes": 64 * 2**20,
+            "batch_window_ms": 0,
+            "batch_max_messages": 64,
+            "dissemination": "flood",
+            "fanout": 0,
+            "fanout_mode": "fixed",
+            "anti_entropy_interval": 0,
+            "anti_entropy_max_digests": 256,
+            "anti_entropy_max_bytes": 256 * 2**10,
+            "store_path": "",
+            "store_segment_size": 16 * 2**20,
+            "store_segment_age": 3600,
+            "store_max_segments": 4,
+            "peer_table_path": "",
+            "peer_table_size": 1024,
+            "dial_concurrency": 16,
+            "dial_timeout": 5,
+            "dial_backoff": 1,
+            "dial_max_backoff": 300,
+            "eviction_policy": "quality",
+            "eviction_min_uptime": 60,
+            "peer_exchange_sample": 32,
+            "plumtree_graft_timeout_ms": 500,
+            "plumtree_payload_cache_size": 4096,
+            "metrics_address": "",
+            "read_buffer_size": 16384,
+            "event_loop": "asyncio",
+            "tcp_nodelay": True,
+            "reuse_port": False,
+            "listen_backlog": 1024,
+            "socket_send_buffer": 0,
+            "socket_receive_buffer": 0,
+            "workers": 1,
         },
     }
 
     def __init__(self, config_file_path):
-        print("=====================================")
-        print(f"Reading config file from {config_file_path}")
+        log.info("Reading config file from %s", config_file_path)
         config = ConfigParser()
         config.read(config_file_path)
         self.__validate_config_file(config)
-        print(">>>> config file read and validated successfully <<<<")
-        print(vars(self))
-        print("=====================================")
+        if self.challenge_difficulty_bits is None:
+            # challenge_difficulty counts leading zero hex digits
+            self.challenge_difficulty_bits = 4 * self.challenge_difficulty
+        log.info("config file read and validated successfully")
+        log.debug("%s", vars(self))
 
     def __validate_config_file(self, config: ConfigParser):
         """Validate the config file"""
@@ -60,6 +222,11 @@ class Config:
 
             for option, validations in options.items():
                 if not config.has_option(section, option):
+                    defaults = self.configFileDefaults.get(section, {})
+                    if option in defaults:
+                        setattr(self, option, defaults[option])
+                        log.info("Setting %s to default %s", option, defaults[option])
+                        continue
                     raise ValueError(
                         f"Key '{option}' is missing in the '{section}' section"
                     )
@@ -71,6 +238,10 @@ class Config:
                         if validation == int:
                             int(value)
                             value = int(value)
+                        elif validation == float:
+                            value = float(value)
+                        elif validation == bool:
+                            value = config.getboolean(section, option)
                         elif not validation(value):
                             raise ValueError()
                 except ValueError as e:
@@ -78,4 +249,4 @@ class Config:
                         f"Invalid value for '{option}' in section '{section}'. "
                     ) from e
                 setattr(self, option, value)
-                print(f"Setting {option} to {value}")
+                log.info("Setting %s to %s", option, value)
@@ -0,0 +1,116 @@
+"""Outbound connections to peers"""
+
+import asyncio
+
+from gossip.log import PEER as log
+from gossip.p2p_connection import P2PConnection
+from gossip.sockets import open_connection
+
+# addresses in backoff beyond which the ones whose backoff ended are forgotten
+MAX_BACKOFF_ENTRIES = 10000
+
+
+class Dialer:
+    """Dials peer addresses in the background. At most dial_concurrency connects
+    run at the same time, each is given up after dial_timeout seconds. An address
+    that is already being dialed is not dialed again, and an address that failed is
+    not dialed again before its backoff ends, which starts at dial_backoff seconds
+    and doubles with every failure up to dial_max_backoff."""
+
+    def __init__(self, gossip):
+        self.gossip = gossip
+        config = gossip.config
+        self.timeout = config.dial_timeout
+        self.initial_backoff = config.dial_backoff
+        self.max_backoff = config.dial_max_backoff
+        self.slots = asyncio.Semaphore(config.dial_concurrency)
+
+        # key: (host, port), value: task of the dial
+        self.in_flight = {}
+        # key: (host, port), value: (failures, loop time before which it is not dialed)
+        self.backoff = {}
+
+        self.dials = 0
+        self.failures = 0
+
+    def dial(self, host, port, handed_over=False):
+        """start dialing an address, returns the task of the dial or None if the
+        address is already being dialed or in backoff. `handed_over` if a peer
+        evicted the connection to it for us (see P2PConnection.hand_over)"""
+        address = (host, int(port))
+        if address in self.in_flight:
+            return None
+        failed = self.backoff.get(address)
+        if failed is not None and asyncio.get_running_loop().time() < failed[1]:
+            log.debug("Not dialing %s:%s, backing off", host, port)
+            return None
+
+        task = asyncio.create_task(self.connect(*address, handed_over))
+        self.in_flight[address] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(address, None))
+        return task
+
+    def pending(self):
+        """dials that are connecting or in their handshake"""
+        return len(self.in_flight) + len(self.gossip.p2p_connections.dialed)
+
+    def missing(self):
+        """connections to dial to reach degree, besides the pending ones"""
+        connections = self.gossip.p2p_connections
+        return self.gossip.config.degree - len(connections) - self.pending()
+
+    async def dial_all(self, addresses):
+        """dial (host, port) addresses in parallel and wait until all dials ended"""
+        tasks = [self.dial(host, port) for host, port in addresses]
+        await asyncio.gather(*(task for task in tasks if task is not None))
+
+    async def connect(self, host, port, handed_over=False):
+        async with self.slots:
+            self.dials += 1
+            try:
+                log.info("Initiating p2p connection with %s:%s", host, port)
+                reader, writer = await asyncio.wait_for(
+                    open_connection(host, port, self.gossip.config), self.timeout
+                )
+            except Exception as e:
+                log.warning(
+                    "Error in initiating connection with %s:%s: %s", host, port, e
+                )
+                self.failed(host, port)
+                return
+
+        self.backoff.pop((host, port), None)
+
+        connection = P2PConnection(self.gossip, reader, writer, port, handed_over)
+
+        if not self.gossip.p2p_connections.add_unverified(connection):
+            log.info("Too many unverified connections, dropping %s:%s", host, port)
+            writer.close()
+            return
+
+        asyncio.create_task(connection.run())
+
+    def failed(self, host, port):
+        self.failures += 1
+        now = asyncio.get_running_loop().time()
+        failures = self.backoff.get((host, port), (0, 0))[0] + 1
+        delay = min(self.initial_backoff * 2 ** (failures - 1), self.max_backoff)
+        self.backoff[(host, port)] = (failures, now + delay)
+
+        if len(self.backoff) > MAX_BACKOFF_ENTRIES:
+            self.backoff = {
+                address: failed
+                for address, failed in self.backoff.items()
+                if failed[1] > now
+            }
+
+        if self.gossip.peer_table is not None:
+            self.gossip.peer_table.failed(host, port)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.in_flight),
+            "backoff": len(self.backoff),
+            "dials": self.dials,
+            "failures": self.failures,
+        }
@@ -0,0 +1,248 @@
+"""Forwarding of announces to peers.
+
+In "flood" mode every announce is pushed in full to every peer but its sender, or
+to `fanout` of them picked at random for each announce. With fanout_mode "adaptive"
+the fanout depends on where the announce is in its lifetime: its origin and the
+last peers allowed to forward it (ttl 1 is sent, so the receivers will not forward
+it) push it to twice as many peers, every other hop uses `fanout`. The cost of an
+announce then grows with `fanout` instead of with the number of connections.
+
+In "plumtree" mode (eager push / lazy pull) full announces only travel over eager
+connections, which form a spanning tree, the other (lazy) connections only get
+PEER_IHAVE with the digests of the announces. All connections start eager, a peer
+that sends us an announce we already have is told to stop with PEER_PRUNE and
+becomes lazy. A peer that announced a digest we do not receive in full within
+plumtree_graft_timeout_ms is asked for it with PEER_GRAFT, which also makes the
+connection eager again, so the tree repairs itself over the existing connections
+when a connection of it is lost. Peers that do not support the plumtree feature
+always get full announces."""
+
+import asyncio
+import random
+from collections import OrderedDict, deque
+
+from gossip.batching import join_messages
+from gossip.codec import (
+    MAX_DIGESTS,
+    encode_peer_announce,
+    encode_peer_graft,
+    encode_peer_ihave,
+    encode_peer_prune,
+)
+from gossip.log import P2P as log
+from gossip.messages_type import FEATURE_PLUMTREE
+
+FLOOD = "flood"
+PLUMTREE = "plumtree"
+
+MODES = (FLOOD, PLUMTREE)
+
+FIXED = "fixed"
+ADAPTIVE = "adaptive"
+
+FANOUT_MODES = (FIXED, ADAPTIVE)
+
+
+class MissingAnnounce:
+    """A digest announced with PEER_IHAVE whose announce has not arrived yet"""
+
+    __slots__ = ("announcers", "timer")
+
+    def __init__(self):
+        self.announcers = deque()
+        self.timer = None
+
+
+class Dissemination:
+
+    def __init__(self, gossip):
+        self.gossip = gossip
+        config = gossip.config
+        self.plumtree = config.dissemination == PLUMTREE
+        # features we advertise to peers
+        self.features = FEATURE_PLUMTREE if self.plumtree else 0
+
+        # 0 pushes to all peers
+        self.fanout = config.fanout
+        self.adaptive_fanout = config.fanout_mode == ADAPTIVE
+
+        self.graft_timeout = config.plumtree_graft_timeout_ms / 1000
+        self.max_payloads = config.plumtree_payload_cache_size
+
+        # key: digest, value: (ttl, data_type, data) of recently forwarded announces,
+        # sent to peers that ask for them with PEER_GRAFT or PEER_REQUEST
+        self.keep_payloads = self.plumtree or config.anti_entropy_interval > 0
+        self.payloads = OrderedDict()
+        # key: digest, value: MissingAnnounce
+        self.missing = {}
+
+        self.ihaves_sent = 0
+        self.grafts_sent = 0
+        self.prunes_sent = 0
+
+    def is_lazy(self, connection):
+        return (
+            self.plumtree
+            and connection.features & FEATURE_PLUMTREE
+            and not connection.eager
+        )
+
+    def broadcast(self, announces):
+        """send announces, a list of (digest, sender, ttl, data_type, data), to every
+        peer but their sender. Each peer gets all its announces as one message"""
+        if self.keep_payloads:
+            for digest, _, ttl, data_type, data in announces:
+                self.payloads[digest] = (ttl, data_type, data)
+                if len(self.payloads) > self.max_payloads:
+                    self.payloads.popitem(last=False)
+
+        store = self.gossip.store
+        if store is not None:
+            for digest, _, ttl, data_type, data in announces:
+                store.add_payload(digest, ttl, data_type, data)
+
+        peers = tuple(self.gossip.p2p_connections)
+        # key: connection, value: list of messages
+        outgoing = {}
+        # key: lazy connection, value: {data_type: list of digests}
+        lazy_digests = {}
+
+        for digest, sender, ttl, data_type, data in announces:
+            msg = encode_peer_announce(ttl, data_type, data)
+            targets = [connection for connection in peers if connection is not sender]
+            if not self.plumtree:
+                fanout = self.fanout_of(sender, ttl)
+                if 0 < fanout < len(targets):
+                    targets = random.sample(targets, fanout)
+
+            for connection in targets:
+                if self.is_lazy(connection):
+                    lazy_digests.setdefault(connection, {}).setdefault(
+                        data_type, []
+                    ).append(digest)
+                else:
+                    outgoing.setdefault(connection, []).append(msg)
+
+        for connection, digests in lazy_digests.items():
+            messages = outgoing.setdefault(connection, [])
+            for data_type, data_type_digests in digests.items():
+                for i in range(0, len(data_type_digests), MAX_DIGESTS):
+                    messages.append(
+                        encode_peer_ihave(
+                            data_type, data_type_digests[i : i + MAX_DIGESTS]
+                        )
+                    )
+                    self.ihaves_sent += 1
+
+        for connection, messages in outgoing.items():
+            log.debug(
+                "Sending %s messages to %s:%s",
+                len(messages),
+                connection.address,
+                connection.listening_port,
+            )
+            connection.send(join_messages(messages), len(messages))
+
+    def fanout_of(self, sender, ttl):
+        """number of peers an announce is pushed to, 0 for all of them"""
+        if self.fanout and self.adaptive_fanout and (sender is None or ttl == 1):
+            return 2 * self.fanout
+        return self.fanout
+
+    def on_announce(self, connection, digest, duplicate):
+        """called for every PEER_ANNOUNCE received from `connection`"""
+        if not self.plumtree:
+            return
+        if duplicate:
+            if connection.features & FEATURE_PLUMTREE and connection.eager:
+                log.debug(
+                    "Duplicate announce, pruning %s:%s",
+                    connection.address,
+                    connection.listening_port,
+                )
+                connection.eager = False
+                connection.send(encode_peer_prune())
+                self.prunes_sent += 1
+            return
+
+        missing = self.missing.pop(digest, None)
+        if missing is not None and missing.timer is not None:
+            missing.timer.cancel()
+
+    def on_ihave(self, connection, data_type, digests):
+        if not self.plumtree or not self.gossip.has_subscribers(data_type):
+            return
+        for digest in digests:
+            if digest in self.gossip.cache:
+                continue
+            missing = self.missing.get(digest)
+            if missing is None:
+                if len(self.missing) >= self.max_payloads:
+                    continue
+                missing = self.missing[digest] = MissingAnnounce()
+                missing.timer = asyncio.get_running_loop().call_later(
+                    self.graft_timeout, self.graft, digest
+                )
+            missing.announcers.append(connection)
+
+    def graft(self, digest):
+        """ask the next peer that announced `digest` for it"""
+        missing = self.missing.get(digest)
+        if missing is None:
+            return
+
+        connection = None
+        while missing.announcers:
+            announcer = missing.announcers.popleft()
+            if announcer in self.gossip.p2p_connections:
+                connection = announcer
+                break
+        if connection is None:
+            del self.missing[digest]
+            return
+
+        log.debug(
+            "Announce not received in time, grafting %s:%s",
+            connection.address,
+            connection.listening_port,
+        )
+        connection.eager = True
+        connection.send(encode_peer_graft([digest]))
+        self.grafts_sent += 1
+
+        if missing.announcers:
+            missing.timer = asyncio.get_running_loop().call_later(
+                self.graft_timeout, self.graft, digest
+            )
+        else:
+            del self.missing[digest]
+
+    def payload(self, digest):
+        """returns (ttl, data_type, data) of a forwarded announce, None if it is
+        neither kept in memory nor in the store"""
+        payload = self.payloads.get(digest)
+        if payload is None and self.gossip.store is not None:
+            payload = self.gossip.store.get(digest)
+        return payload
+
+    def on_graft(self, connection, digests):
+        connection.eager = True
+        messages = []
+        for digest in digests:
+            payload = self.payload(digest)
+            if payload is not None:
+                messages.append(encode_peer_announce(*payload))
+        if messages:
+            connection.send(join_messages(messages), len(messages))
+
+    def on_prune(self, connection):
+        connection.eager = False
+
+    def stats(self):
+        return {
+            "payloads": len(self.payloads),
+            "missing": len(self.missing),
+            "ihaves_sent": self.ihaves_sent,
+            "grafts_sent": self.grafts_sent,
+            "prunes_sent": self.prunes_sent,
+        }
@@ -0,0 +1,122 @@
+"""Choice of the connection that is closed when a new peer is verified while degree
+connections are open"""
+
+import asyncio
+
+from gossip.log import PEER as log
+
+# weight of a new round trip time sample in the moving average
+RTT_ALPHA = 0.25
+# round trip time at which the latency halves the score of a peer
+REFERENCE_RTT = 0.1
+# uptime in seconds after which a peer gets the full uptime weight
+FULL_UPTIME = 600
+
+
+class PeerStats:
+    """What a connection delivered since it was verified"""
+
+    __slots__ = ("verified_at", "rtt", "unique", "duplicates", "ping_sent")
+
+    def __init__(self):
+        self.verified_at = None
+        # moving average in seconds, None until measured
+        self.rtt = None
+        # PEER_ANNOUNCE messages that were new to us, and ones we already had
+        self.unique = 0
+        self.duplicates = 0
+        # loop time a request we time the answer of was sent at
+        self.ping_sent = None
+
+    def uptime(self, now):
+        if self.verified_at is None:
+            return 0
+        return now - self.verified_at
+
+    def add_rtt(self, rtt):
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            self.rtt += RTT_ALPHA * (rtt - self.rtt)
+
+    def ping(self):
+        self.ping_sent = asyncio.get_running_loop().time()
+
+    def pong(self):
+        """the answer to the timed request arrived"""
+        if self.ping_sent is not None:
+            self.add_rtt(asyncio.get_running_loop().time() - self.ping_sent)
+            self.ping_sent = None
+
+    def score(self, now):
+        """usefulness of a peer, higher is better. The share of unique messages
+        (Laplace smoothed, 0.5 without messages), weighted by the unique messages per
+        minute it delivers, its latency and how long it has been connected"""
+        uptime = self.uptime(now)
+        unique_ratio = (self.unique + 1) / (self.unique + self.duplicates + 2)
+        unique_rate = self.unique / max(uptime / 60, 1)
+        # peers without a sample are assumed to have the reference round trip time
+        rtt = REFERENCE_RTT if self.rtt is None else self.rtt
+        latency = 1 / (1 + rtt / REFERENCE_RTT)
+        longevity = 0.5 + 0.5 * min(uptime / FULL_UPTIME, 1)
+        return unique_ratio * (1 + unique_rate) * latency * longevity
+
+    def as_dict(self, now):
+        return {
+            "uptime": self.uptime(now),
+            "rtt": self.rtt,
+            "unique": self.unique,
+            "duplicates": self.duplicates,
+            "score": self.score(now),
+        }
+
+
+class RejectPolicy:
+    """Keep the existing connections, the new one is closed"""
+
+    def choose_victim(self, connections, newcomer):
+        return None
+
+
+class OldestPolicy:
+    """Close the connection that was verified first"""
+
+    def choose_victim(self, connections, newcomer):
+        return min(connections, key=lambda c: c.stats.verified_at, default=None)
+
+
+class QualityPolicy:
+    """Close the lowest scoring connection (see PeerStats.score) of those that have
+    been up for at least `min_uptime` seconds, so good long-lived peers stay and the
+    mesh converges towards fast, useful links. While no connection is that old, as
+    when the network is joining, the oldest one is closed. A new peer is never
+    turned away, it may be the only node that knows about it."""
+
+    def __init__(self, min_uptime):
+        self.min_uptime = min_uptime
+        self.fallback = OldestPolicy()
+
+    def choose_victim(self, connections, newcomer):
+        now = asyncio.get_running_loop().time()
+        candidates = [c for c in connections if c.stats.uptime(now) >= self.min_uptime]
+        if not candidates:
+            return self.fallback.choose_victim(connections, newcomer)
+
+        scores = {c: c.stats.score(now) for c in candidates}
+        victim = min(candidates, key=scores.get)
+        log.debug(
+            "Evicting %s:%s with score %.3f, average %.3f",
+            victim.address,
+            victim.listening_port,
+            scores[victim],
+            sum(scores.values()) / len(scores),
+        )
+        return victim
+
+
+def create_eviction_policy(config):
+    if config.eviction_policy == "reject":
+        return RejectPolicy()
+    if config.eviction_policy == "oldest":
+        return OldestPolicy()
+    return QualityPolicy(config.eviction_min_uptime)
@@ -0,0 +1,69 @@
+"""Reads the length prefixed frames of the API and P2P protocols from a stream"""
+
+import struct
+
+# size of the whole frame, including the size field itself
+SIZE = struct.Struct(">H")
+# size and message type, common to all messages
+HEADER = struct.Struct(">HH")
+
+
+class FrameReader:
+    """Reads from the stream in large chunks into one buffer and returns every frame as
+    a memoryview of that buffer, so frames are never copied or concatenated.
+
+    A returned frame is only valid until the next call of read_frame, since the buffer
+    is reused for the following frames. Handlers that keep a frame (or a slice of it)
+    around after that have to copy it with bytes()."""
+
+    def __init__(self, reader, min_size, buffer_size=16384):
+        self.reader = reader
+        self.min_size = min_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    async def read_frame(self):
+        while True:
+            available = self.end - self.start
+            needed = SIZE.size
+            if available >= SIZE.size:
+                size = SIZE.unpack_from(self.buffer, self.start)[0]
+                if size < self.min_size:
+                    raise Exception(f"Invalid message size {size}")
+                if available >= size:
+                    frame = self.view[self.start : self.start + size]
+                    self.start += size
+                    return frame
+                needed = size
+
+            await self.fill(needed)
+
+    async def fill(self, needed):
+        """read at least one more chunk, making room for `needed` bytes from start"""
+        available = self.end - self.start
+        if available == 0:
+            self.start = self.end = 0
+        elif self.start + needed > len(self.buffer):
+            if needed > len(self.buffer):
+                # frame does not fit, continue in a new buffer so that frames still
+                # referencing the old one are left untouched
+                buffer = bytearray(max(needed, 2 * len(self.buffer)))
+                buffer[:available] = self.view[self.start : self.end]
+                self.buffer = buffer
+                self.view = memoryview(buffer)
+            else:
+                self.buffer[:available] = bytes(self.view[self.start : self.end])
+            self.start = 0
+            self.end = available
+
+        chunk = await self.reader.read(len(self.buffer) - self.end)
+        if not chunk:
+            if available == 0:
+                raise ConnectionError("Connection closed")
+            raise ConnectionError(
+                f"Connection closed in the middle of a message => expected {needed} bytes, got {available} bytes"
+            )
+        self.buffer[self.end : self.end + len(chunk)] = chunk
+        self.end += len(chunk)
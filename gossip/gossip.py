@@ -1,42 +1,130 @@
 """Start gossip module."""
 
 import asyncio
-from collections import deque
+import atexit
+from gossip.api_connection import forward_announces
+from gossip.anti_entropy import AntiEntropy
 from gossip.api_server import APIServer
+from gossip.batching import create_batcher
+from gossip.cache import create_cache
 from gossip.config import Config
+from gossip.dialer import Dialer
+from gossip.eviction import create_eviction_policy
+from gossip.dissemination import Dissemination
+from gossip.log import logger as log, setup_logging
+from gossip.messages_type import FEATURE_BINARY_BROADCAST
+from gossip.metrics import Metrics, MetricsServer
 from gossip.p2p_server import P2PServer
+from gossip.peers import create_peer_table
+from gossip.pending import PendingValidations
+from gossip.pow import ProofOfWorkSolver
+from gossip.registry import ConnectionRegistry, SnapshotList, SubscriptionTable
+from gossip.store import create_store
 
 
 class Gossip:
     """Gossip class to start the gossip module."""
 
-    def __init__(self, config_file_path):
-        self.config = Config(config_file_path)
-        print("Gossip module started")
+    def __init__(self, config_file_path, cluster=None):
+        # an already read Config can be passed instead of its path, e.g. to start
+        # many nodes from one config (see gossip.simulation)
+        if isinstance(config_file_path, Config):
+            self.config = config_file_path
+        else:
+            self.config = Config(config_file_path)
+        setup_logging(self.config.log_level)
+        log.info("Gossip module started")
 
-        self.api_connections = []
-        self.api_connections_lock = asyncio.Lock()
+        # connection to the state shared with the other worker processes of the
+        # node, None if it runs in a single process (see gossip.cluster)
+        self.cluster = cluster
+        if cluster is not None:
+            cluster.gossip = self
 
-        # key: data_type, value: list of subscribed connections
-        self.subscriptions = {}
-        self.subscriptions_lock = asyncio.Lock()
+        # message counters and latency histograms, served if metrics_address is set
+        self.metrics = Metrics()
 
-        self.p2p_connections = deque(maxlen=self.config.degree)
-        self.p2p_connections_lock = asyncio.Lock()
+        # containers below are replaced as a whole on every change, handlers read
+        # them without locking (see gossip.registry)
+        self.api_connections = SnapshotList()
 
-        self.unverified_p2p_connections = deque(maxlen=self.config.degree)
-        self.unverified_p2p_connections_lock = asyncio.Lock()
+        # key: data_type, value: frozenset of subscribed connections
+        self.subscriptions = SubscriptionTable()
 
-        # key: message_id, value: [ttl, data_type, data, sender p2p_connection, [subscribers] ]
-        self.unvalidated_announces = {}
-        self.unvalidated_announces_lock = asyncio.Lock()
+        # verified and unverified connections, indexed by peer endpoint
+        self.p2p_connections = ConnectionRegistry(
+            self.config.degree, self.config.degree
+        )
 
-        self.cache = deque(maxlen=self.config.cache_size)
-        self.cache_lock = asyncio.Lock()
+        # picks the connection closed for a new peer when degree is reached
+        self.eviction_policy = create_eviction_policy(self.config)
+
+        # optional persistent table of known peers, dialed at startup
+        self.peer_table = create_peer_table(self.config)
+        if self.peer_table is not None:
+            atexit.register(self.peer_table.save)
+
+        # outbound connections, dialed in parallel with timeouts and backoff
+        self.dialer = Dialer(self)
+
+        # PEER_ANNOUNCE messages awaiting GOSSIP_VALIDATION from local subscribers
+        # entries are only changed between awaits
+        self.unvalidated_announces = PendingValidations(
+            self.config.validation_timeout,
+            self.config.max_pending_validations,
+            self.config.max_pending_validation_bytes,
+        )
+
+        # hashes of already seen PEER_ANNOUNCE messages
+        if cluster is not None:
+            self.cache = cluster.cache
+        else:
+            self.cache = create_cache(self.config)
+
+        # optional on-disk log of seen digests and forwarded payloads, reloaded
+        # into the cache so a restarted node does not accept duplicates again
+        self.store = create_store(self.config)
+        if self.store is not None:
+            self.store.load_digests(self.cache)
+            atexit.register(self.store.close)
+
+        # PEER_INIT challenges are solved on a process pool to keep the event loop free
+        self.pow_solver = ProofOfWorkSolver(
+            self.config.pow_workers, self.config.pow_chunk_size
+        )
+
+        # forwards announces to peers, by flooding or over a plumtree
+        self.dissemination = Dissemination(self)
+
+        # repairs announces peers missed by periodically exchanging digests
+        self.anti_entropy = AntiEntropy(self)
+
+        # optional protocol features we advertise to peers
+        self.features = (
+            FEATURE_BINARY_BROADCAST
+            | self.dissemination.features
+            | self.anti_entropy.features
+        )
+
+        # announces validated by all subscribers, forwarded to peers in batches
+        # if batching is enabled
+        self.validated_announces = create_batcher(
+            self.config, lambda entries: forward_announces(self, entries)
+        )
+
+    def has_subscribers(self, data_type):
+        """True if an API connection of this node, in any of its worker processes,
+        is subscribed to the data type"""
+        if self.subscriptions.subscribers(data_type):
+            return True
+        return self.cluster is not None and self.cluster.is_subscribed(data_type)
 
     async def run(self):
         asyncio.create_task(APIServer(self).run())
         asyncio.create_task(P2PServer(self).run())
+        asyncio.create_task(self.unvalidated_announces.run())
+        if self.config.metrics_address:
+            asyncio.create_task(MetricsServer(self).run())
 
         while True:
             await asyncio.sleep(1)
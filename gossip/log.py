@@ -0,0 +1,75 @@
+"""Loggers of the gossip module and their non-blocking output.
+
+Every subsystem logs through its own logger, messages use %-style arguments so
+they are only formatted when their level is enabled. Records are put on a queue
+and formatted and written by a background thread, a slow stdout never blocks
+the event loop."""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+
+import hexdump
+
+# parent of all loggers below, its level applies to all of them
+logger = logging.getLogger("gossip")
+
+API = logging.getLogger("gossip.API")
+P2P = logging.getLogger("gossip.P2P")
+PEER = logging.getLogger("gossip.PEER")
+
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+
+FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+listener = None
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread, records do not
+    leave the process so they don't need to be prepared for pickling"""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level="INFO", stream=None):
+    """Send all gossip loggers through a queue to `stream` (stdout by default),
+    can be called again to change the level"""
+    global listener
+
+    logger.setLevel(level)
+    if listener is not None:
+        return
+
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(FORMAT))
+
+    logger.addHandler(LocalQueueHandler(records))
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def pause_logging():
+    """write the queued records and stop the output thread, a process forked while
+    it runs would inherit the queue but not the thread"""
+    if listener is not None:
+        listener.stop()
+
+
+def resume_logging():
+    """start the output thread again after pause_logging"""
+    if listener is not None:
+        listener.start()
+
+
+def log_payload(log, data):
+    """hexdump of a payload, only at debug level"""
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("    Data: %s", hexdump.dump(data))
@@ -12,3 +12,21 @@ PEER_ANOUNCE = 507
 
 PEER_DISCOVER = 508
 PEER_BROADCAST = 509
+
+# used by the plumtree dissemination mode (see gossip.dissemination)
+PEER_IHAVE = 510
+PEER_GRAFT = 511
+PEER_PRUNE = 512
+
+# used by the anti-entropy exchange (see gossip.anti_entropy)
+PEER_DIGEST = 513
+PEER_REQUEST = 514
+
+# PEER_BROADCAST with packed addresses, sent to peers with FEATURE_BINARY_BROADCAST
+PEER_BROADCAST_V2 = 515
+
+# optional features, a peer advertises the ones it supports in the reserved field of
+# PEER_VERIFY or PEER_OK, a feature is used on a connection if both sides support it
+FEATURE_PLUMTREE = 0x1
+FEATURE_ANTI_ENTROPY = 0x2
+FEATURE_BINARY_BROADCAST = 0x4
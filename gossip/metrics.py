@@ -0,0 +1,309 @@
+"""Counters and latency histograms of the hot paths, served in the Prometheus text
+format over HTTP on metrics_address.
+
+Counting a message is a dictionary increment. Messages that are sent are counted by
+the writer task of the send queue once per batch, everything else (cache hit rate,
+pending validations, queue depths) is read from the stats of the components when
+the endpoint is scraped."""
+
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+
+from gossip import messages_type
+from gossip.log import logger as log
+
+# upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1,
+    5,
+    10,
+    30,
+)
+POW_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+# key: message type, value: its name in messages_type
+MESSAGE_NAMES = {
+    value: name
+    for name, value in vars(messages_type).items()
+    if name.startswith(("GOSSIP_", "PEER_")) and isinstance(value, int)
+}
+
+# keys of the dissemination, anti-entropy, dialer and store stats that are levels,
+# all other keys are counters that only grow
+STATS_GAUGES = frozenset(("payloads", "missing", "in_flight", "backoff", "segments"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Counts observations in buckets with fixed upper bounds"""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is for observations above the largest bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, help_text):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+def render_metric(name, metric_type, help_text, samples):
+    """lines of a metric from (labels, value) samples, labels is a dict"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        if labels:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+    return lines
+
+
+class Metrics:
+    """Counters updated by the connections"""
+
+    def __init__(self):
+        # key: message type, value: number of messages / bytes
+        self.messages_in = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.messages_out = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+
+        # solving the PEER_INIT challenge of a peer
+        self.pow_solve = Histogram(POW_BUCKETS)
+        # from reading a PEER_ANNOUNCE to queueing its GOSSIP_NOTIFICATION messages
+        self.announce_notification = Histogram(LATENCY_BUCKETS)
+        # from reading a PEER_ANNOUNCE to forwarding it after all validations
+        self.announce_forward = Histogram(LATENCY_BUCKETS)
+
+    def received(self, msg_type, size):
+        self.messages_in[msg_type] += 1
+        self.bytes_in[msg_type] += size
+
+    def sent(self, parts):
+        """count the messages in the parts written to a socket. Every part starts a
+        message or continues the previous one, and messages start with their size"""
+        remaining = 0
+        for part in parts:
+            offset = 0
+            length = len(part)
+            while offset < length:
+                if remaining == 0:
+                    size = int.from_bytes(part[offset : offset + 2], "big")
+                    msg_type = int.from_bytes(part[offset + 2 : offset + 4], "big")
+                    self.messages_out[msg_type] += 1
+                    self.bytes_out[msg_type] += size
+                    remaining = size
+                step = min(remaining, length - offset)
+                offset += step
+                remaining -= step
+
+    def render(self, gossip):
+        """the metrics in the Prometheus text format"""
+        lines = []
+
+        def by_type(counts):
+            return [
+                ({"type": MESSAGE_NAMES.get(t, str(t))}, count)
+                for t, count in sorted(counts.items())
+            ]
+
+        lines += render_metric(
+            "gossip_messages_received_total",
+            "counter",
+            "Messages received by message type",
+            by_type(self.messages_in),
+        )
+        lines += render_metric(
+            "gossip_bytes_received_total",
+            "counter",
+            "Bytes received by message type",
+            by_type(self.bytes_in),
+        )
+        lines += render_metric(
+            "gossip_messages_sent_total",
+            "counter",
+            "Messages written to sockets by message type",
+            by_type(self.messages_out),
+        )
+        lines += render_metric(
+            "gossip_bytes_sent_total",
+            "counter",
+            "Bytes written to sockets by message type",
+            by_type(self.bytes_out),
+        )
+
+        cache = gossip.cache.stats()
+        lookups = cache["hits"] + cache["misses"]
+        lines += render_metric(
+            "gossip_cache_lookups_total",
+            "counter",
+            "Lookups in the seen message cache",
+            [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])],
+        )
+        lines += render_metric(
+            "gossip_cache_hit_ratio",
+            "gauge",
+            "Share of cache lookups that found a duplicate",
+            [({}, cache["hits"] / lookups if lookups else 0)],
+        )
+        lines += render_metric(
+            "gossip_cache_entries",
+            "gauge",
+            "Entries in the cache",
+            [({}, cache["size"])],
+        )
+
+        pending = gossip.unvalidated_announces.stats()
+        lines += render_metric(
+            "gossip_pending_validations",
+            "gauge",
+            "Announces awaiting validation",
+            [({}, pending["pending"])],
+        )
+        lines += render_metric(
+            "gossip_pending_validation_bytes",
+            "gauge",
+            "Payload bytes of announces awaiting validation",
+            [({}, pending["bytes"])],
+        )
+        lines += render_metric(
+            "gossip_validations_total",
+            "counter",
+            "Announces that left the pending validations",
+            [
+                ({"result": result}, pending[result])
+                for result in ("validated", "expired", "evicted")
+            ],
+        )
+
+        p2p = list(gossip.p2p_connections.connections())
+        lines += render_metric(
+            "gossip_connections",
+            "gauge",
+            "Open connections",
+            [
+                ({"kind": "p2p"}, len(p2p)),
+                (
+                    {"kind": "p2p_unverified"},
+                    len(gossip.p2p_connections.unverified_connections()),
+                ),
+                ({"kind": "api"}, len(gossip.api_connections)),
+            ],
+        )
+        queues = [
+            ({"kind": "p2p", "peer": f"{c.address}:{c.listening_port}"}, c.send_queue)
+            for c in p2p
+        ] + [
+            ({"kind": "api", "peer": f"{c.address}:{c.port}"}, c.send_queue)
+            for c in gossip.api_connections
+        ]
+        lines += render_metric(
+            "gossip_send_queue_depth",
+            "gauge",
+            "Messages queued for a connection",
+            [(labels, queue.depth) for labels, queue in queues],
+        )
+        lines += render_metric(
+            "gossip_send_queue_dropped_total",
+            "counter",
+            "Messages dropped because the send queue of a connection was full",
+            [(labels, queue.dropped) for labels, queue in queues],
+        )
+
+        for prefix, stats in (
+            ("gossip_dissemination", gossip.dissemination.stats()),
+            ("gossip_anti_entropy", gossip.anti_entropy.stats()),
+            ("gossip_dialer", gossip.dialer.stats()),
+            ("gossip_store", gossip.store.stats() if gossip.store else {}),
+        ):
+            for key, value in stats.items():
+                if key in STATS_GAUGES:
+                    name, metric_type = f"{prefix}_{key}", "gauge"
+                else:
+                    name, metric_type = f"{prefix}_{key}_total", "counter"
+                lines += render_metric(
+                    name, metric_type, key.replace("_", " "), [({}, value)]
+                )
+
+        lines += self.pow_solve.render(
+            "gossip_pow_solve_seconds", "Time to solve the PEER_INIT challenge"
+        )
+        lines += self.announce_notification.render(
+            "gossip_announce_notification_seconds",
+            "Time from receiving a PEER_ANNOUNCE to queueing its notifications",
+        )
+        lines += self.announce_forward.render(
+            "gossip_announce_forward_seconds",
+            "Time from receiving a PEER_ANNOUNCE to forwarding it after validation",
+        )
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Minimal HTTP server answering every GET with the metrics"""
+
+    def __init__(self, gossip):
+        self.gossip = gossip
+        self.host, self.port = gossip.config.metrics_address.rsplit(":", 1)
+
+    async def on_connection(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            if request.startswith(b"GET "):
+                status = "200 OK"
+                body = self.gossip.metrics.render(self.gossip).encode()
+            else:
+                status = "405 Method Not Allowed"
+                body = b""
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except Exception as e:
+            log.debug("Error in serving metrics: %s", e)
+        finally:
+            writer.close()
+
+    async def run(self):
+        try:
+            server = await asyncio.start_server(
+                self.on_connection, self.host, self.port
+            )
+
+            log.info("Metrics server listening on %s:%s", self.host, self.port)
+
+            async with server:
+                await server.serve_forever()
+        except Exception as e:
+            log.error(
+                "Error in starting metrics server on %s:%s: %s", self.host, self.port, e
+            )
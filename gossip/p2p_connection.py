@@ -1,89 +1,217 @@
 import hashlib
 import random
-import struct
 import time
-import hexdump
 import asyncio
 
+from gossip.codec import (
+    decode_header,
+    decode_peer_announce,
+    decode_peer_broadcast,
+    decode_peer_broadcast_v2,
+    decode_peer_digest,
+    decode_peer_graft,
+    decode_peer_ihave,
+    decode_peer_init,
+    decode_peer_ok,
+    decode_peer_request,
+    decode_peer_verify,
+    encode_gossip_notification,
+    encode_peer_broadcast,
+    encode_peer_broadcast_v2,
+    encode_peer_init,
+    encode_peer_ok,
+    encode_peer_verify,
+)
 from gossip.messages_type import (
-    GOSSIP_NOTIFICATION,
+    FEATURE_BINARY_BROADCAST,
     PEER_ANOUNCE,
     PEER_BROADCAST,
+    PEER_BROADCAST_V2,
     PEER_DISCOVER,
     PEER_INIT,
     PEER_VERIFY,
     PEER_OK,
+    PEER_IHAVE,
+    PEER_GRAFT,
+    PEER_PRUNE,
+    PEER_DIGEST,
+    PEER_REQUEST,
 )
+from gossip.eviction import PeerStats
+from gossip.pow import is_valid_nonce
+from gossip.framing import FrameReader
+from gossip.log import P2P as log, PEER as peer_log, log_payload
+from gossip.send_queue import SendQueue
 
 
 class P2PConnection:
 
-    def __init__(self, gossip, reader, writer, listening_port):
+    def __init__(self, gossip, reader, writer, listening_port, handed_over=False):
         self.gossip = gossip
         self.reader = reader
         self.writer = writer
+        # messages are at least 4 bytes long
+        self.frames = FrameReader(reader, 4, gossip.config.read_buffer_size)
 
         peername = writer.get_extra_info("peername")
         self.address = peername[0]
         self.port = peername[1]
         self.listening_port = listening_port
+        # connections we dialed know the listening port of the peer from the start
+        self.outbound = listening_port is not None
+        # whether we dialed it because a peer evicted it for us, see hand_over
+        self.handed_over = handed_over
         self.challenge_sent = None
         self.challenge_timeout = None
         self.validated = False
+        # features supported by both sides, known once the handshake is done
+        self.features = 0
+        # whether full announces are pushed over this connection in plumtree mode
+        self.eager = True
+        # whether our PEER_DISCOVER was not answered yet
+        self.discovering = False
+
+        # start of the handshake, to measure its latency
+        self.created = asyncio.get_running_loop().time()
+        # measured quality of the peer, used to pick a connection to evict
+        self.stats = PeerStats()
+
+        self.send_queue = SendQueue(
+            f"P2P {self.address}:{self.port}",
+            writer,
+            gossip.config.send_queue_size,
+            gossip.config.send_queue_policy,
+            self.close_connection,
+            gossip.metrics,
+        )
+
+    def send(self, message, count=1):
+        """queue a message to be sent to the peer without waiting for it,
+        `count` is the number of messages joined into it"""
+        return self.send_queue.put(message, count)
 
     async def close_connection(self):
-        print(f"[-][P2P] Closing connection with {self.address}:{self.port}")
+        log.info("Closing connection with %s:%s", self.address, self.port)
+        self.send_queue.close()
         self.writer.close()
-        async with self.gossip.p2p_connections_lock:
-            if self in self.gossip.p2p_connections:
-                self.gossip.p2p_connections.remove(self)
-        async with self.gossip.unverified_p2p_connections_lock:
-            if self in self.gossip.p2p_connections:
-                self.gossip.unverified_p2p_connections.remove(self)
+        self.gossip.p2p_connections.remove(self)
+
+    def initiator(self):
+        """endpoint of the side that opened the connection"""
+        if self.outbound:
+            host, port = self.gossip.config.p2p_address.split(":")
+            return host, int(port)
+        return self.address, int(self.listening_port)
+
+    def mark_verified(self):
+        """move the connection from the unverified to the verified connections once
+        the handshake is done, raises if it cannot be added. Returns the connection
+        that was evicted to make room for it, or None"""
+        connections = self.gossip.p2p_connections
+
+        existing = connections.get(self.address, self.listening_port)
+        if existing is not None:
+            # both peers dialed each other, both keep the connection opened by the
+            # peer with the lower endpoint
+            if existing.outbound == self.outbound or (
+                existing.initiator() < self.initiator()
+            ):
+                raise Exception("[-][P2P] Already connected to this peer")
+            peer_log.info(
+                "Replacing connection with %s:%s", existing.address, existing.port
+            )
+            connections.remove(existing)
+            existing.send_queue.close()
+            existing.writer.close()
+
+        victim = None
+        spare = 0
+        # slots are kept for our dials in progress, each may bring the connection
+        # a full peer evicts for us too (see hand_over)
+        reserved = 0 if self.outbound else 2 * self.gossip.dialer.pending()
+        if self.handed_over:
+            # evicting for a connection that was handed over would hand over yet
+            # another one, it may take the node one above degree instead
+            spare = 1
+        elif connections and len(connections) + reserved >= connections.max_verified:
+            victim = self.gossip.eviction_policy.choose_victim(
+                connections.connections(), self
+            )
+            if victim is None:
+                raise Exception("[-][P2P] Maximum number of connections reached")
+            peer_log.info(
+                "Evicting connection with %s:%s", victim.address, victim.listening_port
+            )
+            connections.remove(victim)
+            victim.send_queue.close()
+            victim.writer.close()
+
+        if not connections.verify(self, spare):
+            raise Exception("[-][P2P] Maximum number of connections reached")
+        self.validated = True
+        self.stats.verified_at = asyncio.get_running_loop().time()
+
+        peer_table = self.gossip.peer_table
+        if peer_table is not None:
+            latency = asyncio.get_running_loop().time() - self.created
+            peer_table.connected(self.address, self.listening_port, latency)
+        return victim
+
+    def hand_over(self, victim):
+        """tell the new peer the address of the connection evicted for it. The new
+        peer dials it, so the evicted peer is connected again through the new one
+        and an eviction does not split the overlay"""
+        if victim is None:
+            return
+        peer_log.debug(
+            "Handing %s:%s over to %s:%s",
+            victim.address,
+            victim.listening_port,
+            self.address,
+            self.listening_port,
+        )
+        self.send(self.encode_broadcast([(victim.address, int(victim.listening_port))]))
+
+    def encode_broadcast(self, addresses):
+        """PEER_BROADCAST of (host, port) addresses in the version the peer reads"""
+        if self.features & FEATURE_BINARY_BROADCAST:
+            return encode_peer_broadcast_v2(addresses)
+        return encode_peer_broadcast([f"{host}:{port}" for host, port in addresses])
 
     async def send_peer_init(self):
         self.challenge_sent = random.getrandbits(64)
         self.challenge_timeout = time.time() + self.gossip.config.challenge_timeout
 
-        message = struct.pack(">HHQ", 12, PEER_INIT, self.challenge_sent)
-        print(f"[+][PEER] Sending PEER_CHALLENGE to: {self.address}:{self.port}")
-        self.writer.write(message)
-        await self.writer.drain()
+        message = encode_peer_init(self.challenge_sent)
+        peer_log.debug("Sending PEER_CHALLENGE to: %s:%s", self.address, self.port)
+        self.send(message)
 
     async def run(self):
         """listen for incoming messages"""
 
-        print(f"[+][P2P] Connection established with {self.address}:{self.port}")
+        log.info("Connection established with %s:%s", self.address, self.port)
+        self.send_queue.start()
 
         if self.listening_port is None:
             await self.send_peer_init()
 
         while True:
             try:
-                msg_size_bytes = await self.reader.read(2)
-                msg_size = struct.unpack(">H", msg_size_bytes)[0]
-                if msg_size < 4 or msg_size > 65535:
-                    raise Exception(f"[-][P2P] Invalid message size {msg_size}")
-                msg = msg_size_bytes + await self.reader.read(msg_size - 2)
-                if len(msg) != (msg_size):
-                    raise Exception(
-                        f"[-][P2P] Incomplete message received from {self.address}:{self.port}=> expected {msg_size} bytes, got {len(msg)} bytes"
-                    )
-                print("++++++++++++++++++++")
+                msg = await self.frames.read_frame()
                 await self.handle_message(msg)
             except Exception as e:
-                print(
-                    f"[-][P2P] Error in Connection with {self.address}:{self.port} \n Exception: {e}"
+                log.warning(
+                    "Error in Connection with %s:%s => %s", self.address, self.port, e
                 )
                 await self.close_connection()
                 break
-            print("++++++++++++++++++++")
 
     async def handle_message(self, msg):
         """handle incoming message"""
-        print(f"[+][P2P] Packet arrived from {self.address}:{self.port}")
+        log.debug("Packet arrived from %s:%s", self.address, self.port)
 
-        msg_type = struct.unpack(">H", msg[2:4])[0]
+        size, msg_type = decode_header(msg)
+        self.gossip.metrics.received(msg_type, size)
 
         def check_validated(msg_type):
             if not self.validated:
@@ -92,11 +220,12 @@ class P2PConnection:
                 )
 
         if msg_type == PEER_INIT:  # nonce
-            asyncio.create_task(self.handle_peer_init(msg))
+            # frames are only valid until the next one is read, the task outlives it
+            asyncio.create_task(self.handle_peer_init(bytes(msg)))
         elif msg_type == PEER_VERIFY:
             await self.handle_peer_verify(msg)
         elif msg_type == PEER_OK:
-            await self.handle_peer_ok()
+            await self.handle_peer_ok(msg)
         elif msg_type == PEER_ANOUNCE:
             check_validated("PEER_ANOUNCE")
             await self.handle_peer_announce(msg)
@@ -105,7 +234,25 @@ class P2PConnection:
             await self.handle_peer_discover()
         elif msg_type == PEER_BROADCAST:
             check_validated("PEER_BROADCAST")
-            await self.handle_peer_broadcast(msg)
+            await self.handle_peer_broadcast(decode_peer_broadcast(msg))
+        elif msg_type == PEER_BROADCAST_V2:
+            check_validated("PEER_BROADCAST_V2")
+            await self.handle_peer_broadcast(decode_peer_broadcast_v2(msg))
+        elif msg_type == PEER_IHAVE:
+            check_validated("PEER_IHAVE")
+            self.gossip.dissemination.on_ihave(self, *decode_peer_ihave(msg))
+        elif msg_type == PEER_GRAFT:
+            check_validated("PEER_GRAFT")
+            self.gossip.dissemination.on_graft(self, decode_peer_graft(msg))
+        elif msg_type == PEER_PRUNE:
+            check_validated("PEER_PRUNE")
+            self.gossip.dissemination.on_prune(self)
+        elif msg_type == PEER_DIGEST:
+            check_validated("PEER_DIGEST")
+            self.gossip.anti_entropy.on_digest(self, decode_peer_digest(msg))
+        elif msg_type == PEER_REQUEST:
+            check_validated("PEER_REQUEST")
+            self.gossip.anti_entropy.on_request(self, decode_peer_request(msg))
 
         else:
             raise Exception(
@@ -114,49 +261,51 @@ class P2PConnection:
 
     async def handle_peer_init(self, msg):
 
-        print(f"[+][P2P] PEER_CHALLENGE from {self.address}:{self.port}")
+        peer_log.debug("PEER_CHALLENGE from %s:%s", self.address, self.port)
 
         try:
 
-            challenge = int(struct.unpack(">Q", msg[4:])[0]).to_bytes(8, "big")
-            print(f"    [+] Challenge: {challenge}")
+            challenge = decode_peer_init(msg).to_bytes(8, "big")
+            peer_log.debug("    Challenge: %s", challenge)
 
-            difficulty = self.gossip.config.challenge_difficulty
+            difficulty_bits = self.gossip.config.challenge_difficulty_bits
             our_listening_port = int(self.gossip.config.p2p_address.split(":")[1])
-            our_listening_port_bytes = our_listening_port.to_bytes(2, "big")
-
-            print(f"[+][P2P] Finding nonce")
-            nonce = None
-            for trial in range(2**64):
-
-                hash = hashlib.sha256(
-                    (challenge + trial.to_bytes(8, "big") + our_listening_port_bytes)
-                ).hexdigest()
 
-                if hash[:difficulty] == "0" * difficulty:
-                    nonce = trial
-                    print(f"[+] Found nonce {nonce}")
-                    print(f"[+] hash(challenge + nonce + our_listening_port) => {hash}")
-                    break
+            peer_log.debug("Finding nonce")
+            started = asyncio.get_running_loop().time()
+            try:
+                nonce = await self.gossip.pow_solver.solve(
+                    challenge,
+                    our_listening_port,
+                    difficulty_bits,
+                    self.gossip.config.challenge_timeout,
+                )
+            except asyncio.TimeoutError:
+                raise Exception("[-] Could not find a nonce before challenge timeout")
 
             if nonce is None:
                 raise Exception("[-] Could not find a nonce")
+            self.gossip.metrics.pow_solve.observe(
+                asyncio.get_running_loop().time() - started
+            )
+            peer_log.debug("Found nonce %s", nonce)
 
-            message = struct.pack(
-                ">HHHHQ", 16, PEER_VERIFY, 0, our_listening_port, nonce
+            message = encode_peer_verify(
+                our_listening_port, nonce, self.gossip.features
             )
-            print(f"[+][P2P] Sending PEER_VERIFY to {self.address}:{self.port}")
-            self.writer.write(message)
-            await self.writer.drain()
+            peer_log.debug("Sending PEER_VERIFY to %s:%s", self.address, self.port)
+            # PEER_OK follows right after the nonce is checked, a round trip sample
+            self.stats.ping()
+            self.send(message)
 
         except Exception as e:
-            print(
-                f"[-][P2P] Error in handling PEER_CHALLENGE from {self.address}:{self.port}"
+            peer_log.warning(
+                "Error in handling PEER_CHALLENGE from %s:%s", self.address, self.port
             )
             raise e
 
     async def handle_peer_verify(self, msg):
-        print(f"[+][P2P] PEER_VERIFY from {self.address}:{self.port} =>\n")
+        peer_log.debug("PEER_VERIFY from %s:%s", self.address, self.port)
 
         try:
             if self.challenge_sent is None or self.listening_port is not None:
@@ -165,274 +314,230 @@ class P2PConnection:
             if time.time() > self.challenge_timeout:
                 raise Exception("[-][P2P] Received nonce after timeout")
 
-            listening_port, nonce = struct.unpack(">HQ", msg[6:])
-            print(f"    [+] listening_port: {listening_port}")
-            print(f"    [+] nonce: {nonce}")
+            listening_port, nonce, features = decode_peer_verify(msg)
+            peer_log.debug("    listening_port: %s, nonce: %s", listening_port, nonce)
 
-            hash = hashlib.sha256(
-                self.challenge_sent.to_bytes(8, "big")
-                + nonce.to_bytes(8, "big")
-                + listening_port.to_bytes(2, "big")
-            ).hexdigest()
-
-            print(f"hash : {hash}")
-
-            difficulty = self.gossip.config.challenge_difficulty
-            if not hash[:difficulty] == "0" * difficulty:
+            if not is_valid_nonce(
+                self.challenge_sent.to_bytes(8, "big"),
+                nonce,
+                listening_port,
+                self.gossip.config.challenge_difficulty_bits,
+            ):
                 raise Exception("[-][P2P] Received invalid nonce")
 
             self.listening_port = listening_port
-            print(f"[+][P2P] Sending PEER_OK to {self.address}:{self.listening_port}")
-
-            async with self.gossip.unverified_p2p_connections_lock:
-                async with self.gossip.p2p_connections_lock:
-                    self.gossip.unverified_p2p_connections.remove(self)
-
-                    if (
-                        len(self.gossip.p2p_connections)
-                        >= self.gossip.p2p_connections.maxlen
-                    ):
-                        popped_connection = self.gossip.p2p_connections.popleft()
-                        popped_connection.writer.close()
-                        print(
-                            f"[-][P2P] Popped connection with {popped_connection.address}:{popped_connection.listening_port}"
-                        )
+            self.features = features & self.gossip.features
+            peer_log.debug(
+                "Sending PEER_OK to %s:%s", self.address, self.listening_port
+            )
 
-                    self.gossip.p2p_connections.append(self)
-            self.validated = True
+            victim = self.mark_verified()
 
-            message = struct.pack(">HH", 4, PEER_OK)
-            self.writer.write(message)
-            await self.writer.drain()
+            self.send(encode_peer_ok(self.gossip.features))
+            self.hand_over(victim)
 
         except Exception as e:
-            print(
-                f"[-][P2P] Error in handling PEER_VERIFY from {self.address}:{self.port}"
+            peer_log.warning(
+                "Error in handling PEER_VERIFY from %s:%s", self.address, self.port
             )
             raise e
 
-    async def handle_peer_ok(self):
-        print(f"[+][P2P] PEER_OK from {self.address}:{self.port}")
+    async def handle_peer_ok(self, msg):
+        peer_log.debug("PEER_OK from %s:%s", self.address, self.port)
 
         try:
             if self.challenge_sent is not None:
                 raise Exception("[-][P2P] not expecting this message at this time")
 
-            async with self.gossip.unverified_p2p_connections_lock:
-                async with self.gossip.p2p_connections_lock:
-                    self.gossip.unverified_p2p_connections.remove(self)
-
-                    if (
-                        len(self.gossip.p2p_connections)
-                        >= self.gossip.p2p_connections.maxlen
-                    ):
-                        popped_connection = self.gossip.p2p_connections.popleft()
-                        popped_connection.writer.close()
-                        print(
-                            f"[-][P2P] Popped connection with {popped_connection.address}:{popped_connection.listening_port}"
-                        )
-
-                    self.gossip.p2p_connections.append(self)
-            self.validated = True
+            self.stats.pong()
+            self.features = decode_peer_ok(msg) & self.gossip.features
+            self.hand_over(self.mark_verified())
 
         except Exception as e:
-            print(f"[-][P2P] Error in handling PEER_OK from {self.address}:{self.port}")
+            peer_log.warning(
+                "Error in handling PEER_OK from %s:%s", self.address, self.port
+            )
             raise e
 
     async def handle_peer_announce(self, msg):
-        print(f"[+][P2P] PEER_ANNOUNCE from {self.address}:{self.listening_port}")
+        log.debug("PEER_ANNOUNCE from %s:%s", self.address, self.listening_port)
+        received = asyncio.get_running_loop().time()
 
         try:
 
-            ttl = struct.unpack(">B", msg[4:5])[0]
-            data_type = struct.unpack(">H", msg[6:8])[0]
-            data = msg[8:]
+            ttl, data_type, data = decode_peer_announce(msg)
 
-            print(f"    [+] Data type: {data_type}")
-            print(f"    [+] TTL: {ttl}")
-            print(f"    [+] Data: {hexdump.dump(data)}")
+            log.debug("    Data type: %s, TTL: %s", data_type, ttl)
+            log_payload(log, data)
 
-            subscribers = []
-            async with self.gossip.subscriptions_lock:
-                if not (
-                    data_type in self.gossip.subscriptions
-                    and self.gossip.subscriptions[data_type]
-                ):
-                    print(
-                        f"[-][P2P] No subscribers for data type {data_type}. Discarding message from {self.address}:{self.listening_port}"
-                    )
-                    return
-                subscribers = self.gossip.subscriptions[data_type].copy()
-
-            message_hash = hashlib.sha1(msg[6:]).digest()
-            async with self.gossip.cache_lock:
-                if message_hash in self.gossip.cache:
-                    print(
-                        f"[+] Message already in cache. Discarding message from {self.address}:{self.listening_port}"
-                    )
-                    return
-                self.gossip.cache.append(message_hash)
+            subscribers = self.gossip.subscriptions.subscribers(data_type)
+            cluster = self.gossip.cluster
+            if not self.gossip.has_subscribers(data_type):
+                log.debug(
+                    "No subscribers for data type %s. Discarding message from %s:%s",
+                    data_type,
+                    self.address,
+                    self.listening_port,
+                )
+                return
+
+            # the digest of the data type and data, same as announce_digest
+            digest = hashlib.sha1(msg[6:]).digest()
+            duplicate = self.gossip.cache.check_and_add(digest)
+            if duplicate:
+                self.stats.duplicates += 1
+            else:
+                self.stats.unique += 1
+            self.gossip.dissemination.on_announce(self, digest, duplicate)
+            if duplicate:
+                log.debug(
+                    "Message already in cache. Discarding message from %s:%s",
+                    self.address,
+                    self.listening_port,
+                )
+                return
 
-            message_id = random.randint(1, 2**16 - 1)
+            if self.gossip.store is not None:
+                self.gossip.store.add_digest(digest)
 
-            if ttl != 1:
+            # one copy of the payload out of the frame buffer, shared by all recipients
+            data = bytes(data)
+            # messages that are not forwarded do not wait for validation
+            message_id = 0
+            forward = ttl != 1
+
+            if forward:
                 if ttl > 1:
                     ttl = ttl - 1
-                async with self.gossip.unvalidated_announces_lock:
-                    while message_id in self.gossip.unvalidated_announces:
-                        message_id = random.randint(0, 2**16 - 1)
-
-                    self.gossip.unvalidated_announces[message_id] = [
-                        ttl,
-                        data_type,
-                        data,
-                        self,
-                        subscribers,
-                    ]
-
-            gossip_notification_message = (
-                struct.pack(
-                    ">HHHH",
-                    8 + len(data),
-                    GOSSIP_NOTIFICATION,
-                    message_id,
-                    data_type,
+                if subscribers:
+                    message_id = self.gossip.unvalidated_announces.add(
+                        ttl, data_type, data, self, subscribers, digest
+                    )
+
+            if cluster is not None:
+                # the other workers notify their subscribers, all workers forward
+                # the announce once the subscribers of all of them validated it
+                cluster.announce(
+                    digest, self, ttl, data_type, data, forward, message_id != 0
                 )
-                + data
+
+            gossip_notification_message = encode_gossip_notification(
+                message_id, data_type, data
             )
 
             for connection in subscribers:
-                try:
-                    print(
-                        f"[+][API] Sending GOSSIP_NOTIFICATION to {connection.address}:{connection.port}"
-                    )
-                    connection.writer.write(gossip_notification_message)
-                    await connection.writer.drain()
-                except Exception as e:
-                    print(
-                        f"[-][API] Error in sending GOSSIP_NOTIFICATION to {connection.address}:{connection.port}: {e}"
-                    )
+                log.debug(
+                    "Sending GOSSIP_NOTIFICATION to %s:%s",
+                    connection.address,
+                    connection.port,
+                )
+                connection.notify(gossip_notification_message)
+
+            self.gossip.metrics.announce_notification.observe(
+                asyncio.get_running_loop().time() - received
+            )
 
         except Exception as e:
-            print(
-                f"[-][P2P] Error in handling PEER_ANNOUNCE from {self.address}:{self.listening_port}"
+            log.warning(
+                "Error in handling PEER_ANNOUNCE from %s:%s",
+                self.address,
+                self.listening_port,
             )
             raise e
 
     async def handle_peer_discover(self):
-        print(f"[+][P2P] PEER_DISCOVER from {self.address}:{self.listening_port}")
+        peer_log.debug("PEER_DISCOVER from %s:%s", self.address, self.listening_port)
 
         try:
-            async with self.gossip.p2p_connections_lock:
-                addresses = []
-                for connection in self.gossip.p2p_connections:
-                    if not (
-                        connection.address == self.address
-                        and int(connection.listening_port) == int(self.listening_port)
-                    ):
-                        addresses.append(
-                            f"{connection.address}:{connection.listening_port}"
-                        )
-
-                if len(addresses) == 0:
-                    print(
-                        f"[+][P2P] No addresses known to send to {self.address}:{self.listening_port}"
-                    )
-                    return
-
-                addresses_bytes = (",".join(addresses)).encode("utf-8")
-
-                peer_broadcast_msg = (
-                    struct.pack(">HH", 4 + len(addresses_bytes), PEER_BROADCAST)
-                    + addresses_bytes
+            addresses = [
+                (connection.address, int(connection.listening_port))
+                for connection in self.gossip.p2p_connections
+                if connection is not self
+            ]
+            sample_size = self.gossip.config.peer_exchange_sample
+            if 0 < sample_size < len(addresses):
+                addresses = random.sample(addresses, sample_size)
+
+            if len(addresses) == 0:
+                peer_log.debug(
+                    "No addresses known to send to %s:%s",
+                    self.address,
+                    self.listening_port,
                 )
+                return
 
-                print(
-                    f"[+][P2P] Sending PEER_BROADCAST to {self.address}:{self.listening_port}"
-                )
-                print(f"    [+] Addresses: {addresses}")
-                self.writer.write(peer_broadcast_msg)
-                await self.writer.drain()
+            peer_broadcast_msg = self.encode_broadcast(addresses)
+
+            peer_log.debug(
+                "Sending PEER_BROADCAST to %s:%s => %s",
+                self.address,
+                self.listening_port,
+                addresses,
+            )
+            self.send(peer_broadcast_msg)
 
         except Exception as e:
-            print(
-                f"[-][P2P] Error in handling PEER_DISCOVER from {self.address}:{self.listening_port}"
+            peer_log.warning(
+                "Error in handling PEER_DISCOVER from %s:%s",
+                self.address,
+                self.listening_port,
             )
             raise e
 
-    async def handle_peer_broadcast(self, msg):
-        print(f"[+][P2P] PEER_BROADCAST from {self.address}:{self.listening_port}")
+    async def handle_peer_broadcast(self, addresses):
+        """addresses is the decoded list of (host, port) of either version"""
+        peer_log.debug("PEER_BROADCAST from %s:%s", self.address, self.listening_port)
         try:
 
-            addresses = msg[4:].decode("utf-8").split(",")
-            print(f"    [+] Addresses: {addresses}")
+            # answer to our PEER_DISCOVER
+            self.stats.pong()
+
+            peer_log.debug("    Addresses: %s", addresses)
+            our_address, our_port = self.gossip.config.p2p_address.split(":")
             got_new_addresses = False
-            async with self.gossip.p2p_connections_lock:
-                async with self.gossip.unverified_p2p_connections_lock:
-                    for address in addresses:
-                        peer_address, peer_port = address.split(":")
-
-                        our_address, our_port = self.gossip.config.p2p_address.split(
-                            ":"
-                        )
-
-                        if peer_address == our_address and int(peer_port) == int(
-                            our_port
-                        ):
-                            continue
-
-                        connection_exists = False
-                        for connection in self.gossip.p2p_connections:
-                            if connection.address == peer_address and (
-                                int(connection.listening_port) == int(peer_port)
-                                or int(connection.port) == int(peer_port)
-                            ):
-                                connection_exists = True
-                                break
-                        if not connection_exists:
-                            for connection in self.gossip.unverified_p2p_connections:
-                                if connection.address == peer_address and (
-                                    int(connection.listening_port) == int(peer_port)
-                                    or int(connection.port) == int(peer_port)
-                                ):
-                                    connection_exists = True
-                                    break
-
-                        if not connection_exists:
-                            got_new_addresses = True
-                            print(
-                                f"[+][P2P] Initiating connection with {peer_address}:{peer_port}"
-                            )
-
-                            await initiate_connection_to_peer(
-                                peer_address, peer_port, self.gossip
-                            )
-
-                    if not got_new_addresses:
-                        print(
-                            f"[+][P2P] No new addresses to connect to from {self.address}:{self.listening_port}"
-                        )
+            # at most one address is dialed per broadcast, a full peer that is
+            # dialed hands over the connection it evicts for us (see hand_over),
+            # which takes the next slot. A broadcast we did not ask for is such a
+            # hand over, the connection may take us one above degree.
+            handed_over = not self.discovering
+            if handed_over:
+                can_dial = len(self.gossip.p2p_connections) <= self.gossip.config.degree
+            else:
+                self.discovering = False
+                can_dial = self.gossip.dialer.missing() > 0
+            for peer_address, peer_port in addresses:
+
+                if peer_address == our_address and int(peer_port) == int(our_port):
+                    continue
+
+                if self.gossip.peer_table is not None:
+                    self.gossip.peer_table.learn(peer_address, peer_port)
+
+                if not can_dial:
+                    continue
+
+                if not self.gossip.p2p_connections.has_endpoint(
+                    peer_address, peer_port
+                ):
+                    got_new_addresses = True
+
+                    # dialed in the background, an unreachable address does not
+                    # hold up this connection
+                    dial = self.gossip.dialer.dial(peer_address, peer_port, handed_over)
+                    if dial is not None:
+                        can_dial = False
+
+            if not got_new_addresses:
+                peer_log.debug(
+                    "No new addresses to connect to from %s:%s",
+                    self.address,
+                    self.listening_port,
+                )
 
         except Exception as e:
-            print(
-                f"[-][P2P] Error in handling PEER_BROADCAST from {self.address}:{self.listening_port}"
+            peer_log.warning(
+                "Error in handling PEER_BROADCAST from %s:%s",
+                self.address,
+                self.listening_port,
             )
             raise e
-
-
-async def initiate_connection_to_peer(peer_address, peer_port, gossip):
-    try:
-
-        print(f"[+][P2P] Initiating p2p connection with {peer_address}:{peer_port}")
-        reader, writer = await asyncio.open_connection(peer_address, peer_port)
-
-        connection = P2PConnection(gossip, reader, writer, peer_port)
-
-        gossip.unverified_p2p_connections.append(connection)
-
-        asyncio.create_task(connection.run())
-
-    except Exception as e:
-        print(
-            f"[-][P2P] Error in initiating connection with {peer_address}:{peer_port}: {e}"
-        )
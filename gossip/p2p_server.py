@@ -1,8 +1,10 @@
 import asyncio
-import struct
+import random
 
-from gossip.p2p_connection import P2PConnection, initiate_connection_to_peer
-from gossip.messages_type import PEER_DISCOVER
+from gossip.codec import encode_peer_discover
+from gossip.log import P2P as log, PEER as peer_log
+from gossip.p2p_connection import P2PConnection
+from gossip.sockets import start_server, tune_connection
 
 
 class P2PServer:
@@ -17,74 +19,147 @@ class P2PServer:
     async def run(self):
         asyncio.create_task(self.start_server())
 
-        async with self.gossip.unverified_p2p_connections_lock:
-            await initiate_connection_to_peer(
-                self.bootstrapper_host, self.bootstrapper_port, self.gossip
+        # after a restart the known peers are dialed together with the bootstrapper,
+        # which reaches full degree without waiting for discovery rounds
+        known_peers = []
+        peer_table = self.gossip.peer_table
+        if peer_table is not None:
+            known_peers = peer_table.select(
+                self.gossip.config.degree,
+                exclude=(
+                    self.gossip.config.p2p_address,
+                    self.gossip.config.bootstrapper,
+                ),
             )
+            if known_peers:
+                peer_log.info("Dialing %s known peers", len(known_peers))
+
+        addresses = [(self.bootstrapper_host, self.bootstrapper_port), *known_peers]
+        # a peer keeps one connection to our address, only the first worker of a
+        # multi-process node dials the bootstrapper
+        if self.gossip.cluster is not None and self.gossip.cluster.index != 0:
+            addresses = known_peers
+        await self.gossip.dialer.dial_all(addresses)
 
         asyncio.create_task(self.peer_discovery())
 
+        if self.gossip.config.anti_entropy_interval > 0:
+            asyncio.create_task(self.anti_entropy())
+
     async def on_connection(self, reader, writer):
+        tune_connection(writer, self.gossip.config)
         connection = P2PConnection(self.gossip, reader, writer, None)
 
-        async with self.gossip.unverified_p2p_connections_lock:
-            self.gossip.unverified_p2p_connections.append(connection)
+        if not self.gossip.p2p_connections.add_unverified(connection):
+            log.info(
+                "Too many unverified connections, dropping %s:%s",
+                connection.address,
+                connection.port,
+            )
+            writer.close()
+            return
 
         asyncio.create_task(connection.run())
 
     async def start_server(self):
         try:
-            server = await asyncio.start_server(
-                self.on_connection, self.host, self.port
+            server = await start_server(
+                self.on_connection, self.host, self.port, self.gossip.config
             )
-            print(f">>>> P2P Server started, listening on {self.host}:{self.port} <<<<")
+            log.info("P2P Server started, listening on %s:%s", self.host, self.port)
 
             async with server:
                 await server.serve_forever()
         except Exception as e:
-            print(
-                f"[-][P2P] Error in starting P2P server on {self.host}:{self.port}: {e}"
+            log.error(
+                "Error in starting P2P server on %s:%s: %s", self.host, self.port, e
             )
 
     async def peer_discovery(self):
 
-        peer_discover_msg = struct.pack(">HH", 4, PEER_DISCOVER)
-
-        async def send_peer_discover(connection):
-            try:
-                print(
-                    f"[+][P2P] Sending PEER_DISCOVER to {connection.address}:{connection.listening_port}"
-                )
-                connection.writer.write(peer_discover_msg)
-                await connection.writer.drain()
-            except Exception as e:
-                print(
-                    f"[-][P2P] Error in sending PEER_DISCOVER to {connection.address}:{connection.listening_port}: {e}"
-                )
+        peer_discover_msg = encode_peer_discover()
+        previous = 0
 
         while True:
 
-            async with self.gossip.p2p_connections_lock:
-                if (
-                    len(self.gossip.p2p_connections)
-                    < self.gossip.p2p_connections.maxlen
+            missing = self.gossip.dialer.missing()
+            if missing > 0:
+                # a full peer evicts one of its connections when we connect to it and
+                # hands it over to us (see P2PConnection.hand_over), so every dial
+                # may bring two connections
+                connections = self.gossip.p2p_connections.connections()
+                dials = missing // 2 if connections else max(missing // 2, 1)
+                dials -= self.redial(dials, stalled=missing >= previous)
+
+                peer_log.debug("Discovering peers")
+                # every answer is one dial, see P2PConnection.handle_peer_broadcast
+                for connection in random.sample(
+                    connections, min(len(connections), dials)
                 ):
-                    print("====================================")
-                    print(f"[+][P2P] Discovering peers")
-                    tasks = []
-                    for connection in self.gossip.p2p_connections:
-                        tasks.append(
-                            asyncio.create_task(send_peer_discover(connection))
-                        )
-                    await asyncio.gather(*tasks)
-
-            async with self.gossip.unverified_p2p_connections_lock:
-                async with self.gossip.p2p_connections_lock:
-                    print(
-                        f"current connections {[f'{c.address}:{c.listening_port}' for c in self.gossip.p2p_connections]}"
-                    )
-                    print(
-                        f"current unverified connections: {[f'{c.address}:{c.port}' for c in self.gossip.unverified_p2p_connections]}"
+                    peer_log.debug(
+                        "Sending PEER_DISCOVER to %s:%s",
+                        connection.address,
+                        connection.listening_port,
                     )
-            print("====================================")
+                    connection.stats.ping()
+                    connection.discovering = True
+                    connection.send(peer_discover_msg)
+
+            peer_log.info(
+                "current connections (send queue depth): %s",
+                [
+                    f"{c.address}:{c.listening_port} ({c.send_queue.depth})"
+                    for c in self.gossip.p2p_connections
+                ],
+            )
+            peer_log.info(
+                "current unverified connections: %s",
+                [
+                    f"{c.address}:{c.port}"
+                    for c in self.gossip.p2p_connections.unverified_connections()
+                ],
+            )
+            if self.gossip.peer_table is not None:
+                self.gossip.peer_table.save()
+            previous = missing
             await asyncio.sleep(self.gossip.config.discovery_cooldown)
+
+    def redial(self, dials, stalled):
+        """discovery only reaches peers through the connections there are. Below
+        degree up to `dials` known peers are dialed again, and the bootstrapper too
+        if there are no connections or the last round of discovery found nobody.
+        The backoff of the dialer limits how often an address that keeps failing is
+        tried. Returns the number of dials started."""
+        gossip = self.gossip
+        config = gossip.config
+        connections = gossip.p2p_connections
+
+        addresses = []
+        if gossip.peer_table is not None:
+            addresses = gossip.peer_table.select(
+                dials, exclude=(config.p2p_address, config.bootstrapper)
+            )
+        # like at startup, only the first worker of a multi-process node dials it
+        if (
+            (stalled or not connections)
+            and config.bootstrapper != config.p2p_address
+            and (gossip.cluster is None or gossip.cluster.index == 0)
+        ):
+            addresses.append((self.bootstrapper_host, int(self.bootstrapper_port)))
+
+        started = 0
+        for host, port in addresses:
+            if started == dials:
+                break
+            if connections.has_endpoint(host, port):
+                continue
+            peer_log.debug("Dialing %s:%s again", host, port)
+            if gossip.dialer.dial(host, port) is not None:
+                started += 1
+        return started
+
+    async def anti_entropy(self):
+
+        while True:
+            await asyncio.sleep(self.gossip.config.anti_entropy_interval)
+            self.gossip.anti_entropy.exchange()
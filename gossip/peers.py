@@ -0,0 +1,149 @@
+"""Persistent table of known peers, used to reconnect quickly after a restart"""
+
+import ipaddress
+import json
+import os
+import time
+
+from gossip.log import PEER as log
+
+
+def network_of(host):
+    """the /16 of an IPv4 address or /32 of an IPv6 address, peers in the same
+    network are likely run by the same operator"""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    prefix = 16 if ip.version == 4 else 32
+    return str(ipaddress.ip_network(f"{host}/{prefix}", strict=False))
+
+
+def is_valid_peer(address, peer):
+    """an entry of a loaded table: "host:port" and the fields written by save"""
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit() or not isinstance(peer, dict):
+        return False
+    return (
+        isinstance(peer.get("last_seen"), (int, float, type(None)))
+        and isinstance(peer.get("latency"), (int, float, type(None)))
+        and type(peer.get("failures")) is int
+        and peer["failures"] >= 0
+    )
+
+
+class PeerTable:
+    """Peer addresses learned from PEER_BROADCAST or connections, with the time of
+    their last handshake, its latency and the number of failed connection attempts
+    since then. Saved as JSON to `path` and loaded from it."""
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        # key: "host:port", value: {"last_seen", "latency", "failures"}
+        self.peers = {}
+        self.dirty = False
+
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    peers = json.load(f)
+                if not isinstance(peers, dict):
+                    raise ValueError("not a JSON object")
+                self.peers = {
+                    address: peer
+                    for address, peer in peers.items()
+                    if is_valid_peer(address, peer)
+                }
+                if len(self.peers) < len(peers):
+                    log.warning(
+                        "Ignored %s invalid entries of peer table %s",
+                        len(peers) - len(self.peers),
+                        path,
+                    )
+                log.info("Loaded %s peers from %s", len(self.peers), path)
+            except (OSError, ValueError) as e:
+                log.warning("Could not load peer table %s: %s", path, e)
+
+    def __len__(self):
+        return len(self.peers)
+
+    def learn(self, host, port):
+        """an address received in a PEER_BROADCAST, it is not seen until a handshake
+        with it completed"""
+        address = f"{host}:{port}"
+        if address not in self.peers:
+            self.peers[address] = {"last_seen": None, "latency": None, "failures": 0}
+            self.dirty = True
+
+    def connected(self, host, port, latency):
+        """a handshake with the peer completed after `latency` seconds"""
+        self.peers[f"{host}:{port}"] = {
+            "last_seen": time.time(),
+            "latency": latency,
+            "failures": 0,
+        }
+        self.dirty = True
+
+    def failed(self, host, port):
+        peer = self.peers.get(f"{host}:{port}")
+        if peer is not None:
+            peer["failures"] += 1
+            self.dirty = True
+
+    def select(self, count, exclude=()):
+        """up to `count` (host, port) of the best known peers, taken round-robin from
+        their networks so the connections do not all end up in one network"""
+
+        def score(item):
+            _, peer = item
+            latency = peer["latency"]
+            return (
+                peer["failures"],
+                latency is None,
+                -(peer["last_seen"] or 0),
+                latency or 0,
+            )
+
+        # key: network, value: addresses ordered from best to worst
+        networks = {}
+        for address, _ in sorted(self.peers.items(), key=score):
+            if address in exclude:
+                continue
+            host, port = address.rsplit(":", 1)
+            networks.setdefault(network_of(host), []).append((host, int(port)))
+
+        selected = []
+        while len(selected) < count and networks:
+            for network in list(networks):
+                selected.append(networks[network].pop(0))
+                if not networks[network]:
+                    del networks[network]
+                if len(selected) == count:
+                    break
+        return selected
+
+    def save(self):
+        """write the table if it changed, keeping the `max_size` best peers"""
+        if not self.dirty:
+            return
+        if len(self.peers) > self.max_size:
+            ranked = sorted(
+                self.peers.items(),
+                key=lambda item: (item[1]["failures"], -(item[1]["last_seen"] or 0)),
+            )
+            self.peers = dict(ranked[: self.max_size])
+        try:
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.peers, f)
+            os.replace(self.path + ".tmp", self.path)
+            self.dirty = False
+        except OSError as e:
+            log.warning("Could not save peer table %s: %s", self.path, e)
+
+
+def create_peer_table(config):
+    """PeerTable in peer_table_path, None if it is disabled"""
+    if not config.peer_table_path:
+        return None
+    return PeerTable(config.peer_table_path, config.peer_table_size)
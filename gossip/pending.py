@@ -0,0 +1,245 @@
+"""Store of received PEER_ANNOUNCE messages that wait for GOSSIP_VALIDATION from the
+local subscribers before they are forwarded to other peers"""
+
+import asyncio
+from collections import deque
+
+from gossip.log import P2P as log
+
+# message ids are 16 bit, 0 is used for notifications that are not awaiting validation
+MAX_MESSAGE_ID = 2**16 - 1
+
+
+class MessageIdAllocator:
+    """Hands out message ids 1..MAX_MESSAGE_ID in O(1). Ids that were never used are
+    given out first, released ids are reused in the order they were released so an
+    id is reused as late as possible"""
+
+    def __init__(self):
+        self.next_id = 1
+        self.released = deque()
+
+    def allocate(self):
+        """returns a free id, or None if all ids are in use"""
+        if self.next_id <= MAX_MESSAGE_ID:
+            message_id = self.next_id
+            self.next_id += 1
+            return message_id
+        if self.released:
+            return self.released.popleft()
+        return None
+
+    def release(self, message_id):
+        self.released.append(message_id)
+
+
+class TimerWheel:
+    """Hashed timer wheel, keys are put in the slot of the tick their deadline falls
+    in and `advance` only looks at the slots of the ticks that passed since its last
+    call. Deadlines more than `slots` ticks away stay in their slot until their round
+    comes."""
+
+    def __init__(self, tick, slots):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.last_tick = None
+
+    def slot_of(self, deadline):
+        return int(deadline // self.tick) % len(self.slots)
+
+    def schedule(self, key, deadline):
+        self.slots[self.slot_of(deadline)][key] = deadline
+
+    def cancel(self, key, deadline):
+        self.slots[self.slot_of(deadline)].pop(key, None)
+
+    def advance(self, now):
+        """returns the keys whose deadline is not after `now`"""
+        now_tick = int(now // self.tick)
+        if self.last_tick is None:
+            self.last_tick = now_tick - 1
+        ticks = min(now_tick - self.last_tick, len(self.slots))
+        self.last_tick = now_tick
+
+        expired = []
+        for tick in range(now_tick - ticks + 1, now_tick + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, deadline in slot.items() if deadline <= now]
+            for key in due:
+                del slot[key]
+            expired.extend(due)
+        return expired
+
+
+class PendingAnnounce:
+    """A PEER_ANNOUNCE waiting for the validation of `validators`"""
+
+    __slots__ = (
+        "message_id",
+        "ttl",
+        "data_type",
+        "data",
+        "sender",
+        "validators",
+        "deadline",
+        "digest",
+        "approved",
+    )
+
+    def __init__(
+        self, message_id, ttl, data_type, data, sender, validators, deadline, digest
+    ):
+        self.message_id = message_id
+        self.ttl = ttl
+        self.data_type = data_type
+        self.data = data
+        self.sender = sender
+        self.validators = validators
+        self.deadline = deadline
+        self.digest = digest
+        # True once a validator found it valid
+        self.approved = False
+
+
+class PendingValidations:
+    """Announces awaiting validation keyed by message id. An announce that is not
+    validated by all its validators within `timeout` seconds is dropped without being
+    forwarded. At most `max_entries` announces holding `max_bytes` bytes of payload
+    are kept, the oldest ones are dropped to make room for new ones."""
+
+    def __init__(self, timeout, max_entries, max_bytes, tick=1.0):
+        self.timeout = timeout
+        self.max_entries = min(max_entries, MAX_MESSAGE_ID)
+        self.max_bytes = max_bytes
+
+        # insertion ordered, so the first entry is the oldest
+        self.entries = {}
+        # key: validator connection, value: set of message ids it has to validate
+        self.by_validator = {}
+        self.ids = MessageIdAllocator()
+        self.wheel = TimerWheel(tick, int(timeout // tick) + 2)
+        self.tick = tick
+        self.size_bytes = 0
+
+        self.added = 0
+        self.validated = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, message_id):
+        return message_id in self.entries
+
+    def get(self, message_id):
+        return self.entries.get(message_id)
+
+    def add(self, ttl, data_type, data, sender, validators, digest):
+        """store an announce and return its message id"""
+        while self.entries and (
+            len(self.entries) >= self.max_entries
+            or self.size_bytes + len(data) > self.max_bytes
+        ):
+            oldest = self.pop(next(iter(self.entries)))
+            self.evicted += 1
+            log.warning(
+                "Too many announces awaiting validation, dropping message %s",
+                oldest.message_id,
+            )
+
+        message_id = self.ids.allocate()
+        deadline = asyncio.get_running_loop().time() + self.timeout
+        entry = PendingAnnounce(
+            message_id, ttl, data_type, data, sender, set(validators), deadline, digest
+        )
+        self.entries[message_id] = entry
+        for validator in entry.validators:
+            self.by_validator.setdefault(validator, set()).add(message_id)
+        self.wheel.schedule(message_id, deadline)
+        self.size_bytes += len(data)
+        self.added += 1
+        return message_id
+
+    def pop(self, message_id):
+        """remove an announce and return it, None if there is no such announce"""
+        entry = self.entries.pop(message_id, None)
+        if entry is None:
+            return None
+        for validator in entry.validators:
+            self.discard_id(validator, message_id)
+        self.wheel.cancel(message_id, entry.deadline)
+        self.ids.release(message_id)
+        self.size_bytes -= len(entry.data)
+        return entry
+
+    def discard_id(self, validator, message_id):
+        message_ids = self.by_validator.get(validator)
+        if message_ids is not None:
+            message_ids.discard(message_id)
+            if not message_ids:
+                del self.by_validator[validator]
+
+    def validate(self, message_id, validator):
+        """mark an announce as validated by `validator`, returns the announce once all
+        its validators validated it and removes it from the store"""
+        entry = self.entries[message_id]
+        entry.approved = True
+        entry.validators.discard(validator)
+        self.discard_id(validator, message_id)
+        if entry.validators:
+            return None
+        self.validated += 1
+        return self.pop(message_id)
+
+    def remove_validator(self, validator):
+        """forget a closed connection as validator. Announces that no longer wait
+        for any validator are removed from the store, returns the ones another
+        validator found valid and the ones nobody validated, which are dropped
+        like expired ones"""
+        completed = []
+        dropped = []
+        for message_id in self.by_validator.pop(validator, ()):
+            entry = self.entries[message_id]
+            entry.validators.discard(validator)
+            if entry.validators:
+                continue
+            self.pop(message_id)
+            if entry.approved:
+                self.validated += 1
+                completed.append(entry)
+            else:
+                self.expired += 1
+                dropped.append(entry)
+                log.info(
+                    "Message %s lost its validators before it was validated, dropping it",
+                    message_id,
+                )
+        return completed, dropped
+
+    def expire(self):
+        """drop the announces whose deadline passed"""
+        now = asyncio.get_running_loop().time()
+        for message_id in self.wheel.advance(now):
+            entry = self.pop(message_id)
+            if entry is not None:
+                self.expired += 1
+                log.info(
+                    "Message %s was not validated in time, dropping it", message_id
+                )
+
+    async def run(self):
+        """expire announces every tick"""
+        while True:
+            await asyncio.sleep(self.tick)
+            self.expire()
+
+    def stats(self):
+        return {
+            "pending": len(self.entries),
+            "bytes": self.size_bytes,
+            "added": self.added,
+            "validated": self.validated,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,142 @@
+"""Proof of work nonce search for PEER_INIT challenges, run off the event loop"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+NONCE_SPACE = 2**64
+
+
+def difficulty_target(difficulty_bits):
+    """Digests lower than the returned 32 bytes have `difficulty_bits` leading zero bits,
+    None means every digest is accepted"""
+    if difficulty_bits == 0:
+        return None
+    return (1 << (256 - difficulty_bits)).to_bytes(32, "big")
+
+
+def is_valid_nonce(challenge, nonce, listening_port, difficulty_bits):
+    """Check a nonce received in PEER_VERIFY against the 8 byte `challenge` we sent"""
+    target = difficulty_target(difficulty_bits)
+    if target is None:
+        return True
+    digest = hashlib.sha256(
+        challenge + nonce.to_bytes(8, "big") + listening_port.to_bytes(2, "big")
+    ).digest()
+    return digest < target
+
+
+def search_nonce_range(challenge, listening_port_bytes, difficulty_bits, start, end):
+    """Search nonces in [start, end) for a hash with `difficulty_bits` leading zero bits.
+    Runs inside a worker process, returns the nonce or None"""
+    target = difficulty_target(difficulty_bits)
+    if target is None:
+        return start if start < end else None
+
+    # the challenge is hashed once, each trial continues from a copy of that state
+    # and writes the nonce into the same suffix buffer
+    prefix = hashlib.sha256(challenge)
+    suffix = bytearray(8) + listening_port_bytes
+    pack_nonce = struct.Struct(">Q").pack_into
+    for trial in range(start, end):
+        pack_nonce(suffix, 0, trial)
+        hash = prefix.copy()
+        hash.update(suffix)
+        if hash.digest() < target:
+            return trial
+    return None
+
+
+class ProofOfWorkSolver:
+    """Splits the nonce space into chunks of `chunk_size` nonces and searches them
+    on a process pool of `workers` processes, keeping one chunk in flight per worker.
+    With `workers` set to 0 the chunks are searched on the event loop, yielding
+    to other tasks between chunks."""
+
+    def __init__(self, workers, chunk_size):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            # spawned workers do not inherit the listening sockets of the node
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self.executor
+
+    async def solve(self, challenge, listening_port, difficulty_bits, timeout):
+        """Find a nonce for the 8 byte `challenge`, raises asyncio.TimeoutError if
+        none is found within `timeout` seconds"""
+        listening_port_bytes = listening_port.to_bytes(2, "big")
+        chunks = (
+            (start, min(start + self.chunk_size, NONCE_SPACE))
+            for start in range(0, NONCE_SPACE, self.chunk_size)
+        )
+
+        if self.workers == 0:
+            return await asyncio.wait_for(
+                self.solve_inline(
+                    challenge, listening_port_bytes, difficulty_bits, chunks
+                ),
+                timeout,
+            )
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        executor = self.get_executor()
+        pending = set()
+
+        def submit_next_chunk():
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.add(
+                    loop.run_in_executor(
+                        executor,
+                        search_nonce_range,
+                        challenge,
+                        listening_port_bytes,
+                        difficulty_bits,
+                        *chunk,
+                    )
+                )
+
+        try:
+            for _ in range(self.workers):
+                submit_next_chunk()
+
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    nonce = future.result()
+                    if nonce is not None:
+                        return nonce
+                    submit_next_chunk()
+
+            return None
+        finally:
+            # chunks that have not started yet are dropped, running ones finish on their own
+            for future in pending:
+                future.cancel()
+
+    async def solve_inline(
+        self, challenge, listening_port_bytes, difficulty_bits, chunks
+    ):
+        for start, end in chunks:
+            nonce = search_nonce_range(
+                challenge, listening_port_bytes, difficulty_bits, start, end
+            )
+            if nonce is not None:
+                return nonce
+            await asyncio.sleep(0)
+        return None
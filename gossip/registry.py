@@ -0,0 +1,168 @@
+"""Copy-on-write containers for the connections and subscriptions shared by all handlers.
+
+Readers take the current snapshot (a tuple or a frozenset) and iterate it without
+any lock, even across awaits. Writers build a new snapshot and swap it in with a
+single assignment, which is atomic for all tasks of the event loop."""
+
+
+class SnapshotList:
+    """Ordered collection of connections"""
+
+    def __init__(self):
+        self.snapshot = ()
+
+    def __iter__(self):
+        return iter(self.snapshot)
+
+    def __len__(self):
+        return len(self.snapshot)
+
+    def __contains__(self, item):
+        return item in self.snapshot
+
+    def append(self, item):
+        self.snapshot = self.snapshot + (item,)
+
+    def remove(self, item):
+        """Remove an item if it is in the list"""
+        self.snapshot = tuple(other for other in self.snapshot if other is not item)
+
+
+class SubscriptionTable:
+    """Maps a data type to the frozenset of API connections subscribed to it"""
+
+    def __init__(self):
+        self.snapshot = {}
+
+    def __contains__(self, data_type):
+        return data_type in self.snapshot
+
+    def subscribers(self, data_type):
+        return self.snapshot.get(data_type, frozenset())
+
+    def subscribe(self, data_type, connection):
+        """Subscribe a connection to a data type, returns True if the data type is new"""
+        subscribers = self.snapshot.get(data_type)
+        if subscribers is not None and connection in subscribers:
+            return False
+        self.snapshot = {
+            **self.snapshot,
+            data_type: (subscribers or frozenset()) | {connection},
+        }
+        return subscribers is None
+
+    def unsubscribe_all(self, connection):
+        """Remove a connection from every data type, returns the data types it left"""
+        left = [
+            data_type
+            for data_type, subscribers in self.snapshot.items()
+            if connection in subscribers
+        ]
+        if left:
+            snapshot = dict(self.snapshot)
+            for data_type in left:
+                snapshot[data_type] = snapshot[data_type] - {connection}
+            self.snapshot = snapshot
+        return left
+
+
+def endpoint(address, listening_port):
+    return address, int(listening_port)
+
+
+class ConnectionRegistry:
+    """P2P connections indexed by state and by the endpoint (address, listening port)
+    of the peer. Iterating the registry yields the verified connections from a
+    snapshot tuple that is rebuilt on the first read after a change, lookups,
+    inserts and removals are dict operations.
+
+    Nothing is evicted: adding an unverified connection fails when there are
+    `max_unverified` of them, verifying one fails when there are `max_verified`
+    verified connections, plus the spare ones the caller allows, or one with the
+    same endpoint."""
+
+    def __init__(self, max_verified, max_unverified):
+        self.max_verified = max_verified
+        self.max_unverified = max_unverified
+
+        # key: endpoint, value: connection
+        self.verified = {}
+        # key: connection, value: its endpoint, None for incoming connections that
+        # did not tell their listening port yet
+        self.unverified = {}
+        # key: endpoint, value: unverified connection we dialed
+        self.dialed = {}
+
+        self.snapshot = None
+
+    def __iter__(self):
+        return iter(self.connections())
+
+    def __len__(self):
+        return len(self.verified)
+
+    def __contains__(self, connection):
+        if connection.listening_port is None:
+            return False
+        key = endpoint(connection.address, connection.listening_port)
+        return self.verified.get(key) is connection
+
+    def connections(self):
+        """snapshot of the verified connections"""
+        if self.snapshot is None:
+            self.snapshot = tuple(self.verified.values())
+        return self.snapshot
+
+    def unverified_connections(self):
+        return tuple(self.unverified)
+
+    def is_full(self):
+        return len(self.verified) >= self.max_verified
+
+    def get(self, address, listening_port):
+        """the verified connection to an endpoint, or None"""
+        return self.verified.get(endpoint(address, listening_port))
+
+    def has_endpoint(self, address, listening_port):
+        """whether there is a verified connection to the endpoint or one being dialed"""
+        key = endpoint(address, listening_port)
+        return key in self.verified or key in self.dialed
+
+    def add_unverified(self, connection):
+        """returns False if there are too many unverified connections"""
+        if len(self.unverified) >= self.max_unverified:
+            return False
+        key = None
+        if connection.listening_port is not None:
+            key = endpoint(connection.address, connection.listening_port)
+            self.dialed[key] = connection
+        self.unverified[connection] = key
+        return True
+
+    def verify(self, connection, spare=0):
+        """move a connection to the verified ones, returns False if there are
+        `max_verified` + `spare` verified connections or already one to its
+        endpoint"""
+        key = endpoint(connection.address, connection.listening_port)
+        if key in self.verified or len(self.verified) >= self.max_verified + spare:
+            return False
+        self.remove_unverified(connection)
+        self.verified[key] = connection
+        self.snapshot = None
+        return True
+
+    def remove_unverified(self, connection):
+        key = self.unverified.pop(connection, None)
+        if key is not None and self.dialed.get(key) is connection:
+            del self.dialed[key]
+
+    def remove(self, connection):
+        """remove a connection in any state, returns False if it was not registered"""
+        if connection in self.unverified:
+            self.remove_unverified(connection)
+            return True
+        if connection in self:
+            del self.verified[endpoint(connection.address, connection.listening_port)]
+            self.snapshot = None
+            return True
+        return False
@@ -0,0 +1,126 @@
+"""Bounded outbound message queue of a connection, written to the socket by its own task"""
+
+import asyncio
+from collections import deque
+
+from gossip.log import logger as log
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+
+class SendQueue:
+    """Messages are put into the queue without waiting, a writer task writes everything
+    queued with one writelines call and waits for the socket to drain before taking
+    the next batch. A slow connection therefore only fills its own queue. When the
+    queue holds `max_size` messages the `overflow_policy` decides whether the oldest
+    queued message is dropped, the new one is dropped, or the connection is closed
+    through `on_disconnect`. A batch of messages joined into one entry counts as the
+    number of messages it holds."""
+
+    def __init__(
+        self, name, writer, max_size, overflow_policy, on_disconnect, metrics=None
+    ):
+        self.name = name
+        self.writer = writer
+        self.max_size = max_size
+        self.overflow_policy = overflow_policy
+        self.on_disconnect = on_disconnect
+        # counts the written messages if set (see gossip.metrics)
+        self.metrics = metrics
+
+        self.messages = deque()
+        # number of messages in each entry of self.messages, and their sum
+        self.counts = deque()
+        self.size = 0
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+
+    @property
+    def depth(self):
+        return self.size
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    def put(self, message, count=1):
+        """Queue a message, either a bytes-like object or a tuple of them that are
+        written one after the other, `count` is the number of messages joined into
+        it. Returns False if the message was dropped"""
+        if self.closed:
+            return False
+
+        # a batch larger than the queue is only queued when the queue is empty
+        if self.messages and self.size + count > self.max_size:
+            if self.overflow_policy == DROP_NEWEST:
+                self.dropped += count
+                return False
+            if self.overflow_policy == DISCONNECT:
+                log.warning(
+                    "Send queue of %s is full (%s messages), disconnecting",
+                    self.name,
+                    self.max_size,
+                )
+                self.close()
+                asyncio.create_task(self.on_disconnect())
+                return False
+            while self.messages and self.size + count > self.max_size:
+                self.messages.popleft()
+                dropped = self.counts.popleft()
+                self.size -= dropped
+                self.dropped += dropped
+
+        self.messages.append(message)
+        self.counts.append(count)
+        self.size += count
+        self.wakeup.set()
+        return True
+
+    async def run(self):
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.messages:
+                    parts = []
+                    for message in self.messages:
+                        # messages with a payload are (header, payload) tuples
+                        if type(message) is tuple:
+                            parts.extend(message)
+                        else:
+                            parts.append(message)
+                    self.sent += self.size
+                    self.clear()
+                    if self.metrics is not None:
+                        self.metrics.sent(parts)
+                    self.writer.writelines(parts)
+                    await self.writer.drain()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.warning("Error in sending to %s: %s", self.name, e)
+            self.closed = True
+            self.clear()
+            await self.on_disconnect()
+
+    def clear(self):
+        self.messages.clear()
+        self.counts.clear()
+        self.size = 0
+
+    def close(self):
+        self.closed = True
+        self.clear()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def stats(self):
+        return {"depth": self.depth, "sent": self.sent, "dropped": self.dropped}
@@ -0,0 +1,371 @@
+"""Discrete-event simulation of many gossip nodes in one process.
+
+SimulatedLoop is an asyncio event loop with a virtual clock. Instead of waiting in
+select() it moves the clock to the next scheduled callback, so sleeps and timeouts
+take no real time and a run only depends on its seed. Its create_connection and
+create_server connect hosts over an in-memory Network instead of sockets, so the
+unchanged node code (asyncio.open_connection, asyncio.start_server, the
+P2PConnection and APIConnection handlers) runs between simulated hosts.
+
+Every write arrives at the other end after the latency of its connection, in order.
+Frames of the message types in LOSSY_TYPES are dropped with the configured loss
+rate, handshake and discovery messages always arrive since there is no
+retransmission for them in the protocol. A killed host loses its servers,
+connections and tasks at once, like a crashed process.
+
+Hosts are told apart by the current_host context variable. It is set when a node
+is started and inherited by every task the node creates, tasks are registered
+with the network under their host so they can be cancelled when it is killed."""
+
+import asyncio
+import contextvars
+import errno
+import random
+import selectors
+
+from gossip.framing import HEADER
+from gossip.messages_type import (
+    PEER_ANOUNCE,
+    PEER_DIGEST,
+    PEER_GRAFT,
+    PEER_IHAVE,
+    PEER_REQUEST,
+)
+
+# host the running code belongs to, None outside of simulated hosts
+current_host = contextvars.ContextVar("current_host", default=None)
+
+# messages that can be lost, the ones the dissemination and repair cope with
+LOSSY_TYPES = frozenset(
+    (PEER_ANOUNCE, PEER_IHAVE, PEER_GRAFT, PEER_DIGEST, PEER_REQUEST)
+)
+
+FIRST_EPHEMERAL_PORT = 32768
+EPHEMERAL_PORTS = 28232
+
+
+class VirtualSelector(selectors.SelectSelector):
+    """Selector that never waits, select() advances the clock of its loop by the
+    timeout instead. The loop only asks it with a timeout of 0 while callbacks are
+    ready, otherwise with the time until the next scheduled callback."""
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Simulation stalled, nothing is scheduled")
+        self.loop.clock += timeout
+        return []
+
+
+class SimulatedLoop(asyncio.SelectorEventLoop):
+    """Event loop with a virtual clock whose connections go over `network`"""
+
+    def __init__(self, network):
+        selector = VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.clock = 0.0
+        self.network = network
+        network.loop = self
+
+    def time(self):
+        return self.clock
+
+    def create_task(self, coro, *, name=None, context=None):
+        task = super().create_task(coro, name=name, context=context)
+        host = current_host.get() if context is None else context.get(current_host)
+        if host is not None:
+            self.network.add_task(host, task)
+        return task
+
+    async def create_connection(self, protocol_factory, host=None, port=None, **_):
+        return await self.network.connect(protocol_factory, host, int(port))
+
+    async def create_server(self, protocol_factory, host=None, port=None, **_):
+        return self.network.listen(protocol_factory, host, int(port))
+
+
+class SimulatedTransport(asyncio.Transport):
+    """One end of an in-memory connection, owned by `host`"""
+
+    def __init__(self, network, host, sockname, peername, latency, context):
+        super().__init__({"peername": peername, "sockname": sockname})
+        self.network = network
+        self.host = host
+        self.latency = latency
+        # context the callbacks of this end run in, so tasks they create belong
+        # to its host
+        self.context = context
+        self.peer = None
+        self.protocol = None
+        # data that arrived before the protocol was connected
+        self.pending = []
+        self.closing = False
+        self.lost = False
+        # arrival time of the last write, later writes arrive after it
+        self.last_arrival = 0.0
+
+    def connect(self, protocol):
+        self.protocol = protocol
+        protocol.connection_made(self)
+        for data in self.pending:
+            protocol.data_received(data)
+        self.pending = None
+        if self.lost:
+            protocol.connection_lost(None)
+
+    def get_protocol(self):
+        return self.protocol
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def is_closing(self):
+        return self.closing
+
+    def is_reading(self):
+        return not self.closing
+
+    def pause_reading(self):
+        pass
+
+    def resume_reading(self):
+        pass
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def get_write_buffer_limits(self):
+        return (0, 0)
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        pass
+
+    def can_write_eof(self):
+        return False
+
+    def write(self, data):
+        if not self.closing:
+            self.network.send(self, data)
+
+    def writelines(self, parts):
+        self.write(b"".join(parts))
+
+    def receive(self, data):
+        if self.closing:
+            return
+        if self.protocol is None:
+            self.pending.append(data)
+        else:
+            self.protocol.data_received(data)
+
+    def connection_lost(self):
+        if self.lost:
+            return
+        self.lost = True
+        self.closing = True
+        self.network.forget(self)
+        if self.protocol is not None:
+            self.protocol.connection_lost(None)
+
+    def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.network.close(self)
+
+    def abort(self):
+        self.close()
+
+
+class SimulatedServer(asyncio.AbstractServer):
+    """Listening address of a host, accepted connections are handed to the protocols
+    of `protocol_factory` in the context of the host"""
+
+    def __init__(self, network, protocol_factory, address, context):
+        self.network = network
+        self.protocol_factory = protocol_factory
+        self.address = address
+        self.context = context
+        self.closed = False
+        self.waiter = None
+
+    def get_loop(self):
+        return self.network.loop
+
+    @property
+    def sockets(self):
+        return ()
+
+    def is_serving(self):
+        return not self.closed
+
+    async def start_serving(self):
+        pass
+
+    async def serve_forever(self):
+        self.waiter = self.network.loop.create_future()
+        try:
+            await self.waiter
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.network.unlisten(self)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def wait_closed(self):
+        pass
+
+
+class Network:
+    """In-memory network between simulated hosts. A connection gets a one-way
+    latency of `latency` plus up to `jitter` seconds, connections within a host
+    have no latency. Frames in LOSSY_TYPES are dropped with probability `loss`."""
+
+    def __init__(self, seed=0, latency=0.05, jitter=0.0, loss=0.0):
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.loop = None
+
+        # key: (host, port), value: SimulatedServer
+        self.servers = {}
+        # key: host, value: dict of its open transports / its running tasks, dicts
+        # instead of sets so they are closed in a deterministic order
+        self.transports = {}
+        self.tasks = {}
+        # key: host, value: last ephemeral port used
+        self.ports = {}
+
+        # key: message type, value: frames delivered / dropped
+        self.delivered = {}
+        self.dropped = {}
+
+    def add_task(self, host, task):
+        tasks = self.tasks.get(host)
+        if tasks is None:
+            tasks = self.tasks[host] = {}
+        tasks[task] = None
+        task.add_done_callback(lambda task: tasks.pop(task, None))
+
+    def listen(self, protocol_factory, host, port):
+        if (host, port) in self.servers:
+            raise OSError(errno.EADDRINUSE, f"Address {host}:{port} already in use")
+        server = SimulatedServer(
+            self, protocol_factory, (host, port), contextvars.copy_context()
+        )
+        self.servers[(host, port)] = server
+        return server
+
+    def unlisten(self, server):
+        if self.servers.get(server.address) is server:
+            del self.servers[server.address]
+
+    def ephemeral_port(self, host):
+        port = self.ports.get(host, -1) + 1
+        self.ports[host] = port
+        return FIRST_EPHEMERAL_PORT + port % EPHEMERAL_PORTS
+
+    def add_transport(self, transport):
+        transports = self.transports.get(transport.host)
+        if transports is None:
+            transports = self.transports[transport.host] = {}
+        transports[transport] = None
+
+    def forget(self, transport):
+        transports = self.transports.get(transport.host)
+        if transports is not None:
+            transports.pop(transport, None)
+
+    async def connect(self, protocol_factory, host, port):
+        """open a connection from the current host, takes a round trip"""
+        local = current_host.get()
+        if local == host:
+            latency = 0.0
+        else:
+            latency = self.latency + self.random.uniform(0, self.jitter)
+
+        await asyncio.sleep(latency)
+        server = self.servers.get((host, port))
+        if server is None:
+            await asyncio.sleep(latency)
+            raise ConnectionRefusedError(
+                errno.ECONNREFUSED, f"Connection refused by {host}:{port}"
+            )
+
+        sockname = (local, self.ephemeral_port(local))
+        client = SimulatedTransport(
+            self, local, sockname, (host, port), latency, contextvars.copy_context()
+        )
+        accepted = SimulatedTransport(
+            self, host, (host, port), sockname, latency, server.context
+        )
+        client.peer = accepted
+        accepted.peer = client
+        self.add_transport(client)
+        self.add_transport(accepted)
+        server.context.run(accepted.connect, server.protocol_factory())
+
+        await asyncio.sleep(latency)
+        client.connect(protocol_factory())
+        return client, client.protocol
+
+    def send(self, transport, data):
+        """deliver the frames in `data` to the other end after the latency"""
+        peer = transport.peer
+        loss = self.loss
+        kept = None
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            size, msg_type = HEADER.unpack_from(data, offset)
+            if size < HEADER.size:
+                break
+            if loss and msg_type in LOSSY_TYPES and self.random.random() < loss:
+                self.dropped[msg_type] = self.dropped.get(msg_type, 0) + 1
+                if kept is None:
+                    kept = [data[:offset]]
+            else:
+                self.delivered[msg_type] = self.delivered.get(msg_type, 0) + 1
+                if kept is not None:
+                    kept.append(data[offset : offset + size])
+            offset += size
+        if kept is not None:
+            kept.append(data[offset:])
+            data = b"".join(kept)
+            if not data:
+                return
+        else:
+            data = bytes(data)
+
+        arrival = max(self.loop.time() + transport.latency, transport.last_arrival)
+        transport.last_arrival = arrival
+        self.loop.call_at(arrival, peer.receive, data, context=peer.context)
+
+    def close(self, transport):
+        """close our end now and the other one after the data in flight arrived"""
+        self.loop.call_soon(transport.connection_lost, context=transport.context)
+        peer = transport.peer
+        if peer is not None:
+            arrival = max(self.loop.time() + transport.latency, transport.last_arrival)
+            self.loop.call_at(arrival, peer.connection_lost, context=peer.context)
+
+    def kill(self, host):
+        """crash a host, its servers, connections and tasks are gone"""
+        for task in list(self.tasks.pop(host, ())):
+            task.cancel()
+        for server in [s for s in self.servers.values() if s.address[0] == host]:
+            server.close()
+        for transport in list(self.transports.pop(host, ())):
+            transport.close()
+
+    def stats(self):
+        return {"delivered": dict(self.delivered), "dropped": dict(self.dropped)}
@@ -0,0 +1,102 @@
+"""Event loop selection and the socket options of listeners and outbound connections"""
+
+import asyncio
+import socket
+
+from gossip.log import logger as log
+
+
+def install_event_loop(name):
+    """make asyncio.run use uvloop if `name` is "uvloop" and it is installed,
+    returns the name of the event loop that is used"""
+    if name != "uvloop":
+        return "asyncio"
+    try:
+        import uvloop
+    except ImportError:
+        log.warning("uvloop is not installed, using the asyncio event loop")
+        return "asyncio"
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    log.info("Using the uvloop event loop")
+    return "uvloop"
+
+
+def set_buffer_sizes(sock, config):
+    """socket_send_buffer and socket_receive_buffer, 0 leaves the OS default. They
+    have to be set before connecting or listening to be used for the TCP window,
+    accepted sockets inherit them from the listener"""
+    if config.socket_send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, config.socket_send_buffer)
+    if config.socket_receive_buffer:
+        sock.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, config.socket_receive_buffer
+        )
+
+
+def tune_connection(writer, config):
+    """set the options of an established connection"""
+    sock = writer.get_extra_info("socket")
+    # simulated connections have no socket
+    if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    try:
+        sock.setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if config.tcp_nodelay else 0
+        )
+    except OSError as e:
+        log.debug("Could not set TCP_NODELAY: %s", e)
+
+
+async def start_server(client_connected_cb, host, port, config):
+    """asyncio.start_server with the listen backlog, SO_REUSEPORT and buffer sizes
+    of the config"""
+    if not (config.socket_send_buffer or config.socket_receive_buffer):
+        return await asyncio.start_server(
+            client_connected_cb,
+            host,
+            port,
+            backlog=config.listen_backlog,
+            reuse_port=config.reuse_port or None,
+        )
+
+    # the buffer sizes have to be set before listen(), which start_server calls
+    loop = asyncio.get_running_loop()
+    infos = await loop.getaddrinfo(
+        host, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )
+    family, sock_type, proto, _, address = infos[0]
+    sock = socket.socket(family, sock_type, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if config.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        set_buffer_sizes(sock, config)
+        sock.bind(address)
+        sock.setblocking(False)
+    except BaseException:
+        sock.close()
+        raise
+    return await asyncio.start_server(
+        client_connected_cb, sock=sock, backlog=config.listen_backlog
+    )
+
+
+async def open_connection(host, port, config):
+    """asyncio.open_connection with the socket options of the config"""
+    if not (config.socket_send_buffer or config.socket_receive_buffer):
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        family, sock_type, proto, _, address = infos[0]
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            sock.setblocking(False)
+            set_buffer_sizes(sock, config)
+            await loop.sock_connect(sock, address)
+        except BaseException:
+            sock.close()
+            raise
+        reader, writer = await asyncio.open_connection(sock=sock)
+    tune_connection(writer, config)
+    return reader, writer
@@ -0,0 +1,281 @@
+"""Optional on-disk store of recent announces, so a restarted node still knows which
+messages it already handled.
+
+The store is a directory of append-only segment files. Every record holds the
+digest of an announce and, for announces we forwarded, its payload. The active
+segment is preallocated and memory-mapped, records are copied into the mapping and
+written back by the OS. A segment is rolled once it is full or older than
+store_segment_age seconds. Only the newest store_max_segments segments keep their
+payloads, older ones are compacted in a worker thread into digest-only files, and
+compacted files are deleted once they hold more digests than the cache can take.
+
+At startup the digests are fed to the seen cache oldest first. Records are walked
+through the mappings reading only their headers, payloads are never read into
+memory."""
+
+import asyncio
+import mmap
+import os
+import struct
+import time
+
+from gossip.log import logger as log
+
+# kind, ttl, data type, payload length, unix time, digest
+RECORD = struct.Struct(">BBHHI20s")
+
+# an unused part of a preallocated segment starts with kind 0
+END = 0
+DIGEST = 1
+PAYLOAD = 2
+
+SEGMENT_SUFFIX = ".seg"
+COMPACTED_SUFFIX = ".dig"
+
+
+class Segment:
+    """A memory-mapped segment file, `writable` segments are preallocated to `size`
+    bytes and appended to"""
+
+    def __init__(self, path, size=None, writable=False):
+        self.path = path
+        self.writable = writable
+
+        mode = "r+b" if writable else "rb"
+        if writable and not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.truncate(size)
+        with open(path, mode) as f:
+            self.map = mmap.mmap(
+                f.fileno(),
+                0,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ,
+            )
+
+        # key: digest, value: offset of the record holding its payload
+        self.payloads = {}
+        self.created = None
+        self.position = 0
+        for offset, kind, _, _, _, timestamp, digest in self.records():
+            if self.created is None:
+                self.created = timestamp
+            if kind == PAYLOAD:
+                self.payloads[digest] = offset
+        if self.created is None:
+            self.created = int(time.time())
+
+    def records(self):
+        """yields (offset, kind, ttl, data_type, length, timestamp, digest) and leaves
+        `position` at the end of the last record"""
+        offset = 0
+        size = len(self.map)
+        while offset + RECORD.size <= size:
+            record = RECORD.unpack_from(self.map, offset)
+            if record[0] == END:
+                break
+            yield (offset, *record)
+            offset += RECORD.size + record[3]
+        self.position = offset
+
+    def append(self, kind, ttl, data_type, digest, data=b""):
+        """returns False if the record does not fit"""
+        end = self.position + RECORD.size + len(data)
+        if end > len(self.map):
+            return False
+        RECORD.pack_into(
+            self.map,
+            self.position,
+            kind,
+            ttl,
+            data_type,
+            len(data),
+            int(time.time()),
+            digest,
+        )
+        self.map[self.position + RECORD.size : end] = data
+        if kind == PAYLOAD:
+            self.payloads[digest] = self.position
+        self.position = end
+        return True
+
+    def read(self, offset):
+        """returns (ttl, data_type, data) of the record at `offset`"""
+        _, ttl, data_type, length, _, _ = RECORD.unpack_from(self.map, offset)
+        start = offset + RECORD.size
+        return ttl, data_type, self.map[start : start + length]
+
+    def close(self):
+        if self.writable:
+            self.map.flush()
+        self.map.close()
+
+
+def compact(paths, directory, max_digests):
+    """rewrite segments into digest-only files and delete the oldest digest-only
+    files that hold more than `max_digests` digests in total, runs in a thread"""
+    for path in paths:
+        segment = Segment(path)
+        records = [
+            RECORD.pack(DIGEST, ttl, data_type, 0, timestamp, digest)
+            for _, _, ttl, data_type, _, timestamp, digest in segment.records()
+        ]
+        segment.close()
+        if records:
+            compacted = path[: -len(SEGMENT_SUFFIX)] + COMPACTED_SUFFIX
+            with open(compacted + ".tmp", "wb") as f:
+                f.write(b"".join(records))
+            os.replace(compacted + ".tmp", compacted)
+        os.remove(path)
+
+    compacted_files = sorted(
+        name for name in os.listdir(directory) if name.endswith(COMPACTED_SUFFIX)
+    )
+    digests = 0
+    for name in reversed(compacted_files):
+        path = os.path.join(directory, name)
+        digests += os.path.getsize(path) // RECORD.size
+        if digests > max_digests:
+            os.remove(path)
+
+
+class MessageStore:
+
+    def __init__(self, directory, segment_size, segment_age, max_segments, max_digests):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segment_age = segment_age
+        self.max_segments = max_segments
+        self.max_digests = max_digests
+
+        os.makedirs(directory, exist_ok=True)
+        names = []
+        for name in sorted(os.listdir(directory)):
+            if not (name.endswith(SEGMENT_SUFFIX) or name.endswith(COMPACTED_SUFFIX)):
+                continue
+            path = os.path.join(directory, name)
+            # a crash before a new segment was preallocated leaves an empty file,
+            # which cannot be mapped
+            if os.path.getsize(path) == 0:
+                log.warning("Removing empty store file %s", path)
+                os.remove(path)
+                continue
+            names.append(name)
+        self.compacted = [
+            os.path.join(directory, name)
+            for name in names
+            if name.endswith(COMPACTED_SUFFIX)
+        ]
+        segment_names = [name for name in names if name.endswith(SEGMENT_SUFFIX)]
+        self.next_index = int(names[-1].split(".")[0]) + 1 if names else 0
+
+        # oldest first, the last one is the active segment that is appended to
+        self.segments = [
+            Segment(
+                os.path.join(directory, name),
+                writable=i == len(segment_names) - 1,
+            )
+            for i, name in enumerate(segment_names)
+        ]
+        if not self.segments:
+            self.segments.append(self.new_segment())
+
+        self.compaction = None
+        self.appended = 0
+        self.rolls = 0
+
+    def new_segment(self):
+        path = os.path.join(self.directory, f"{self.next_index:010d}{SEGMENT_SUFFIX}")
+        self.next_index += 1
+        return Segment(path, self.segment_size, writable=True)
+
+    def load_digests(self, cache):
+        """add all stored digests to the seen cache, oldest first"""
+        # reloaded digests are neither hits nor misses of the announces we receive
+        hits, misses = cache.hits, cache.misses
+        count = 0
+        for path in self.compacted:
+            segment = Segment(path)
+            for record in segment.records():
+                cache.check_and_add(record[6])
+                count += 1
+            segment.close()
+        for segment in self.segments:
+            for record in segment.records():
+                cache.check_and_add(record[6])
+                count += 1
+        cache.hits, cache.misses = hits, misses
+        log.info("Loaded %s message digests from %s", count, self.directory)
+
+    def append(self, kind, ttl, data_type, digest, data=b""):
+        active = self.segments[-1]
+        if time.time() - active.created > self.segment_age or not active.append(
+            kind, ttl, data_type, digest, data
+        ):
+            self.roll()
+            self.segments[-1].append(kind, ttl, data_type, digest, data)
+        self.appended += 1
+
+    def add_digest(self, digest):
+        """remember an announce that was seen but not forwarded (yet)"""
+        self.append(DIGEST, 0, 0, digest)
+
+    def add_payload(self, digest, ttl, data_type, data):
+        self.append(PAYLOAD, ttl, data_type, digest, data)
+
+    def get(self, digest):
+        """returns (ttl, data_type, data) of a stored announce, None if its payload
+        is not stored"""
+        for segment in reversed(self.segments):
+            offset = segment.payloads.get(digest)
+            if offset is not None:
+                ttl, data_type, data = segment.read(offset)
+                return ttl, data_type, bytes(data)
+        return None
+
+    def roll(self):
+        """start a new segment and compact the segments beyond max_segments"""
+        active = self.segments.pop()
+        active.close()
+        self.segments.append(Segment(active.path))
+        self.segments.append(self.new_segment())
+        self.rolls += 1
+
+        if len(self.segments) <= self.max_segments:
+            return
+        if self.compaction is not None and not self.compaction.done():
+            return
+        old = self.segments[: -self.max_segments]
+        del self.segments[: -self.max_segments]
+        for segment in old:
+            segment.close()
+        self.compaction = asyncio.get_running_loop().run_in_executor(
+            None,
+            compact,
+            [segment.path for segment in old],
+            self.directory,
+            self.max_digests,
+        )
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def stats(self):
+        return {
+            "segments": len(self.segments),
+            "appended": self.appended,
+            "rolls": self.rolls,
+        }
+
+
+def create_store(config):
+    """MessageStore in store_path, None if the store is disabled"""
+    if not config.store_path:
+        return None
+    return MessageStore(
+        config.store_path,
+        config.store_segment_size,
+        config.store_segment_age,
+        config.store_max_segments,
+        config.cache_size,
+    )
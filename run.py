@@ -3,14 +3,16 @@
 from argparse import ArgumentParser
 import asyncio
 import os
+from gossip.cluster import run_cluster
+from gossip.config import Config
 from gossip.gossip import Gossip
+from gossip.log import logger as log, setup_logging
+from gossip.sockets import install_event_loop
 
 
-async def main():
-    """Main entry point for the whole application."""
-    print("program started")
-    # Parse command-line arguments
-
+def read_config():
+    """Read the config file given in the conf environment variable or on the
+    command line"""
     config_file_path = "config.ini"
     env_config_file_path = os.getenv("conf")
     if env_config_file_path is not None:
@@ -28,8 +30,22 @@ async def main():
 
         config_file_path = args.config
 
-    await Gossip(config_file_path).run()
+    return Config(config_file_path)
+
+
+async def main(config):
+    """Main entry point for the whole application."""
+    await Gossip(config).run()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    setup_logging()
+    log.info("program started")
+    # Parse command-line arguments
+    config = read_config()
+    # the event loop has to be chosen before it is started
+    install_event_loop(config.event_loop)
+    if config.workers > 1:
+        run_cluster(config)
+    else:
+        asyncio.run(main(config))